@@ -0,0 +1,74 @@
+"""Minimum-cost assignment (the Hungarian algorithm)."""
+
+
+def min_cost_assignment(cost):
+    """Match rows to columns of a cost matrix at the least total cost.
+
+    The matrix may have more columns than rows, but not fewer; columns left
+    over are left unmatched. Return a list mapping each row to the column
+    it's matched with. This is
+    the O(n^3) shortest augmenting path form of the Hungarian algorithm: rows
+    are added one at a time, and each is matched by finding a cheapest path to
+    a free column, using row and column potentials to keep reduced costs
+    nonnegative.
+    """
+    n = len(cost)
+    m = len(cost[0]) if n else 0
+    if n > m:
+        raise ValueError("Can't match {} rows to {} columns".format(n, m))
+    inf = float("inf")
+
+    # Potentials of rows and columns, 1-indexed; index 0 is a sentinel.
+    row_pot = [0] * (n + 1)
+    col_pot = [0] * (m + 1)
+
+    # col_match[j] is the row matched to column j, or 0 if it's free.
+    col_match = [0] * (m + 1)
+
+    for i in range(1, n + 1):
+        col_match[0] = i
+        j0 = 0
+        min_slack = [inf] * (m + 1)
+        prev_col = [0] * (m + 1)
+        used = [False] * (m + 1)
+
+        # Grow a tree of tight edges from row i until it reaches a free
+        # column.
+        while True:
+            used[j0] = True
+            i0 = col_match[j0]
+            delta = inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if used[j]:
+                    continue
+                slack = cost[i0 - 1][j - 1] - row_pot[i0] - col_pot[j]
+                if slack < min_slack[j]:
+                    min_slack[j] = slack
+                    prev_col[j] = j0
+                if min_slack[j] < delta:
+                    delta = min_slack[j]
+                    j1 = j
+
+            for j in range(m + 1):
+                if used[j]:
+                    row_pot[col_match[j]] += delta
+                    col_pot[j] -= delta
+                else:
+                    min_slack[j] -= delta
+
+            j0 = j1
+            if col_match[j0] == 0:
+                break
+
+        # Flip the matching along the path we found.
+        while j0 != 0:
+            j1 = prev_col[j0]
+            col_match[j0] = col_match[j1]
+            j0 = j1
+
+    assignment = [0] * n
+    for j in range(1, m + 1):
+        if col_match[j]:
+            assignment[col_match[j] - 1] = j - 1
+    return assignment
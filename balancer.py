@@ -0,0 +1,80 @@
+"""Idle load balancing between CPUs, after CFS's newidle and periodic
+balancing.
+"""
+
+
+class IdleBalancer(object):
+    """Lets a CPU with nothing to run pull a waiting process off another.
+
+    As in CFS's load_balance(), an idle CPU pulls from the busiest runqueue,
+    the one with the most load waiting on it. Each RunQueue keeps its load
+    up to date as processes come and go, so finding the busiest is one look
+    per CPU rather than a pass over their processes.
+
+    A CPU only pulls from CPUs in its domain. That's every CPU, until the
+    time-packer puts them in buckets; from then on it's the CPUs of its own
+    bucket, so that processes stay with others of similar runtimes. A CPU
+    outside of every bucket pulls from none.
+    """
+    def __init__(self, cpus):
+        self.cpus = cpus
+        self.cpu_of = {c.scheduler: c for c in cpus}
+
+        # Map from CPU --> the CPUs it may pull from, or None if any CPU may
+        # pull from any other.
+        self.domains = None
+
+    def update_domains(self, buckets):
+        """Take note of the buckets the migrator has put the CPUs in."""
+        if not buckets:
+            self.domains = None
+            return
+
+        self.domains = {c: [] for c in self.cpus}
+        for b in buckets:
+            for c in b.cpus:
+                self.domains[c] = b.cpus
+
+    def busiest(self, cpu):
+        """Return the CPU in cpu's domain with the most load waiting, or None
+        if none of them has a process waiting.
+
+        CPUs that aren't running anything are about to run what's waiting
+        on them, so they're left alone.
+        """
+        domain = self.domains[cpu] if self.domains is not None else self.cpus
+        busiest, busiest_load = None, 0
+        for c in domain:
+            s = c.scheduler
+            if (c is not cpu and s.curr_proc is not None and
+                    s.waiting_procs.load_weight > busiest_load):
+                busiest, busiest_load = c, s.waiting_procs.load_weight
+        return busiest
+
+    def pull(self, scheduler, now):
+        """Pull a process onto scheduler, which is idle, at time now.
+
+        The process is the one that would have run next on the busiest
+        runqueue. Return whether there was one to pull.
+        """
+        cpu = self.cpu_of[scheduler]
+        busiest = self.busiest(cpu)
+        if busiest is None:
+            return False
+
+        source = busiest.scheduler
+        p = source.waiting_procs.peek()
+
+        # One the migrator has sent elsewhere is already on its way.
+        if p.target_cpu is not busiest:
+            return False
+
+        source.take_proc(p)
+        source.notify()
+
+        # It belongs here now, as far as the migrator is concerned too.
+        p.target_cpu = cpu
+        scheduler.catch_up(now)
+        source.send_to_target(p)
+        source.counters.idle_pulls += 1
+        return True
@@ -0,0 +1,225 @@
+#!/usr/bin/python2
+"""Benchmark the simulator itself, on synthetic traces.
+
+Measures how fast traces parse, how many slices per second the scheduler
+simulates, and how long each migrator rebalance takes, over a grid of process
+and CPU counts. Each run's numbers are appended to a history file and compared
+with the previous run's, so regressions show up.
+"""
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+
+import gen_trace
+import simulate
+from state import State
+
+BENCH_HISTORY = "./plots/bench_history.jsonl"
+
+USAGE = """Usage: ./bench.py [--procs N,...] [--cpus N,...] [--sim-millis N]
+
+    --procs         process counts to simulate (default {procs})
+    --cpus          CPU counts to simulate (default {cpus})
+    --sim-millis    how much of each trace to simulate (default {sim_millis})"""
+
+DEFAULT_PROCS = [10, 100, 1000]
+DEFAULT_CPUS = [4, 64, 256]
+DEFAULT_SIM_MILLIS = 500
+
+# How long the synthetic traces are, in seconds.
+TRACE_SECONDS = 10
+
+
+def synthetic_trace_name(profile):
+    return "synthetic_{}".format(profile)
+
+
+def make_traces():
+    """Write a synthetic trace for every profile, unless it already exists.
+
+    The traces are deterministic, so existing ones are reused (along with
+    their parsed state caches).
+    """
+    for profile in sorted(gen_trace.PROFILES):
+        name = synthetic_trace_name(profile)
+        if not os.path.exists(gen_trace.trace_file_name(name)):
+            gen_trace.write_trace(gen_trace.PROFILES[profile], name,
+                                  TRACE_SECONDS)
+
+
+def make_workload(num_procs, num_cpus, sim_millis):
+    """A time-packed workload with processes spread over every profile."""
+    profiles = sorted(gen_trace.PROFILES)
+    return {
+        "processes": [
+            {"benchmark": synthetic_trace_name(profile),
+             "quantity": (num_procs / len(profiles) +
+                          (1 if i < num_procs % len(profiles) else 0))}
+            for i, profile in enumerate(profiles)],
+        "cpus": num_cpus,
+        "sim_time_millis": sim_millis,
+        "max_latency_millis": 30,
+        "rebalance_period_millis": 100,
+        "initial_latency_millis": 10,
+        "time_packer_active": True,
+    }
+
+
+def bench_parse():
+    """Return a map from profile --> {seconds, states} to parse its trace."""
+    results = {}
+    for profile in sorted(gen_trace.PROFILES):
+        trace_file = gen_trace.trace_file_name(synthetic_trace_name(profile))
+        start = time.time()
+        states = State.parse_trace(trace_file)
+        results[profile] = {"seconds": time.time() - start,
+                            "states": len(states)}
+    return results
+
+
+def bench_simulation(num_procs, num_cpus, sim_millis):
+    json_load = make_workload(num_procs, num_cpus, sim_millis)
+
+    # Parse outside of the timed simulation.
+    simulate.load_traces(json_load)
+
+    # The migrator prints its buckets on every rebalance.
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        _, _, _, counters = simulate.run_simulation(json_load, plots=False)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    rebalance_seconds = counters.phase_seconds.get("rebalance", 0.)
+    schedule_seconds = counters.phase_seconds["simulate"] - rebalance_seconds
+    return {
+        "procs": num_procs,
+        "cpus": num_cpus,
+        "slices": counters.slices,
+        "slices_per_second": per_second(counters.slices, schedule_seconds),
+        "sim_nanos_per_second": per_second(counters.sim_time,
+                                           schedule_seconds),
+        "rebalance_millis": (1000 * rebalance_seconds / counters.rebalances
+                             if counters.rebalances else 0.),
+    }
+
+
+def per_second(count, seconds):
+    """Return count / seconds, or None if the clock didn't see any time
+    pass (a tiny workload, or a coarse clock).
+    """
+    if seconds <= 0:
+        return None
+    return count / seconds
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history():
+    if not os.path.exists(BENCH_HISTORY):
+        return []
+    with open(BENCH_HISTORY, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_history(record):
+    history_dir = os.path.dirname(BENCH_HISTORY)
+    if not os.path.exists(history_dir):
+        os.makedirs(history_dir)
+    with open(BENCH_HISTORY, "a") as f:
+        f.write(json.dumps(record, sort_keys=True))
+        f.write("\n")
+
+
+def change(new, old):
+    """Describe the change from old to new, as a percentage."""
+    if new is None or old is None or old == 0:
+        return ""
+    return "({:+.1f}%)".format(100. * (new - old) / old)
+
+
+def print_record(record, previous):
+    if previous is not None:
+        print "Compared with {} ({})".format(
+            previous["revision"] or "an unknown revision", previous["time"])
+        print
+
+    print "Parsing"
+    for profile, r in sorted(record["parse"].items()):
+        old = (previous["parse"].get(profile, {}).get("seconds")
+               if previous is not None else None)
+        print "\t{}: {} states in {:.3f}s {}".format(
+            profile, r["states"], r["seconds"], change(r["seconds"], old))
+    print
+
+    old_sims = {}
+    if previous is not None:
+        old_sims = {(r["procs"], r["cpus"]): r for r in previous["simulation"]}
+
+    print "Simulation"
+    print "\t{:>6} {:>6} {:>26} {:>26}".format(
+        "procs", "cpus", "slices/s", "ms/rebalance")
+    for r in record["simulation"]:
+        old = old_sims.get((r["procs"], r["cpus"]), {})
+        print "\t{:>6} {:>6} {:>26} {:>26}".format(
+            r["procs"], r["cpus"],
+            ("{:.0f} {}".format(r["slices_per_second"],
+                                change(r["slices_per_second"],
+                                       old.get("slices_per_second")))
+             if r["slices_per_second"] is not None else "-"),
+            "{:.2f} {}".format(r["rebalance_millis"],
+                               change(r["rebalance_millis"],
+                                      old.get("rebalance_millis"))))
+
+
+def parse_counts(arg):
+    return [int(n) for n in arg.split(",")]
+
+
+def main(argv):
+    options = {"--procs": DEFAULT_PROCS, "--cpus": DEFAULT_CPUS,
+               "--sim-millis": [DEFAULT_SIM_MILLIS]}
+    args = argv[1:]
+    try:
+        while args:
+            if args[0] not in options or len(args) < 2:
+                raise ValueError(args[0])
+            options[args[0]] = parse_counts(args[1])
+            args = args[2:]
+    except ValueError:
+        print USAGE.format(procs=DEFAULT_PROCS, cpus=DEFAULT_CPUS,
+                           sim_millis=DEFAULT_SIM_MILLIS)
+        return
+
+    make_traces()
+
+    record = {
+        "time": datetime.datetime.now().isoformat(),
+        "revision": git_revision(),
+        "sim_millis": options["--sim-millis"][0],
+        "parse": bench_parse(),
+        "simulation": [
+            bench_simulation(p, c, options["--sim-millis"][0])
+            for p in options["--procs"] for c in options["--cpus"]],
+    }
+
+    history = load_history()
+    previous = history[-1] if history else None
+    append_history(record)
+    print_record(record, previous)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,111 @@
+"""Jenks natural breaks, computed as optimal 1-D k-means.
+
+Jenks natural breaks optimization splits sorted data into classes so as to
+minimize the total squared deviation of each value from its class mean:
+
+    https://en.wikipedia.org/wiki/Jenks_natural_breaks_optimization
+
+The textbook algorithm tries every split point for every prefix of the data,
+which is O(k * n^2). Here, the cost of any class comes from prefix sums in
+O(1), and since the best start of the last class only moves right as the data
+grows, each of the k rows of the dynamic program is filled in by divide and
+conquer in O(n log n).
+"""
+
+
+class PrefixSums(object):
+    """Sums and sums of squares of every prefix of the sorted data.
+
+    The values are centred on the median first. That doesn't change any
+    class's squared deviation, but keeps the sums small, so that cost()
+    doesn't lose it to cancellation.
+    """
+    def __init__(self, data):
+        centre = data[len(data) // 2] if data else 0
+        self.sums = [0]
+        self.squares = [0]
+        for x in data:
+            x -= centre
+            self.sums.append(self.sums[-1] + x)
+            self.squares.append(self.squares[-1] + x * x)
+
+    def cost(self, i, j):
+        """Squared deviation from the mean of data[i:j]."""
+        w = j - i
+        s1 = self.sums[j] - self.sums[i]
+        s2 = self.squares[j] - self.squares[i]
+
+        # For integer data, the numerator is exact. For floats it can round,
+        # but only relative to the centred values, not to their distance
+        # from 0.
+        return float(s2 * w - s1 * s1) / w
+
+
+def fill_row(prev, sums, n_prev):
+    """Compute one row of the dynamic program from the previous one.
+
+    prev[i] is the least cost of splitting data[:i] into n_prev classes. Return
+    (row, starts), where row[i] is the least cost of splitting data[:i] into
+    n_prev + 1 classes and starts[i] is where the last of those classes begins.
+    """
+    n = len(prev) - 1
+    row = [float("inf")] * (n + 1)
+    starts = [0] * (n + 1)
+
+    # (lo, hi, first, last): fill in row[lo:hi], knowing that each of their
+    # last classes starts somewhere in [first, last].
+    todo = [(n_prev + 1, n + 1, n_prev, n - 1)]
+    while todo:
+        lo, hi, first, last = todo.pop()
+        if lo >= hi:
+            continue
+
+        mid = (lo + hi) // 2
+        best, best_start = float("inf"), first
+        for t in range(first, min(last, mid - 1) + 1):
+            c = prev[t] + sums.cost(t, mid)
+            # On ties, prefer the earliest start (i.e. the biggest last
+            # class), like the textbook algorithm does.
+            if c < best:
+                best, best_start = c, t
+        row[mid] = best
+        starts[mid] = best_start
+
+        todo.append((lo, mid, first, best_start))
+        todo.append((mid + 1, hi, best_start, last))
+    return row, starts
+
+
+def natural_breaks(data, n_classes):
+    """Return the Jenks natural breaks of data, in n_classes classes.
+
+    Like the jenks package, return n_classes + 1 values: the smallest value,
+    followed by the largest value of each class.
+    """
+    data = sorted(data)
+    n = len(data)
+    if n_classes < 1:
+        return [data[0]]
+    n_classes = min(n_classes, n)
+
+    sums = PrefixSums(data)
+
+    # costs[i] is the least cost of splitting data[:i] into the classes so far.
+    costs = [sums.cost(0, i) if i > 0 else 0. for i in range(n + 1)]
+
+    # all_starts[c][i] is where the last class begins in the best split of
+    # data[:i] into c + 1 classes.
+    all_starts = [[0] * (n + 1)]
+    for c in range(1, n_classes):
+        costs, starts = fill_row(costs, sums, c)
+        all_starts.append(starts)
+
+    # Walk back from the last class, recording each class's largest value.
+    breaks = [data[-1]]
+    end = n
+    for c in range(n_classes - 1, 0, -1):
+        end = all_starts[c][end]
+        breaks.append(data[end - 1])
+    breaks.append(data[0])
+    breaks.reverse()
+    return breaks
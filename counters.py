@@ -0,0 +1,69 @@
+"""Cheap counters of what the simulator did, and how long it took."""
+import time
+from contextlib import contextmanager
+
+
+class Counters(object):
+    """Event counts and wall clock time per phase of a simulation.
+
+    These are bumped on the simulator's hot paths, so they're plain
+    attributes; one Counters object is shared by every CPU of a simulation.
+    """
+    FIELDS = [
+        ("slices", "slices simulated"),
+        ("idle_skips", "idle fast-forwards"),
+        ("idle_time", "idle nanos skipped"),
+        ("wakeups", "wakeups"),
+        ("migrations", "migrations"),
+        ("rebalances", "rebalances"),
+        ("idle_pulls", "idle balance pulls"),
+    ]
+
+    def __init__(self):
+        for field, _ in self.FIELDS:
+            setattr(self, field, 0)
+
+        # How many nanos were simulated.
+        self.sim_time = 0
+
+        # Map from phase --> wall clock seconds spent in it. Phases can nest
+        # (e.g. rebalancing happens during simulation).
+        self.phase_seconds = {}
+
+    @contextmanager
+    def phase(self, name):
+        """Add the wall clock time spent in the with block to phase name."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phase_seconds[name] = (self.phase_seconds.get(name, 0.) +
+                                        time.time() - start)
+
+    def to_dict(self):
+        d = {field: getattr(self, field) for field, _ in self.FIELDS}
+        d["sim_time"] = self.sim_time
+        d["phase_seconds"] = self.phase_seconds
+        return d
+
+    @staticmethod
+    def from_dict(d):
+        counters = Counters()
+        for field, _ in Counters.FIELDS:
+            # Counters added since the results were stored start at 0.
+            setattr(counters, field, d.get(field, 0))
+        counters.sim_time = d["sim_time"]
+        counters.phase_seconds = d["phase_seconds"]
+        return counters
+
+    def report(self):
+        print "Counters"
+        for field, description in self.FIELDS:
+            print "\t{}: {}".format(description, getattr(self, field))
+
+        print "Throughput (simulated nanos per wall second)"
+        for phase in sorted(self.phase_seconds,
+                            key=lambda p: -self.phase_seconds[p]):
+            seconds = self.phase_seconds[phase]
+            throughput = self.sim_time / seconds if seconds > 0 else 0
+            print "\t{}: {:.3f}s, {:.0f}".format(phase, seconds, throughput)
@@ -10,11 +10,16 @@ class CPU(object):
         self.target_latency = target_latency
         self.scheduler = Scheduler(procs, self.target_latency)
 
+    def __hash__(self):
+        # The migrator keeps dicts keyed by CPU, and the order it goes
+        # through them breaks ties between equally loaded CPUs. Hashing by
+        # number rather than id() keeps that order the same for copies of the
+        # CPUs (loaded from a checkpoint, or mirrored from workers), and from
+        # one run to the next.
+        return self.number
+
     def has_unfinished_procs(self):
         return any([not p.finished for p in self.scheduler.processes])
 
     def get_unfinished_procs(self):
         return [p for p in self.scheduler.processes if not p.finished]
-
-    def run(self, time):
-        self.scheduler.run(time)
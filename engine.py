@@ -0,0 +1,297 @@
+"""Discrete-event engine that simulates every CPU in timestamp order."""
+import heapq
+import itertools
+
+from counters import Counters
+
+# Event kinds. At equal times, CPU events come before ticks so that the
+# migrator sees every CPU brought fully up to date, and idle balancing comes
+# last, once the migrator has had its say.
+CPU_EVENT = 0
+TICK = 1
+BALANCE = 2
+
+
+class EventEngine(object):
+    """Drive all of the CPUs' schedulers off a single event calendar.
+
+    The calendar is a heap of (time, kind, cpu, seq, scheduler) events, so
+    simultaneous events are handled in CPU order. Each scheduler with
+    unfinished processes has exactly one live event: the next time something
+    happens on it (a slice expiring, a process finishing, an idle CPU's
+    sleeper waking). When that time moves, a new event is pushed and the old
+    one is left in the calendar as a stale entry. Idle stretches are skipped
+    in a single jump, and migrations between CPUs always happen at the global
+    time of the event that caused them.
+
+    Between migrator ticks, the only processes that can move between CPUs are
+    ones that were running when the migrator retargeted them. Once those have
+    left their CPUs, no CPU can affect another until the next tick, so each
+    one is simulated up to the tick in one go rather than interleaved with
+    the others event by event.
+
+    The engine ticks every rebalance_period if there's a migrator, or if
+    on_tick is set (e.g. to checkpoint the simulation). on_tick is called
+    after every tick, once the calendar is up to date. The whole engine,
+    with its schedulers, can be pickled between events and carries on where
+    it left off when run() is called again.
+
+    With an IdleBalancer, a CPU that runs out of work pulls a process from
+    another, and every balance_period each idle CPU tries again. Any CPU can
+    then affect any other at any time, so events are always handled strictly
+    in timestamp order.
+    """
+    def __init__(self, cpus, migrator=None, rebalance_period=None,
+                 counters=None, balancer=None, balance_period=None):
+        self.schedulers = [c.scheduler for c in cpus]
+        self.counters = counters if counters is not None else Counters()
+
+        # Map from scheduler --> number of its CPU.
+        self.cpu_numbers = {c.scheduler: c.number for c in cpus}
+        self.now = 0
+
+        # If there's no migrator, the time-packer is off and we never
+        # rebalance.
+        self.migrator = migrator
+        self.rebalance_period = rebalance_period
+        self.next_tick = None
+        self.on_tick = None
+        self.started = False
+
+        # If set, run() stops short of events after this time.
+        self.until = None
+
+        self.balancer = balancer
+        self.balance_period = balance_period
+
+        # Schedulers whose running process has been retargeted to another CPU
+        # and hasn't left yet.
+        self.stale = []
+
+        self.calendar = []
+        self.counter = itertools.count()
+
+        # Map from scheduler --> (seq, time) of its live event.
+        self.pending = {}
+
+        # Schedulers whose next event may have moved while handling the
+        # current one. A list, so that rescheduling order is deterministic.
+        self.dirty = []
+
+        for s in self.schedulers:
+            s.counters = self.counters
+        self.hook_schedulers()
+
+    def hook_schedulers(self):
+        for s in self.schedulers:
+            s.on_change = self.mark_dirty
+            s.on_idle = (self.balancer.pull if self.balancer is not None
+                         else None)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["on_tick"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.hook_schedulers()
+
+    def push(self, time, kind, scheduler=None):
+        seq = next(self.counter)
+        cpu = self.cpu_numbers[scheduler] if scheduler is not None else -1
+        heapq.heappush(self.calendar, (time, kind, cpu, seq, scheduler))
+        return seq
+
+    def mark_dirty(self, scheduler):
+        if scheduler not in self.dirty:
+            self.dirty.append(scheduler)
+
+    def schedule(self, scheduler, time=None):
+        """Make sure the calendar holds scheduler's next event."""
+        if time is None:
+            time = scheduler.next_event_time()
+
+        if time is None:
+            self.pending.pop(scheduler, None)
+            return
+
+        assert time >= scheduler.clock
+        live = self.pending.get(scheduler)
+        if live is not None and live[1] == time:
+            return
+
+        self.pending[scheduler] = (self.push(time, CPU_EVENT, scheduler), time)
+
+    def tick(self):
+        if self.migrator is not None:
+            self.rebalance()
+
+        self.next_tick = self.now + self.rebalance_period
+        self.push(self.next_tick, TICK)
+
+    def rebalance(self):
+        self.counters.rebalances += 1
+        with self.counters.phase("rebalance"):
+            # Bring every CPU up to the tick; the migrator measures loads and
+            # migrates sleepers as of now.
+            self.catch_up(self.now)
+            self.migrator.rebalance()
+        if self.balancer is not None:
+            self.balancer.update_domains(self.migrator.buckets)
+        self.retargeted()
+
+    def balance(self):
+        """Let every idle CPU pull a process, as CFS's periodic balancing
+        does, and schedule the next round.
+        """
+        for s in self.schedulers:
+            if s.curr_proc is None and not s.waiting_procs:
+                self.balancer.pull(s, self.now)
+
+        self.push(self.now + self.balance_period, BALANCE)
+
+    def catch_up(self, now):
+        """Bring every CPU up to now, waking its sleepers."""
+        for s in self.schedulers:
+            s.catch_up(now)
+            s.wake_sleepers()
+
+    def retargeted(self):
+        """Take note that processes' target CPUs may have changed."""
+        for s in self.schedulers:
+            self.mark_dirty(s)
+
+        self.stale = [s for s in self.schedulers
+                      if s.curr_proc is not None and
+                      s.curr_proc.target_cpu.scheduler is not s]
+
+    def horizon(self):
+        """Return how far a CPU can be simulated without hearing from others.
+
+        Return None if CPUs can still affect each other before the next tick,
+        in which case we have to go strictly in timestamp order.
+        """
+        if self.balancer is not None:
+            return None
+
+        self.stale = [s for s in self.stale
+                      if s.curr_proc is not None and
+                      s.curr_proc.target_cpu.scheduler is not s]
+        if self.stale:
+            return None
+
+        return min(self.next_tick if self.next_tick is not None
+                   else float("inf"),
+                   self.until if self.until is not None else float("inf"))
+
+    def strict_limit(self):
+        """Return how far a CPU can be simulated in strict timestamp order:
+        up to just before the next event on the calendar. None if there's no
+        limit.
+        """
+        limits = []
+        if self.calendar:
+            limits.append(self.calendar[0][0] - 1)
+        if self.until is not None:
+            limits.append(self.until)
+        return min(limits) if limits else None
+
+    def advance(self, scheduler, time):
+        """Advance scheduler to time, then keep going as far as is safe.
+
+        If the CPUs are independent until the next tick, keep simulating this
+        one up to the tick. Otherwise, keep going only while its next event
+        comes before anything else in the calendar. Either way, we save a
+        round trip through the heap per event.
+        """
+        limit = self.horizon()
+
+        while True:
+            scheduler.advance(time)
+
+            if any(s is not scheduler for s in self.dirty):
+                self.mark_dirty(scheduler)
+                return
+            self.dirty = []
+
+            # A process alone on its CPU can skip ahead through whole
+            # wake-sleep cycles, as far as it's safe to go. Not if its CPU
+            # would pull work from others whenever the process sleeps.
+            bound = limit if limit is not None else self.strict_limit()
+            if bound is not None and self.balancer is None:
+                scheduler.run_alone(bound)
+
+            time = scheduler.next_event_time()
+            if time is None or (bound is not None and time > bound):
+                self.schedule(scheduler, time)
+                return
+
+    def start(self):
+        for s in self.schedulers:
+            self.schedule(s)
+
+        if self.migrator is not None or self.on_tick is not None:
+            self.next_tick = self.rebalance_period
+            self.push(self.next_tick, TICK)
+        if self.balancer is not None:
+            self.push(self.balance_period, BALANCE)
+        self.started = True
+
+    def run(self, until=None):
+        """Simulate until every process has finished.
+
+        If until is given, stop once everything up to that time has been
+        handled instead; run() can be called again to carry on.
+        """
+        if not self.started:
+            self.start()
+
+        self.until = until
+        try:
+            # Every scheduler with unfinished processes has a live event, so
+            # we're done once none are left.
+            while self.pending:
+                if until is not None and self.peek()[0] > until:
+                    break
+                self.step()
+        finally:
+            self.until = None
+
+        self.counters.sim_time = max(s.clock for s in self.schedulers)
+
+    def peek(self):
+        """Return the (time, kind, cpu) of the next live event, or None."""
+        while self.calendar:
+            time, kind, cpu, seq, scheduler = self.calendar[0]
+            if kind == CPU_EVENT:
+                live = self.pending.get(scheduler)
+                if live is None or live[0] != seq:
+                    heapq.heappop(self.calendar)
+                    continue
+            return time, kind, cpu
+        return None
+
+    def step(self):
+        """Handle the next event on the calendar."""
+        if self.peek() is None:
+            return
+
+        time, kind, _, _, scheduler = heapq.heappop(self.calendar)
+        self.now = time
+        if kind == CPU_EVENT:
+            del self.pending[scheduler]
+            self.advance(scheduler, time)
+        elif kind == TICK:
+            self.tick()
+        else:
+            self.balance()
+        self.reschedule_dirty()
+
+        if kind == TICK and self.on_tick is not None:
+            self.on_tick()
+
+    def reschedule_dirty(self):
+        for s in self.dirty:
+            self.schedule(s)
+        self.dirty = []
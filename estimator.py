@@ -0,0 +1,119 @@
+"""Estimators of a process's average runtime between sleeps.
+
+An estimator is fed the runtime of each completed wake-sleep cycle with
+push(), and estimate(curr_runtime) returns the average runtime, counting the
+cycle in progress (which has run for curr_runtime so far) as if it ended now.
+Both are called on the simulator's hottest path, so they do constant work (or
+close to it) and don't allocate.
+"""
+import bisect
+from array import array
+
+# How many wake-sleep cycles the window estimators look back over.
+DEFAULT_WINDOW = 10
+
+# How much the EWMA estimator weighs the newest cycle.
+DEFAULT_WEIGHT = 0.2
+
+
+class WindowAverage(object):
+    """The mean runtime over the last `window` cycles."""
+    def __init__(self, window=DEFAULT_WINDOW):
+        # A ring buffer of the last window runtimes, and their sum.
+        self.runtimes = array('l', [0] * window)
+        self.window = window
+        self.count = 0
+        self.next = 0
+        self.total = 0
+
+    def push(self, runtime):
+        if self.count == self.window:
+            self.total -= self.runtimes[self.next]
+        else:
+            self.count += 1
+        self.runtimes[self.next] = runtime
+        self.total += runtime
+        self.next = (self.next + 1) % self.window
+
+    def estimate(self, curr_runtime):
+        return (self.total + curr_runtime) / (self.count + 1)
+
+
+class WindowMedian(object):
+    """The median runtime over the last `window` cycles.
+
+    The window is kept in arrival order in a ring buffer, and in sorted order
+    alongside it, so each update is a binary search plus a short shift.
+    """
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.runtimes = array('l', [0] * window)
+        self.sorted_runtimes = []
+        self.window = window
+        self.next = 0
+
+    def push(self, runtime):
+        if len(self.sorted_runtimes) == self.window:
+            oldest = self.runtimes[self.next]
+            del self.sorted_runtimes[
+                bisect.bisect_left(self.sorted_runtimes, oldest)]
+        self.runtimes[self.next] = runtime
+        bisect.insort(self.sorted_runtimes, runtime)
+        self.next = (self.next + 1) % self.window
+
+    def estimate(self, curr_runtime):
+        # Find the middle of the window with curr_runtime in it, without
+        # actually putting it in.
+        runtimes = self.sorted_runtimes
+        pos = bisect.bisect_left(runtimes, curr_runtime)
+
+        def kth(k):
+            if k < pos:
+                return runtimes[k]
+            elif k == pos:
+                return curr_runtime
+            return runtimes[k - 1]
+
+        n = len(runtimes) + 1
+        return (kth((n - 1) / 2) + kth(n / 2)) / 2
+
+
+class EWMA(object):
+    """An exponentially weighted moving average of runtimes.
+
+    Like the kernel's PELT load tracking, older cycles count for
+    geometrically less; the newest cycle gets `weight` of the total.
+    """
+    def __init__(self, weight=DEFAULT_WEIGHT):
+        self.weight = weight
+        self.average = None
+
+    def push(self, runtime):
+        self.average = self.estimate(runtime)
+
+    def estimate(self, curr_runtime):
+        if self.average is None:
+            return curr_runtime
+        return int(self.average + self.weight * (curr_runtime - self.average))
+
+
+ESTIMATORS = {
+    "window": lambda config: WindowAverage(
+        config.get("window", DEFAULT_WINDOW)),
+    "median": lambda config: WindowMedian(
+        config.get("window", DEFAULT_WINDOW)),
+    "ewma": lambda config: EWMA(config.get("weight", DEFAULT_WEIGHT)),
+}
+
+
+def estimator_factory(config=None):
+    """Return a function that makes the estimator described by config.
+
+    config is the "runtime_estimator" entry of a workload, e.g.
+    {"type": "ewma", "weight": 0.3}. With no config, processes average their
+    last DEFAULT_WINDOW cycles.
+    """
+    config = config or {}
+    kind = config.get("type", "window")
+    if kind not in ESTIMATORS:
+        raise ValueError("Unrecognized runtime estimator: {}".format(kind))
+    return lambda: ESTIMATORS[kind](config)
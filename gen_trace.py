@@ -0,0 +1,140 @@
+#!/usr/bin/python2
+"""Generate synthetic traces, for when perf isn't available.
+
+The traces are written in the same event,state,ts format that trace_proc.py
+produces, so the simulator can't tell them apart from real ones.
+"""
+import os
+import random
+import sys
+
+from trace_proc import SWITCH_EVENT, TRACE_DIR, WAKE_EVENT
+
+NANOS_PER_MILLISECOND = (10 ** 6)
+
+USAGE = """Usage: ./gen_trace.py <PROFILE> <NAME> [SECONDS] [SEED]
+
+Writes SECONDS (default 10) of a process following PROFILE to
+./traces/NAME.trace.csv, using random seed SEED (default 0)."""
+
+
+class Exponential(object):
+    """Exponentially distributed durations, in nanos."""
+    def __init__(self, mean):
+        self.mean = mean
+
+    def sample(self, rand):
+        return int(rand.expovariate(1.0 / self.mean))
+
+
+class LogNormal(object):
+    """Log-normally distributed durations around a median, in nanos.
+
+    sigma controls the spread: at 1, about two thirds of durations are within
+    a factor of e of the median.
+    """
+    def __init__(self, median, sigma=1.0):
+        self.median = median
+        self.sigma = sigma
+
+    def sample(self, rand):
+        return int(self.median * rand.lognormvariate(0, self.sigma))
+
+
+class Mixture(object):
+    """Draws from one of several distributions, picked by weight."""
+    def __init__(self, weighted_dists):
+        self.weighted_dists = weighted_dists
+        self.total_weight = float(sum(w for w, _ in weighted_dists))
+
+    def sample(self, rand):
+        x = rand.random() * self.total_weight
+        for weight, dist in self.weighted_dists:
+            if x < weight:
+                return dist.sample(rand)
+            x -= weight
+        return self.weighted_dists[-1][1].sample(rand)
+
+
+class TraceProfile(object):
+    """How a synthetic process behaves.
+
+    It alternates between running for a duration drawn from run_dist and
+    sleeping for a duration drawn from sleep_dist. With probability
+    preempt_prob, a run is split by a switch that leaves it runnable (state
+    R), as when it's preempted in a real trace.
+    """
+    def __init__(self, run_dist, sleep_dist, preempt_prob=0.3):
+        self.run_dist = run_dist
+        self.sleep_dist = sleep_dist
+        self.preempt_prob = preempt_prob
+
+    def events(self, max_time, seed=0):
+        """Yield (event, state, ts) up to max_time nanos."""
+        rand = random.Random(seed)
+        ts = 0
+        while ts < max_time:
+            run = max(1, self.run_dist.sample(rand))
+            if rand.random() < self.preempt_prob:
+                yield SWITCH_EVENT, "R", ts + run / 2
+            ts += run
+            yield SWITCH_EVENT, rand.choice(["S", "D"]), ts
+
+            ts += max(1, self.sleep_dist.sample(rand))
+            yield WAKE_EVENT, "", ts
+
+
+PROFILES = {
+    # Runs for tens of millis at a time, and barely sleeps.
+    "cpu_bound": TraceProfile(LogNormal(20 * NANOS_PER_MILLISECOND, 0.5),
+                              Exponential(100 * 1000)),
+
+    # Runs for tens of micros at a time, then waits millis for IO.
+    "io_bound": TraceProfile(LogNormal(50 * 1000, 0.5),
+                             Exponential(2 * NANOS_PER_MILLISECOND)),
+
+    # Mostly short runs, with occasional long bursts of computation.
+    "bimodal": TraceProfile(
+        Mixture([(0.8, LogNormal(200 * 1000, 0.5)),
+                 (0.2, LogNormal(15 * NANOS_PER_MILLISECOND, 0.5))]),
+        Exponential(500 * 1000)),
+}
+
+
+def trace_file_name(name):
+    return os.path.join(TRACE_DIR, "{}.trace.csv".format(name))
+
+
+def write_trace(profile, name, seconds=10, seed=0):
+    """Write a synthetic trace of profile to the traces directory.
+
+    Return the file name.
+    """
+    if not os.path.isdir(TRACE_DIR):
+        os.makedirs(TRACE_DIR)
+
+    file_name = trace_file_name(name)
+    max_time = int(seconds * 1000 * NANOS_PER_MILLISECOND)
+    with open(file_name, "w") as outfile:
+        for event, state, ts in profile.events(max_time, seed):
+            outfile.write("{},{},{}\n".format(event, state, ts))
+    return file_name
+
+
+def main(argv):
+    if len(argv) < 3 or argv[1] not in PROFILES:
+        print USAGE
+        print
+        print "Profiles"
+        for name in sorted(PROFILES):
+            print "\t{}".format(name)
+        return
+
+    seconds = float(argv[3]) if len(argv) > 3 else 10
+    seed = int(argv[4]) if len(argv) > 4 else 0
+    print "Wrote {}".format(
+        write_trace(PROFILES[argv[1]], argv[2], seconds, seed))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
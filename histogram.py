@@ -0,0 +1,153 @@
+"""Log-bucketed histograms of scheduling latencies, in constant memory.
+
+Like HdrHistogram, values below 2**SUB_BUCKET_BITS get a bucket each, and
+every power of two above that is split into 2**(SUB_BUCKET_BITS - 1) equal
+buckets. So a value is only ever off by less than 1 part in 64, however big
+it is, and there are at most a few thousand buckets however many values are
+recorded. Only the buckets that have been used are kept.
+"""
+from collections import defaultdict
+
+NANOS_PER_MILLISECOND = (10 ** 6)
+
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF_BITS = SUB_BUCKET_BITS - 1
+
+# How much time each utilization sample covers.
+UTILIZATION_WINDOW = 10 * NANOS_PER_MILLISECOND
+
+
+def bucket_range(index):
+    """Return the (lowest, highest) value that falls in bucket index."""
+    if index < SUB_BUCKET_COUNT:
+        return index, index
+    shift = (index >> SUB_BUCKET_HALF_BITS) - 1
+    lowest = (index - (shift << SUB_BUCKET_HALF_BITS)) << shift
+    return lowest, lowest + (1 << shift) - 1
+
+
+class LogHistogram(object):
+    """Counts of non-negative integer values (e.g. nanos), log-bucketed."""
+    def __init__(self):
+        # Map from bucket index --> how many values fell in it.
+        self.counts = defaultdict(int)
+
+    def record(self, value, count=1):
+        """Count value, count times over."""
+        if value < SUB_BUCKET_COUNT:
+            index = value
+        else:
+            shift = value.bit_length() - SUB_BUCKET_BITS
+            index = (shift << SUB_BUCKET_HALF_BITS) + (value >> shift)
+        self.counts[index] += count
+
+    @property
+    def total(self):
+        return sum(self.counts.itervalues())
+
+    def merge(self, other):
+        for index, count in other.counts.iteritems():
+            self.counts[index] += count
+
+    def percentile(self, percent):
+        """Return the value that percent of the values are at or below.
+
+        As HdrHistogram does, that's the highest value of the bucket it falls
+        in. Return None if nothing has been recorded.
+        """
+        total = self.total
+        if not total:
+            return None
+
+        # The rank of the value we're after, rounding up, but at least 1.
+        rank = max(1, -(-total * percent // 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return bucket_range(index)[1]
+
+    def to_dict(self):
+        return {"counts": sorted(self.counts.items())}
+
+    @staticmethod
+    def from_dict(d):
+        h = LogHistogram()
+        for index, count in d["counts"]:
+            h.counts[index] = count
+        return h
+
+
+class SchedStats(object):
+    """Histograms of how a process (or a CPU) got scheduled.
+
+    waits holds how long it spent runnable but waiting for the CPU, from
+    waking up (or being preempted) until it was picked to run. slices holds
+    the lengths of the slices it ran. busy holds how much of each window of
+    window nanos it spent running; windows are counted from time 0, and one
+    is only counted once something runs after its end.
+    """
+    def __init__(self, window=UTILIZATION_WINDOW):
+        self.waits = LogHistogram()
+        self.slices = LogHistogram()
+        self.busy = LogHistogram()
+
+        self.window = window
+        self.window_end = window
+        self.window_busy = 0
+
+    def record_slice(self, start, end):
+        """Count a slice run from start to end."""
+        self.slices.record(end - start)
+        if end <= self.window_end:
+            self.window_busy += end - start
+        else:
+            self.add_busy(start, end)
+
+    def add_busy(self, start, end):
+        """Count the time from start to end as spent running."""
+        while end > self.window_end:
+            if start < self.window_end:
+                self.window_busy += self.window_end - start
+                start = self.window_end
+            self.busy.record(self.window_busy)
+            self.window_busy = 0
+            self.window_end += self.window
+
+            # Windows spent without running at all count in one go.
+            idle = (start - self.window_end) / self.window
+            if idle > 0:
+                self.busy.record(0, idle)
+                self.window_end += idle * self.window
+        self.window_busy += end - start
+
+    def utilization(self, percent):
+        """Return the percent-th percentile of the fraction of windows spent
+        running, or None if no window has been counted.
+        """
+        busy = self.busy.percentile(percent)
+        if busy is None:
+            return None
+        return min(1., float(busy) / self.window)
+
+    def merge(self, other):
+        self.waits.merge(other.waits)
+        self.slices.merge(other.slices)
+        self.busy.merge(other.busy)
+
+    def to_dict(self):
+        return {
+            "waits": self.waits.to_dict(),
+            "slices": self.slices.to_dict(),
+            "busy": self.busy.to_dict(),
+            "window": self.window,
+        }
+
+    @staticmethod
+    def from_dict(d):
+        stats = SchedStats(d["window"])
+        stats.waits = LogHistogram.from_dict(d["waits"])
+        stats.slices = LogHistogram.from_dict(d["slices"])
+        stats.busy = LogHistogram.from_dict(d["busy"])
+        return stats
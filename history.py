@@ -0,0 +1,94 @@
+"""Bounded histories of (time, value) points, for plotting."""
+from array import array
+
+# How many points a history holds before it starts decimating.
+DEFAULT_CAP = 4096
+
+
+class History(object):
+    """A series of (time, value) points in at most `cap` slots.
+
+    Points are stored in preallocated arrays. When they fill up, every run of
+    4 stored points is replaced by its smallest and largest value (min/max
+    decimation), halving the points held. From then on, each stored pair is
+    the min and max of a bucket of consecutive points, so spikes survive
+    however long the history gets, and memory stays flat.
+    """
+    def __init__(self, cap=DEFAULT_CAP):
+        # Runs of 4 must line up with buckets' pairs of points.
+        cap = max(4, cap - cap % 4)
+        self.cap = cap
+        self.times = array('l', [0] * cap)
+        self.values = array('l', [0] * cap)
+        self.size = 0
+
+        # How many points each bucket covers. At 1, every point is stored as
+        # is; beyond that, each bucket is stored as its min and max.
+        self.bucket_size = 1
+
+        # The bucket being filled: how many points it has, and its min and
+        # max points so far.
+        self.pending = 0
+        self.pending_min = None
+        self.pending_max = None
+
+    def __len__(self):
+        return self.size + min(self.pending, 2)
+
+    def append(self, time, value):
+        if self.bucket_size == 1:
+            self.store(time, value)
+            return
+
+        point = (time, value)
+        if self.pending == 0:
+            self.pending_min = self.pending_max = point
+        elif value < self.pending_min[1]:
+            self.pending_min = point
+        elif value > self.pending_max[1]:
+            self.pending_max = point
+        self.pending += 1
+
+        if self.pending == self.bucket_size:
+            for t, v in self.bucket_points():
+                self.store(t, v)
+            self.pending = 0
+
+    def bucket_points(self):
+        """The pending bucket's min and max, in time order."""
+        if self.pending == 1:
+            return [self.pending_min]
+        return sorted([self.pending_min, self.pending_max])
+
+    def store(self, time, value):
+        self.times[self.size] = time
+        self.values[self.size] = value
+        self.size += 1
+
+        # Decimate as soon as we're full, rather than on the next store, so
+        # that the pending bucket's points never take us over cap.
+        if self.size == self.cap:
+            self.decimate()
+
+    def decimate(self):
+        """Halve the stored points, keeping each run of 4's min and max."""
+        out = 0
+        for start in range(0, self.size, 4):
+            run = range(start, min(start + 4, self.size))
+            lo = min(run, key=lambda i: self.values[i])
+            hi = max(run, key=lambda i: self.values[i])
+            # Always keep two, even if they're the same, so that pairs stay
+            # lined up with buckets.
+            for i in sorted([lo, hi]):
+                self.times[out] = self.times[i]
+                self.values[out] = self.values[i]
+                out += 1
+        self.size = out
+        self.bucket_size = 4 if self.bucket_size == 1 else self.bucket_size * 2
+
+    def points(self):
+        """Return every point held, including the partly filled bucket."""
+        points = zip(self.times[:self.size], self.values[:self.size])
+        if self.pending:
+            points.extend(self.bucket_points())
+        return points
@@ -1,5 +1,6 @@
 """Migrator migrates processes according to the time-packing algorithm."""
-from jenks import jenks
+from assignment import min_cost_assignment
+from breaks import natural_breaks
 
 # 100 nanos rounding error
 ROUNDING_ERROR = 100
@@ -26,52 +27,182 @@ class Bucket(object):
     def claim_cpu(self, cpu):
         self.cpus.append(cpu)
 
-    def mark_procs_for_migration(self):
-        """Put processes in this bucket on the CPUs allotted to the bucket."""
-        assert self.num_cpus == len(self.cpus)
+    def greedy_placement(self):
+        """Return the CPU for each process, spreading load evenly.
 
+        The result is parallel to self.procs.
+        """
         # Map from cpu --> load. We want to spread load evenly accross CPUs
         # under our control.
         load_map = {c: 0. for c in self.cpus}
 
-        self.desired_latencies = {c: 0. for c in self.cpus}
-
+        placement = []
         for p in self.procs:
             # Put the next process on the CPU with minimum load.
             min_load_cpu = min(load_map.items(), key=lambda i: i[1])[0]
 
             # Update that cpu's load
             load_map[min_load_cpu] += p.get_load()
-            p.target_cpu = min_load_cpu
+            placement.append(min_load_cpu)
+        return placement
+
+    def stable_placement(self, current_cpus, imbalance_tolerance):
+        """Return the CPU for each process, moving as few as we can.
+
+        Processes already on one of the bucket's CPUs stay there, and the rest
+        are placed on the least loaded ones. Then, while the busiest CPU
+        carries more than (1 + imbalance_tolerance) times the busiest CPU's
+        load under greedy_placement, processes are moved from the busiest CPU
+        to the idlest. If that doesn't get under the limit, fall back to the
+        greedy placement. The result is parallel to self.procs.
+        """
+        greedy = self.greedy_placement()
+        load_limit = (max(self.placement_loads(greedy).values()) *
+                      (1 + imbalance_tolerance))
+
+        loads = {c: 0. for c in self.cpus}
+        placement = [None] * len(self.procs)
+        for i, p in enumerate(self.procs):
+            cpu = current_cpus.get(p)
+            if cpu in loads:
+                placement[i] = cpu
+                loads[cpu] += p.get_load()
+
+        for i, p in enumerate(self.procs):
+            if placement[i] is None:
+                cpu = min(self.cpus, key=lambda c: loads[c])
+                placement[i] = cpu
+                loads[cpu] += p.get_load()
+
+        while max(loads.values()) > load_limit:
+            busiest = max(self.cpus, key=lambda c: loads[c])
+            idlest = min(self.cpus, key=lambda c: loads[c])
+
+            # Of the moves that make the pair more even, take the one that
+            # makes it most even. Each move makes the loads strictly more
+            # even, so this can't go on forever.
+            best, best_peak = None, loads[busiest]
+            for i, p in enumerate(self.procs):
+                if placement[i] is not busiest:
+                    continue
+                load = p.get_load()
+                peak = max(loads[busiest] - load, loads[idlest] + load)
+                if peak < best_peak:
+                    best, best_peak = i, peak
+
+            if best is None:
+                return greedy
+
+            load = self.procs[best].get_load()
+            placement[best] = idlest
+            loads[busiest] -= load
+            loads[idlest] += load
+
+        return placement
+
+    def placement_loads(self, placement):
+        loads = {c: 0. for c in self.cpus}
+        for p, cpu in zip(self.procs, placement):
+            loads[cpu] += p.get_load()
+        return loads
+
+    def mark_procs_for_migration(self, current_cpus=None,
+                                 imbalance_tolerance=0.):
+        """Put processes in this bucket on the CPUs allotted to the bucket.
+
+        If current_cpus (a map from process --> the CPU it's on) is given,
+        keep processes where they are as far as the imbalance_tolerance
+        allows. Otherwise, spread load as evenly as we can.
+        """
+        assert self.num_cpus == len(self.cpus)
+
+        if current_cpus is None:
+            placement = self.greedy_placement()
+        else:
+            placement = self.stable_placement(current_cpus,
+                                              imbalance_tolerance)
+
+        self.desired_latencies = {c: 0. for c in self.cpus}
+        mean_weights = self.placement_mean_weights(placement)
+
+        for p, cpu in zip(self.procs, placement):
+            p.target_cpu = cpu
 
             # The desired latency will be the sum of average runtime for
             # processes under this CPU. The idea is that in an ideal world, we
             # want all of the processes to run and then voluntarily sleep within
             # a single latency cycle.
-            self.desired_latencies[min_load_cpu] += p.average_runtime
+            #
+            # Each process gets a share of the latency in proportion to its
+            # weight, so one that's lighter than the others on its CPU needs
+            # a longer cycle to fit its runtime in, and a heavier one less.
+            self.desired_latencies[cpu] += (p.average_runtime *
+                                            mean_weights[cpu] / p.weight)
+
+    def placement_mean_weights(self, placement):
+        """Return a map from CPU --> mean weight of its processes."""
+        weights = {}
+        counts = {}
+        for p, cpu in zip(self.procs, placement):
+            weights[cpu] = weights.get(cpu, 0) + p.weight
+            counts[cpu] = counts.get(cpu, 0) + 1
+        return {c: float(weights[c]) / counts[c] for c in weights}
 
     def set_new_latencies(self, max_latency):
         """Set latencies for the CPUs under this bucket's control.
 
-        Cap latencies at max_latency.
+        Cap latencies at max_latency. A CPU whose processes have yet to
+        finish a run has no runtime to go by, and keeps the latency it has.
         """
         for c in self.cpus:
+            if self.desired_latencies[c] <= 0:
+                continue
             lat = min(self.desired_latencies[c], max_latency)
             c.scheduler.target_latency = lat
 
 
 class Migrator(object):
-    def __init__(self, max_latency_millis, cpus):
+    def __init__(self, max_latency_millis, cpus, breaks_tolerance=0.,
+                 stable=False, imbalance_tolerance=0.):
         self.cpus = cpus
         self.buckets = []
         self.max_latency = max_latency_millis * (10 ** 6)
         self.historical_latencies = []
 
+        # Bucket boundaries are only recomputed if some process's average
+        # runtime has moved by more than this fraction since they last were
+        # (or if the set of processes has changed). At 0, they're recomputed
+        # whenever anything moves at all.
+        self.breaks_tolerance = breaks_tolerance
+
+        # The last bucket boundaries we computed, the number of buckets we
+        # computed them for, and a map from process --> average runtime at the
+        # time.
+        self.bucket_boundaries = None
+        self.breaks_num_buckets = None
+        self.breaks_runtimes = {}
+
+        # In stable mode, buckets are matched with the CPUs their processes
+        # are already on, and processes stay put unless that would leave a
+        # bucket's CPUs more than imbalance_tolerance more unevenly loaded
+        # than spreading them from scratch. This saves migrations, which cost
+        # cache warmth on real hardware.
+        self.stable = stable
+        self.imbalance_tolerance = imbalance_tolerance
+
     def gather_procs(self):
-        """Get all the processes running on all CPUs."""
+        """Get all the processes running on all CPUs.
+
+        Processes that haven't started yet are left where they are: they've
+        no runtime to pack by, and would drag their CPU's latency to 0.
+        """
         procs = []
         for c in self.cpus:
-            procs.extend(c.get_unfinished_procs())
+            # Sleep time is settled lazily; bring it up to date so that the
+            # loads we compute are current.
+            c.scheduler.settle_sleepers()
+            procs.extend([p for p in c.get_unfinished_procs()
+                          if p.has_started()])
         return procs
 
     def rebalance(self):
@@ -85,10 +216,8 @@ class Migrator(object):
 
         # Calculate bucket boundaries according to Jenks natural breaks
         # optimization.
-        #
-        # https://en.wikipedia.org/wiki/Jenks_natural_breaks_optimization
-        bucket_boundaries = jenks([p.average_runtime for p in procs],
-                                  min(num_buckets, len(procs)))
+        bucket_boundaries = self.get_bucket_boundaries(
+            procs, min(num_buckets, len(procs)))
 
         # Iterate through the boundaries, creating a bucket for each upper
         # bound.
@@ -148,29 +277,37 @@ class Migrator(object):
 
         # There might STILL be cpus left to give away, since we rounded down
         # cpus_deserverd. Give the remaining CPUs away to processes in
-        # descending order of load.
+        # descending order of load, going round again if one pass isn't enough.
         cpus_remaining = target_allotted - cpus_allotted
-        for b in sorted(self.buckets, key=lambda b: -b.load):
-            if cpus_remaining == 0:
-                break
+        while cpus_remaining > 0:
+            for b in sorted(self.buckets, key=lambda b: -b.load):
+                if cpus_remaining == 0:
+                    break
 
-            # Again, only give away CPUs if the bucket has enough processes to
-            # utilize them.
-            if len(b.procs) > b.num_cpus:
-                b.num_cpus += 1
-                cpus_remaining -= 1
+                # Again, only give away CPUs if the bucket has enough processes
+                # to utilize them.
+                if len(b.procs) > b.num_cpus:
+                    b.num_cpus += 1
+                    cpus_remaining -= 1
 
         # We shouldn't have anymore CPUs to give away.
         assert cpus_remaining == 0
 
         # Assign cpus to bucket.
-        cpu_itr = iter(self.cpus)
-        for b in self.buckets:
-            for _ in range(b.num_cpus):
-                cpu = cpu_itr.next()
-                b.claim_cpu(cpu)
+        if self.stable:
+            current_cpus = self.get_current_cpus()
+            self.assign_cpus_stably(current_cpus)
+            for b in self.buckets:
+                b.mark_procs_for_migration(current_cpus,
+                                           self.imbalance_tolerance)
+        else:
+            cpu_itr = iter(self.cpus)
+            for b in self.buckets:
+                for _ in range(b.num_cpus):
+                    cpu = cpu_itr.next()
+                    b.claim_cpu(cpu)
 
-            b.mark_procs_for_migration()
+                b.mark_procs_for_migration()
 
         # Debugging
         self.print_buckets()
@@ -187,6 +324,68 @@ class Migrator(object):
                        len(self.cpus))
         self.historical_latencies.append(avg_latency)
 
+    def get_current_cpus(self):
+        """Return a map from each started, unfinished process --> the CPU
+        it's on.
+        """
+        return {p: c for c in self.cpus for p in c.get_unfinished_procs()
+                if p.has_started()}
+
+    def assign_cpus_stably(self, current_cpus):
+        """Give each bucket its CPUs, keeping processes where they are.
+
+        Each bucket gets one slot per CPU it's owed, and slots are matched to
+        CPUs so that as many processes as possible are already on a CPU of
+        their bucket. Ties go to the order the CPUs are normally handed out in.
+        """
+        slots = [b for b in self.buckets for _ in range(b.num_cpus)]
+        slots.extend([None] * (len(self.cpus) - len(slots)))
+
+        # Matching one more process always beats breaking any number of ties.
+        tie_weight = len(self.cpus) + 1
+
+        cost = []
+        for i, b in enumerate(slots):
+            row = []
+            for j, c in enumerate(self.cpus):
+                overlap = 0
+                if b is not None:
+                    overlap = sum(1 for p in b.procs
+                                  if current_cpus.get(p) is c)
+                row.append(-overlap * tie_weight + (0 if i == j else 1))
+            cost.append(row)
+
+        for i, j in enumerate(min_cost_assignment(cost)):
+            if slots[i] is not None:
+                slots[i].claim_cpu(self.cpus[j])
+
+    def breaks_are_current(self, procs, num_buckets):
+        """Whether the last bucket boundaries still hold for procs."""
+        if (self.bucket_boundaries is None or
+                num_buckets != self.breaks_num_buckets or
+                len(procs) != len(self.breaks_runtimes)):
+            return False
+
+        for p in procs:
+            old_runtime = self.breaks_runtimes.get(p)
+            if old_runtime is None:
+                return False
+            if (abs(p.average_runtime - old_runtime) >
+                    self.breaks_tolerance * old_runtime):
+                return False
+        return True
+
+    def get_bucket_boundaries(self, procs, num_buckets):
+        """Return the natural breaks of procs' average runtimes.
+
+        Skip recomputing them if no process has moved far enough to matter.
+        """
+        if not self.breaks_are_current(procs, num_buckets):
+            self.bucket_boundaries = natural_breaks(
+                [p.average_runtime for p in procs], num_buckets)
+            self.breaks_num_buckets = num_buckets
+            self.breaks_runtimes = {p: p.average_runtime for p in procs}
+        return self.bucket_boundaries
 
     def print_buckets(self):
         for i, b in enumerate(self.buckets):
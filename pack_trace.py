@@ -0,0 +1,245 @@
+#!/usr/bin/python2
+"""Pack traces into a compact binary format, and read them back.
+
+A packed trace (NAME.trace.pack) holds the same events as NAME.trace.csv,
+laid out as:
+
+    MAGIC
+    blocks          zlib-compressed runs of up to BLOCK_EVENTS events
+    dictionary      every distinct event,state pair, a line each
+    index           where each block is, and the times it covers
+    footer          where the dictionary and index are, and MAGIC again
+
+Within a block, each event is two varints: the number of its event,state
+pair in the dictionary, and how many nanos after the event before it it
+comes (the first event of a block, after the block's start time in the
+index). So an event takes a few bytes before compression, rather than a line
+of text. Thanks to the index, a reader can start at any time, and stop at
+any time without decompressing the blocks after it.
+"""
+import bisect
+import os
+import struct
+import sys
+import zlib
+
+MAGIC = "TRPACK01"
+
+CSV_FILE_FMT = "./traces/{}.trace.csv"
+PACK_FILE_FMT = "./traces/{}.trace.pack"
+
+USAGE = """Usage: ./pack_trace.py <NAME> ...
+
+Packs ./traces/NAME.trace.csv into ./traces/NAME.trace.pack, which the
+simulator reads instead from then on. The csv can be deleted afterwards."""
+
+BLOCK_EVENTS = 4096
+COMPRESSION_LEVEL = 6
+
+# Per block: its offset in the file, its compressed size, how many events it
+# holds, and the times of its first and last event.
+INDEX_ENTRY = struct.Struct("<qqqqq")
+
+# The offsets of the dictionary and the index, and the number of blocks.
+FOOTER = struct.Struct("<qqq8s")
+
+
+def is_packed(trace_name):
+    return trace_name.endswith(".pack")
+
+
+def encode_varint(value, out):
+    """Append value to the bytearray out, 7 bits a byte, lowest first."""
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varints(data):
+    """Yield every varint in the bytearray data, in order."""
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield value
+            value = shift = 0
+
+
+class TraceWriter(object):
+    """Writes events to a packed trace as they come, a block at a time.
+
+    Events must come in time order. The trace is written under a temporary
+    name, and only appears under its own once it's closed, so a packed trace
+    that's there is complete. Used as a context manager, it's closed at the
+    end of the with block, or thrown away if that raises.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.tmp_name = "{}.{}.tmp".format(file_name, os.getpid())
+        self.out = open(self.tmp_name, "wb")
+        self.out.write(MAGIC)
+
+        # Map from (event, state) --> its number in the dictionary, and the
+        # pairs in number order.
+        self.codes = {}
+        self.pairs = []
+
+        self.index = []
+        self.block = bytearray()
+        self.block_events = 0
+        self.block_start = None
+        self.last_time = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.out.close()
+            os.remove(self.tmp_name)
+
+    def write(self, event, state, time):
+        if self.last_time is not None and time < self.last_time:
+            raise ValueError("Events must come in time order: {} came after "
+                             "{}".format(time, self.last_time))
+
+        code = self.codes.get((event, state))
+        if code is None:
+            code = self.codes[(event, state)] = len(self.pairs)
+            self.pairs.append((event, state))
+
+        if self.block_start is None:
+            self.block_start = self.last_time = time
+        encode_varint(code, self.block)
+        encode_varint(time - self.last_time, self.block)
+        self.last_time = time
+
+        self.block_events += 1
+        if self.block_events == BLOCK_EVENTS:
+            self.flush_block()
+
+    def flush_block(self):
+        if not self.block_events:
+            return
+
+        data = zlib.compress(str(self.block), COMPRESSION_LEVEL)
+        self.index.append((self.out.tell(), len(data), self.block_events,
+                           self.block_start, self.last_time))
+        self.out.write(data)
+
+        self.block = bytearray()
+        self.block_events = 0
+        self.block_start = None
+
+    def close(self):
+        self.flush_block()
+
+        dictionary_offset = self.out.tell()
+        self.out.write("\n".join("{},{}".format(event, state)
+                                 for event, state in self.pairs))
+
+        index_offset = self.out.tell()
+        for entry in self.index:
+            self.out.write(INDEX_ENTRY.pack(*entry))
+        self.out.write(FOOTER.pack(dictionary_offset, index_offset,
+                                   len(self.index), MAGIC))
+        self.out.close()
+        os.rename(self.tmp_name, self.file_name)
+
+
+class TraceReader(object):
+    """Reads the events of a packed trace, from and to any time.
+
+    Only the footer, dictionary and index are read up front; blocks are read
+    and decompressed one at a time as the events are iterated over.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size < len(MAGIC) + FOOTER.size:
+                raise ValueError("{} is too short to be a packed "
+                                 "trace".format(file_name))
+
+            f.seek(size - FOOTER.size)
+            dictionary_offset, index_offset, num_blocks, magic = (
+                FOOTER.unpack(f.read(FOOTER.size)))
+            if magic != MAGIC:
+                raise ValueError("{} isn't a packed trace".format(file_name))
+            if not (len(MAGIC) <= dictionary_offset <= index_offset and
+                    index_offset + num_blocks * INDEX_ENTRY.size ==
+                    size - FOOTER.size):
+                raise ValueError("{} has a corrupt footer".format(file_name))
+
+            f.seek(dictionary_offset)
+            dictionary = f.read(index_offset - dictionary_offset)
+            self.index = [INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+                          for _ in range(num_blocks)]
+
+        self.pairs = [tuple(line.split(",")) for line in dictionary.split("\n")]
+
+        # The time of each block's last event, to find where to start.
+        self.last_times = [entry[4] for entry in self.index]
+
+    def events(self, start_time=None, end_time=None):
+        """Yield (event, state, time) for the events from start_time up to
+        and including end_time, in order. Either can be None, to go from the
+        beginning or to the end.
+        """
+        first = 0
+        if start_time is not None:
+            first = bisect.bisect_left(self.last_times, start_time)
+
+        with open(self.file_name, "rb") as f:
+            for offset, size, _, block_start, _ in self.index[first:]:
+                if end_time is not None and block_start > end_time:
+                    return
+
+                f.seek(offset)
+                values = decode_varints(
+                    bytearray(zlib.decompress(f.read(size))))
+                time = block_start
+                for code in values:
+                    time += next(values)
+                    if end_time is not None and time > end_time:
+                        return
+                    if start_time is None or time >= start_time:
+                        event, state = self.pairs[code]
+                        yield event, state, time
+
+
+def pack_csv(csv_name, pack_name):
+    """Pack the csv trace csv_name into pack_name."""
+    with open(csv_name, "r") as csv_file:
+        with TraceWriter(pack_name) as writer:
+            for line in csv_file:
+                event, state, ts = line.rstrip("\n").split(",")
+                writer.write(event, state, int(ts))
+
+
+def main(argv):
+    names = argv[1:]
+    if not names:
+        print USAGE
+        return
+
+    for name in names:
+        csv_name = CSV_FILE_FMT.format(name)
+        if not os.path.exists(csv_name):
+            print "No such trace: {}".format(csv_name)
+            continue
+
+        pack_name = PACK_FILE_FMT.format(name)
+        pack_csv(csv_name, pack_name)
+        print "{}: {} bytes --> {} bytes".format(
+            name, os.path.getsize(csv_name), os.path.getsize(pack_name))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
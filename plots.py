@@ -0,0 +1,87 @@
+"""Plots of simulation results, drawn in a background process."""
+import multiprocessing
+import os
+
+PLOT_DIR = "./plots"
+
+# Size of each plot (or panel), in inches, and its resolution. Series are
+# thinned out to about two points per pixel of width before they're drawn;
+# anything more is invisible anyway.
+FIGURE_SIZE = (6.4, 4.8)
+DPI = 100
+PLOT_WIDTH_PIXELS = int(FIGURE_SIZE[0] * DPI)
+
+
+def decimate(points, width=PLOT_WIDTH_PIXELS):
+    """Thin (x, y) points, sorted by x, down to a min and max per pixel."""
+    if len(points) <= 2 * width:
+        return points
+
+    x0 = points[0][0]
+    span = points[-1][0] - x0 + 1
+    out = []
+    column = 0
+    lo = hi = points[0]
+    for point in points[1:]:
+        c = (point[0] - x0) * width / span
+        if c != column:
+            out.extend(sorted(set([lo, hi])))
+            column = c
+            lo = hi = point
+        elif point[1] < lo[1]:
+            lo = point
+        elif point[1] > hi[1]:
+            hi = point
+    out.extend(sorted(set([lo, hi])))
+    return out
+
+
+def draw_runtime_plots(series, one_figure):
+    # A non-interactive backend, since nobody's looking at the window. It
+    # has to be picked before pyplot is imported.
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    if not os.path.exists(PLOT_DIR):
+        os.makedirs(PLOT_DIR)
+
+    series = [(name, decimate(points)) for name, points in series]
+
+    if one_figure:
+        fig, axes = plt.subplots(
+            len(series), 1, squeeze=False, dpi=DPI,
+            figsize=(FIGURE_SIZE[0], FIGURE_SIZE[1] * len(series)))
+        for ax, (name, points) in zip([row[0] for row in axes], series):
+            plot_runtimes(ax, name, points)
+        fig.tight_layout()
+        fig.savefig('{}/runtime_all.png'.format(PLOT_DIR))
+        plt.close(fig)
+        return
+
+    for name, points in series:
+        fig, ax = plt.subplots(figsize=FIGURE_SIZE, dpi=DPI)
+        plot_runtimes(ax, name, points)
+        fig.savefig('{}/runtime_{}.png'.format(PLOT_DIR, name))
+        plt.close(fig)
+
+
+def plot_runtimes(ax, name, points):
+    ax.set_title("Estimated Runtime: {}".format(name))
+    ax.set_xlabel("Time (nanos)")
+    ax.set_ylabel("Estimated Runtime (nanos)")
+    ax.plot([x[0] for x in points], [x[1] for x in points])
+
+
+def start_runtime_plots(procs, one_figure=False):
+    """Plot estimated runtimes (moving avg) vs time for each process.
+
+    The plots are drawn by a background process, so that results can be
+    reported in the meantime; join() the returned process to wait for them.
+    If one_figure is set, every process gets a panel in a single figure.
+    """
+    series = [(p.name, p.average_runtime_points.points()) for p in procs]
+    worker = multiprocessing.Process(target=draw_runtime_plots,
+                                     args=(series, one_figure))
+    worker.start()
+    return worker
@@ -1,22 +1,31 @@
 import sys
-import matplotlib.pyplot as plt
 
+from estimator import WindowAverage
+from histogram import SchedStats
+from history import History
 from state import State, RUNNING, SLEEPING
-
-N = 10
+from weights import NICE_0_LOAD, calc_delta_fair, nice_to_weight
 
 class Process(object):
-    def __init__(self, trace_file_name, bname, n, time):
+    def __init__(self, trace_file_name, bname, n, time, estimator=None,
+                 nice=0, start_time=0):
         self.target_latency = 0
         self.bench_name = bname
         self.name = "{}_{}".format(bname, n)
 
+        # The process's share of the CPU relative to others, as CFS load
+        # weights. Its vruntime advances by its runtime scaled by
+        # NICE_0_LOAD / weight.
+        self.nice = nice
+        self.weight, self.inv_weight = nice_to_weight(nice)
+
         # CPU the process should migrate to
         self.target_cpu = None
 
-        # A parsing of the process's trace into a list of states.
+        # A parsing of the process's trace into a list of states. This is
+        # shared with other processes simulating the same trace, so it must
+        # not be modified.
         self.state_list = State.make_state_list_from_trace(trace_file_name, time)
-        self.state_itr = iter(self.state_list)
 
         self.vruntime = 0
 
@@ -24,56 +33,102 @@ class Process(object):
         self.total_sleeptime = 0
 
         self.context_switches = 0
+
+        # How many times the process has moved to another CPU.
+        self.migrations = 0
         self.finished = False
         self.last_duration = 0
 
+        # When the process finished, or None if it hasn't.
+        self.finish_time = None
+
+        # Histograms of the process's waits for the CPU, slices and
+        # utilization, and when it last became runnable (woke up or was
+        # preempted). It's runnable from the start.
+        self.stats = SchedStats()
+        self.runnable_since = 0
+
         # How long the process has been running since it last woke.
         self.curr_runtime = 0
         self.average_runtime = 0
-        self.average_runtime_points = []
-        self.runtime_points = []
 
-        # The first state
-        self.curr_state = self.state_itr.next()
+        # Estimates average_runtime from the runtimes of past wake-sleep
+        # cycles.
+        self.runtime_estimator = (estimator if estimator is not None
+                                  else WindowAverage())
+
+        # Histories of (wall clock time, runtime) and (wall clock time,
+        # average runtime), a point per wake-sleep cycle. They're only kept
+        # for processes that ask for them with record_history().
+        self.average_runtime_points = None
+        self.runtime_points = None
+
+        # Cursor into the state list: the index of the current state, whether
+        # it's RUNNING or SLEEPING, and how much of it is left.
+        self.state_index = 0
+        self.curr_state = self.state_list.kinds[0]
+        self.remaining = self.state_list.durations[0]
+
+        # A process that starts later (e.g. a child forked partway through
+        # its tree's trace) sleeps until start_time, before its first state.
+        # That sleep doesn't count towards its sleeptime.
+        self.start_time = start_time
+        if start_time > 0:
+            self.state_index = -1
+            self.curr_state = SLEEPING
+            self.remaining = start_time
+
+    def record_history(self, cap):
+        """Keep up to cap points of runtime history, for plotting."""
+        self.runtime_points = History(cap)
+        self.average_runtime_points = History(cap)
 
     def is_running(self):
-        return (not self.finished) and self.curr_state.state == RUNNING
+        return (not self.finished) and self.curr_state == RUNNING
 
     def is_sleeping(self):
-        return (not self.finished) and self.curr_state.state == SLEEPING
+        return (not self.finished) and self.curr_state == SLEEPING
+
+    def has_started(self):
+        """Whether the process has reached its first state (see start_time)."""
+        return self.state_index >= 0
 
     def get_time_to_next_run(self):
         if self.finished:
             return sys.maxint
-        elif self.curr_state.state == RUNNING:
+        elif self.curr_state == RUNNING:
             return 0
         else:
-            return self.curr_state.duration
+            return self.remaining
 
     def calc_average_runtime(self):
-        # Average the runtimes available to us in the last N wake-sleep cycles
-        last_n = [p[1] for p in self.runtime_points[-N:]]
-        last_n.append(self.curr_runtime)
-        return sum(last_n) / len(last_n)
+        # Estimate from the runtimes in past wake-sleep cycles, and this one
+        # so far.
+        return self.runtime_estimator.estimate(self.curr_runtime)
 
     def go_to_next_state(self):
-        try:
-            self.curr_state = self.state_itr.next()
-            self.last_duration = self.curr_state.duration
+        if self.state_index + 1 == len(self.state_list):
+            self.finished = True
+            return
+
+        self.state_index += 1
+        self.curr_state = self.state_list.kinds[self.state_index]
+        self.remaining = self.state_list.durations[self.state_index]
+        self.last_duration = self.remaining
 
-            # If we go from running --> sleeping, update the average runtime.
-            if self.curr_state.state == SLEEPING:
-                self.average_runtime = self.calc_average_runtime()
+        # If we go from running --> sleeping, update the average runtime.
+        if self.curr_state == SLEEPING:
+            self.average_runtime = self.calc_average_runtime()
+            self.runtime_estimator.push(self.curr_runtime)
 
-                # What the wall clock time would be if this process were run in
-                # isolation.
+            if self.runtime_points is not None:
+                # What the wall clock time would be if this process were run
+                # in isolation.
                 wall_clock_time = self.total_runtime + self.total_sleeptime
-                self.runtime_points.append((wall_clock_time, self.curr_runtime))
-                self.average_runtime_points.append((wall_clock_time,
-                                                    self.average_runtime))
-                self.curr_runtime = 0
-        except StopIteration:
-            self.finished = True
+                self.runtime_points.append(wall_clock_time, self.curr_runtime)
+                self.average_runtime_points.append(wall_clock_time,
+                                                   self.average_runtime)
+            self.curr_runtime = 0
 
     def run(self, t):
         """Let the process run for time=t.
@@ -82,16 +137,16 @@ class Process(object):
         for less than t, the return value is less than t.
         """
 
-        assert self.curr_state.state == RUNNING
+        assert self.curr_state == RUNNING
 
-        time_run = min(self.curr_state.duration, t)
+        time_run = min(self.remaining, t)
         if time_run <= 0:
             print "WRSFGSDAFDSA"
             print time_run
-            print self.curr_state.duration
+            print self.remaining
         assert time_run > 0
 
-        self.curr_state.duration -= time_run
+        self.remaining -= time_run
         self.curr_runtime += time_run
 
         # Note: runtime is how long the process has run since it woke up.
@@ -117,44 +172,105 @@ class Process(object):
         self.adjust_state()
 
         # Debit time run.
-        self.vruntime += time_run
+        self.vruntime += calc_delta_fair(time_run, self.weight,
+                                         self.inv_weight)
         self.total_runtime += time_run
 
         return time_run
 
+    def run_cycles(self, cycles, timeslice, vruntime_floor):
+        """Run and sleep through whole wake-sleep cycles, in one go.
+
+        This has exactly the effect that run() and sleep() would have on a
+        process that's alone on its CPU, starting at the beginning of a
+        RUNNING state: it runs each RUNNING state to the end in slices of
+        timeslice, sleeps through the SLEEPING state after it, and wakes up
+        with its vruntime raised to at least vruntime_floor (as
+        Scheduler.enqueue_proc would), at the start of the next RUNNING
+        state. The process must not finish. Return how many slices it took.
+        """
+        start = self.state_index
+        end = start + 2 * cycles
+        assert self.curr_state == RUNNING and self.curr_runtime == 0
+        assert end < len(self.state_list)
+
+        durations = self.state_list.durations
+        estimator = self.runtime_estimator
+        weight, inv_weight = self.weight, self.inv_weight
+        slice_vruntime = calc_delta_fair(timeslice, weight, inv_weight)
+        slices = 0
+        for i in xrange(start, end, 2):
+            runtime = durations[i]
+            slices += (runtime + timeslice - 1) / timeslice
+            last_slice = runtime - (runtime - 1) / timeslice * timeslice
+
+            if self.runtime_points is not None:
+                # go_to_next_state() records the point before the last slice
+                # is added to total_runtime.
+                wall_clock_time = (self.total_runtime + runtime - last_slice +
+                                   self.total_sleeptime)
+
+            self.average_runtime = estimator.estimate(runtime)
+            estimator.push(runtime)
+
+            if self.runtime_points is not None:
+                self.runtime_points.append(wall_clock_time, runtime)
+                self.average_runtime_points.append(wall_clock_time,
+                                                   self.average_runtime)
+
+            self.total_runtime += runtime
+
+            # run() charges vruntime a slice at a time, rounding each one.
+            vruntime = ((runtime - last_slice) / timeslice * slice_vruntime +
+                        calc_delta_fair(last_slice, weight, inv_weight))
+            self.vruntime = max(self.vruntime + vruntime, vruntime_floor)
+            self.total_sleeptime += durations[i + 1]
+
+        self.state_index = end
+        self.curr_state = self.state_list.kinds[end]
+        self.remaining = self.last_duration = durations[end]
+        return slices
+
     def get_load(self):
         """Measure the load a process puts on the CPU.
 
         The metric we use is ratio of voluntary runtime to total time spent
-        running or sleeping (but not waiting).
+        running or sleeping (but not waiting), scaled by the process's weight
+        relative to nice 0, as the kernel scales its load averages.
         """
-        return (float(self.total_runtime) /
-                (self.total_runtime + self.total_sleeptime))
+        total = self.total_runtime + self.total_sleeptime
+        if total == 0:
+            # It hasn't started yet.
+            return 0.
+        return (float(self.total_runtime) / total *
+                self.weight / NICE_0_LOAD)
 
     def adjust_state(self):
-        if self.curr_state.duration == 0:
+        if self.remaining == 0:
             self.go_to_next_state()
-        elif self.curr_state.duration < 0:
+        elif self.remaining < 0:
             raise Exception("Duration of curr_state should not be negative.")
 
     def sleep(self, time):
-        if self.curr_state.state != SLEEPING:
+        if self.curr_state != SLEEPING:
             return
 
-        time_sleep = min(time, self.curr_state.duration)
+        time_sleep = min(time, self.remaining)
         assert time_sleep > 0
 
-        self.curr_state.duration -= time_sleep
-        self.total_sleeptime += time_sleep
+        self.remaining -= time_sleep
+        if self.state_index >= 0:
+            self.total_sleeptime += time_sleep
 
         self.adjust_state()
 
     def print_state_list(self):
         duration = 0
-        for state in self.state_list:
+        for state, state_duration in zip(self.state_list.kinds,
+                                         self.state_list.durations):
             print "{} for {} nanos".format(
-                "RUNNING" if state.state == RUNNING else "SLEEPING",
-                str(state.duration))
-            duration += state.duration
+                "RUNNING" if state == RUNNING else "SLEEPING",
+                str(state_duration))
+            duration += state_duration
 
         print "Duration: {} seconds".format(str(float(duration / 10 ** 9)))
@@ -0,0 +1,236 @@
+"""Machine-readable simulation results, stored by a hash of their inputs."""
+import hashlib
+import json
+import os
+import shutil
+
+from counters import Counters
+from histogram import SchedStats
+
+RAW_RESULTS = "./plots/raw_results"
+
+# Files making up a stored run, under RAW_RESULTS/<run hash>/.
+RUN_FILE = "run.json"
+PROCESSES_FILE = "processes.jsonl"
+BENCHMARKS_FILE = "benchmarks.jsonl"
+
+# Bump this whenever the simulator changes in a way that changes its results,
+# so that results stored by older versions aren't served from the cache.
+RESULTS_VERSION = 5
+
+
+def hash_run(json_load, trace_files):
+    """Return a hash of everything a run's results depend on.
+
+    That's the workload config and the contents of every trace it uses, so
+    editing either one (or re-collecting a trace) gets a fresh hash.
+    """
+    h = hashlib.sha1()
+    h.update(str(RESULTS_VERSION))
+    h.update(json.dumps(json_load, sort_keys=True))
+    for trace_file in sorted(set(trace_files)):
+        h.update(trace_file)
+        with open(trace_file, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), ""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def process_record(p):
+    return {
+        "name": p.name,
+        "benchmark": p.bench_name,
+        "context_switches": p.context_switches,
+        "migrations": p.migrations,
+        "total_runtime": p.total_runtime,
+        "total_sleeptime": p.total_sleeptime,
+        "load": p.get_load(),
+        "average_runtime": p.average_runtime,
+        "finished": p.finished,
+        "finish_time": p.finish_time,
+        "stats": p.stats.to_dict(),
+    }
+
+
+def cpu_record(cpu):
+    return {
+        "cpu": cpu.number,
+        "stats": cpu.scheduler.stats.to_dict(),
+    }
+
+
+def benchmark_records(process_records):
+    """Aggregate per-process records into one record per benchmark.
+
+    context_switches is the average over the benchmark's processes; the
+    migrations, runtime and sleeptime are totals. finish_time is when the
+    last of them finished, or None if any didn't.
+    """
+    benchmarks = {}
+    for r in process_records:
+        b = benchmarks.setdefault(r["benchmark"], {
+            "benchmark": r["benchmark"],
+            "proc_count": 0,
+            "context_switches": 0,
+            "migrations": 0,
+            "total_runtime": 0,
+            "total_sleeptime": 0,
+            "finished": True,
+            "finish_time": 0,
+        })
+        b["proc_count"] += 1
+        b["context_switches"] += r["context_switches"]
+        b["migrations"] += r["migrations"]
+        b["total_runtime"] += r["total_runtime"]
+        b["total_sleeptime"] += r["total_sleeptime"]
+        b["finished"] = b["finished"] and r["finished"]
+        b["finish_time"] = (max(b["finish_time"], r["finish_time"])
+                            if b["finish_time"] is not None and
+                            r["finish_time"] is not None else None)
+
+    for b in benchmarks.values():
+        b["context_switches"] /= b["proc_count"]
+    return benchmarks.values()
+
+
+class Results(object):
+    """The results of simulating one workload.
+
+    processes, benchmarks and cpus are lists of records (dicts), in the order
+    they're reported.
+    """
+    def __init__(self, run_hash, json_load, processes, benchmarks,
+                 historical_latencies, counters=None, cpus=None):
+        self.run_hash = run_hash
+        self.json_load = json_load
+        self.processes = processes
+        self.benchmarks = benchmarks
+        self.historical_latencies = historical_latencies
+
+        # The Counters of the simulation that produced these results.
+        self.counters = counters
+        self.cpus = cpus if cpus is not None else []
+
+    @staticmethod
+    def from_simulation(run_hash, json_load, procs, migrator, counters=None,
+                        cpus=()):
+        processes = [process_record(p) for p in procs]
+        return Results(run_hash, json_load, processes,
+                       benchmark_records(processes),
+                       list(migrator.historical_latencies),
+                       counters,
+                       [cpu_record(c) for c in cpus])
+
+    @property
+    def time_packer_active(self):
+        return self.json_load['time_packer_active']
+
+    @property
+    def average_latency(self):
+        """Average target latency over all rebalances, or None if none ran."""
+        lats = self.historical_latencies
+        if not self.time_packer_active or not lats:
+            return None
+        return sum(lats) / len(lats)
+
+    @property
+    def migrations(self):
+        return sum(r["migrations"] for r in self.processes)
+
+    @property
+    def finished(self):
+        return all(r["finished"] for r in self.processes)
+
+    @property
+    def finish_time(self):
+        """When the last process finished, or None if any didn't."""
+        times = [r["finish_time"] for r in self.processes]
+        return max(times) if None not in times else None
+
+    @property
+    def process_stats(self):
+        """The SchedStats of every process, merged."""
+        stats = SchedStats()
+        for r in self.processes:
+            stats.merge(SchedStats.from_dict(r["stats"]))
+        return stats
+
+
+class ResultStore(object):
+    """A directory of stored runs, one subdirectory per run hash.
+
+    Each run is stored as run.json (the hash, workload config, the
+    migrator's historical latencies, the simulator's counters and each CPU's
+    histograms), plus processes.jsonl and benchmarks.jsonl with one record
+    per line. A run is written to a temp directory and renamed into place,
+    so a run that's present is complete.
+    """
+    def __init__(self, root=RAW_RESULTS):
+        self.root = root
+
+    def run_dir(self, run_hash):
+        return os.path.join(self.root, run_hash)
+
+    def __contains__(self, run_hash):
+        return os.path.exists(os.path.join(self.run_dir(run_hash), RUN_FILE))
+
+    def load(self, run_hash):
+        """Return the stored Results for run_hash, or None if there are none."""
+        if run_hash not in self:
+            return None
+
+        run_dir = self.run_dir(run_hash)
+        with open(os.path.join(run_dir, RUN_FILE), "r") as f:
+            run = json.load(f)
+
+        counters = run.get("counters")
+        return Results(run_hash,
+                       run["workload"],
+                       read_jsonl(os.path.join(run_dir, PROCESSES_FILE)),
+                       read_jsonl(os.path.join(run_dir, BENCHMARKS_FILE)),
+                       run["historical_latencies"],
+                       Counters.from_dict(counters) if counters else None,
+                       run.get("cpus"))
+
+    def store(self, results):
+        run_dir = self.run_dir(results.run_hash)
+        if results.run_hash in self:
+            return run_dir
+
+        tmp_dir = "{}.{}.tmp".format(run_dir, os.getpid())
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        with open(os.path.join(tmp_dir, RUN_FILE), "w") as f:
+            json.dump({
+                "hash": results.run_hash,
+                "workload": results.json_load,
+                "historical_latencies": results.historical_latencies,
+                "average_latency": results.average_latency,
+                "finished": results.finished,
+                "counters": (results.counters.to_dict()
+                             if results.counters is not None else None),
+                "cpus": results.cpus,
+            }, f, indent=4, sort_keys=True)
+        write_jsonl(os.path.join(tmp_dir, PROCESSES_FILE), results.processes)
+        write_jsonl(os.path.join(tmp_dir, BENCHMARKS_FILE), results.benchmarks)
+
+        try:
+            os.rename(tmp_dir, run_dir)
+        except OSError:
+            # Another run with the same hash (e.g. from a sweep) beat us to it.
+            shutil.rmtree(tmp_dir)
+        return run_dir
+
+
+def write_jsonl(file_name, records):
+    with open(file_name, "w") as f:
+        for r in records:
+            f.write(json.dumps(r, sort_keys=True))
+            f.write("\n")
+
+
+def read_jsonl(file_name):
+    with open(file_name, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
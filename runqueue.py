@@ -0,0 +1,159 @@
+"""Priority queues for the Scheduler's runnable and sleeping processes."""
+import heapq
+import itertools
+
+# Rebuild the heap once this many dead entries have piled up per live one.
+COMPACTION_FACTOR = 2
+
+
+class ProcessHeap(object):
+    """Min-heap of processes with lazy deletion.
+
+    Each entry is a list [key, seq, process, ...]. Removing an arbitrary
+    process (e.g. when it migrates off the CPU) doesn't search the heap; its
+    entry is just marked dead and skipped when it reaches the top. Ties in key
+    are broken by insertion order, so the process at the top is the same one
+    min() would pick from a list of the processes in the order they were
+    appended.
+    """
+    def __init__(self):
+        self.heap = []
+
+        # Map from process --> its live heap entry.
+        self.entries = {}
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, p):
+        return p in self.entries
+
+    def __iter__(self):
+        """Iterate over the queued processes in the order they were added."""
+        for entry in sorted(self.entries.values(), key=lambda e: e[1]):
+            yield entry[2]
+
+    def push_entry(self, key, p, *extra):
+        assert p not in self.entries
+        entry = [key, next(self.counter), p] + list(extra)
+        self.entries[p] = entry
+        heapq.heappush(self.heap, entry)
+
+    def remove_entry(self, p):
+        entry = self.entries.pop(p)
+        entry[2] = None
+
+        if len(self.heap) > COMPACTION_FACTOR * (len(self.entries) + 1):
+            self.heap = [e for e in self.heap if e[2] is not None]
+            heapq.heapify(self.heap)
+
+        return entry
+
+    def peek_entry(self):
+        while self.heap and self.heap[0][2] is None:
+            heapq.heappop(self.heap)
+        return self.heap[0] if self.heap else None
+
+    def pop_entry(self):
+        entry = self.peek_entry()
+        if entry is None:
+            return None
+
+        heapq.heappop(self.heap)
+        del self.entries[entry[2]]
+        return entry
+
+
+class RunQueue(ProcessHeap):
+    """Runnable processes keyed on vruntime, standing in for CFS's rbtree.
+
+    A process's vruntime must not change while it is on the runqueue. The
+    total weight of the queued processes is kept up to date as they come and
+    go, like the kernel's cfs_rq load, so that timeslices don't need a pass
+    over the queue.
+    """
+    def __init__(self, procs=()):
+        super(RunQueue, self).__init__()
+        self.load_weight = 0
+        for p in procs:
+            self.enqueue(p)
+
+    def enqueue(self, p):
+        self.push_entry(p.vruntime, p)
+        self.load_weight += p.weight
+
+    def remove(self, p):
+        """Take p off the runqueue without picking it (e.g. to migrate it)."""
+        self.remove_entry(p)
+        self.load_weight -= p.weight
+
+    def peek(self):
+        """Return the process with the smallest vruntime, or None."""
+        entry = self.peek_entry()
+        return entry[2] if entry is not None else None
+
+    def pick_next(self):
+        """Remove and return the process with the smallest vruntime, or None."""
+        entry = self.pop_entry()
+        if entry is None:
+            return None
+        self.load_weight -= entry[2].weight
+        return entry[2]
+
+
+class SleeperQueue(ProcessHeap):
+    """Sleeping processes keyed on the absolute time they wake up.
+
+    Times are measured against the owning scheduler's clock. A sleeper's
+    total_sleeptime is only brought up to date (settled) when it wakes, when
+    it leaves the queue, or when settle() is called explicitly, so advancing
+    the clock costs nothing for processes that aren't due to wake.
+    """
+    def add(self, p, now):
+        assert p.is_sleeping()
+        self.push_entry(now + p.remaining, p, now)
+
+    def remove(self, p, now):
+        """Take p off the queue (e.g. to migrate it), settling its sleep."""
+        self.settle_entry(self.entries[p], now)
+        self.remove_entry(p)
+
+    def next_wakeup_time(self):
+        """Return when the earliest sleeper wakes up."""
+        return self.peek_entry()[0]
+
+    def pop_woken(self, now):
+        """Remove the sleepers whose wakeup time has passed.
+
+        Return (wakeup time, process) pairs, in the order they went to sleep.
+        The processes are either runnable or, if the sleep was the end of
+        their trace, finished.
+        """
+        woken = []
+        while True:
+            entry = self.peek_entry()
+            if entry is None or entry[0] > now:
+                break
+
+            self.pop_entry()
+            self.settle_entry(entry, now)
+            woken.append(entry)
+
+        woken.sort(key=lambda e: e[1])
+        return [(e[0], e[2]) for e in woken]
+
+    def settle(self, now):
+        """Bring the sleep time of every sleeper up to date."""
+        for entry in self.entries.values():
+            self.settle_entry(entry, now)
+
+    @staticmethod
+    def settle_entry(entry, now):
+        p, settled_at = entry[2], entry[3]
+        if now > settled_at:
+            p.sleep(now - settled_at)
+            entry[3] = now
+            if p.finished:
+                # The sleep was the end of its trace.
+                p.finish_time = entry[0]
@@ -1,7 +1,15 @@
+import bisect
 import os
 
+from counters import Counters
+from histogram import SchedStats
+from runqueue import RunQueue, SleeperQueue
+
 PLOT_DIR = "./plots"
-RAW_RESULTS = "./plots/raw_results"
+
+# The shortest slice a process gets, in nanos, however small the target
+# latency is.
+MIN_TIMESLICE = 1
 
 class Scheduler(object):
     def __init__(self, procs, target_latency):
@@ -12,72 +20,153 @@ class Scheduler(object):
         # processes.
         self.processes = [p for p in procs]
 
-        # Procs waiting to take a turn on the CPU
-        self.waiting_procs = [p for p in procs]
+        # Procs waiting to take a turn on the CPU, ordered by vruntime.
+        self.waiting_procs = RunQueue(p for p in procs if p.is_running())
 
-        # Sleeping procs (waiting for IO and such)
-        self.sleeping_procs = []
+        # Sleeping procs (waiting for IO and such), ordered by wakeup time.
+        # Processes that start later sleep until then.
+        self.sleeping_procs = SleeperQueue()
+        for p in procs:
+            if p.is_sleeping():
+                self.sleeping_procs.add(p, 0)
 
-        # Proc running right now
+        # Proc running right now, and how long its current slice is and when
+        # it ends.
         self.curr_proc = None
+        self.slice_length = 0
+        self.slice_end = 0
 
-        self.residual_time = 0
+        # The time this scheduler has been simulated up to. Slice ends and
+        # sleepers' wakeup times are measured against this clock.
+        self.clock = 0
 
         # Smallest vruntime of a process on this scheduler.
         self.min_vruntime = 0
 
+        # Called with this scheduler whenever something other than a call to
+        # advance() may have moved its next event (e.g. a process was enqueued
+        # on it from another CPU). Set by the EventEngine driving it.
+        self.on_change = None
+
+        # If set, called with this scheduler and the time when it has nothing
+        # left to run, to pull a process from another CPU. Returns whether it
+        # did.
+        self.on_idle = None
+
+        # Counts of slices, wakeups and so on. The EventEngine driving this
+        # scheduler shares one between all of its CPUs.
+        self.counters = Counters()
+
+        # Histograms of the waits, slices and utilization of this CPU, over
+        # every process that ran on it.
+        self.stats = SchedStats()
+
+    def __getstate__(self):
+        # on_change and on_idle belong to the engine driving us, which sets
+        # them again.
+        state = self.__dict__.copy()
+        state["on_change"] = None
+        state["on_idle"] = None
+        return state
+
     def migrate_procs(self):
+        for p in self.take_migrating_procs():
+            self.send_to_target(p)
+
+    def take_migrating_procs(self):
+        """Take the waiting and sleeping processes that belong on other CPUs
+        off this one, and return them.
+        """
         # Gather all of processes that need migration.
-        migrating_procs = [p for p in (self.waiting_procs + self.sleeping_procs)
+        migrating_procs = [p for p in (list(self.waiting_procs) +
+                                       list(self.sleeping_procs))
                            if p.target_cpu.scheduler != self]
 
         for p in migrating_procs:
-            self.migrate_proc(p)
+            self.take_proc(p)
+        return migrating_procs
 
     def migrate_proc(self, p):
+        self.take_proc(p)
+        self.send_to_target(p)
+
+    def take_proc(self, p):
         # We can't migrate the current process, because it's running. It will
         # migrate when it goes to sleep if it needs to.
         assert self.curr_proc != p
 
         self.processes.remove(p)
-        target_scheduler = p.target_cpu.scheduler
 
         if p.is_running():
             self.waiting_procs.remove(p)
-            target_scheduler.enqueue_proc(p, True)
         else:
-            self.sleeping_procs.remove(p)
-            target_scheduler.enqueue_migrated_sleeper(p)
+            self.sleeping_procs.remove(p, self.clock)
+
+    def send_to_target(self, p):
+        """Hand p, which has just left this scheduler, to its target CPU."""
+        p.migrations += 1
+        self.counters.migrations += 1
+        p.target_cpu.scheduler.receive(p, self.clock)
+
+    def receive(self, p, now):
+        """Take in p, which left another CPU at time now."""
+        # The target may have been idle for a while; the process arrives here
+        # now, not whenever we last did something.
+        self.catch_up(now)
+
+        if p.is_running():
+            self.enqueue_proc(p, migrated=True)
+        else:
+            self.enqueue_migrated_sleeper(p)
+
+    def catch_up(self, now):
+        """Move the clock up to now.
+
+        Nothing on this CPU may be due before now.
+        """
+        self.clock = max(self.clock, now)
+
+    def notify(self):
+        if self.on_change is not None:
+            self.on_change(self)
 
     def get_timeslice(self):
         """Get the timeslice a process should run for."""
         # According to CFS, all currently waiting processes should be able to
-        # run within the target latency. Note that we don't implement weighted
-        # priorities as CFS does - every process runs with the same priority.
+        # run within the target latency, each getting a share of it in
+        # proportion to its weight.
+        #
+        # Like the kernel, we keep time in whole nanos. The migrator's
+        # latencies can be fractional, and fractional slices leave rounding
+        # residue in the clock that can strand a sleeper a hair short of
+        # waking up. A latency too small to share out still gives each
+        # process MIN_TIMESLICE, so that slices always make progress.
         if self.curr_proc is None:
             raise Exception("Must have a process to run.")
-        return self.target_latency / (len(self.waiting_procs) + 1)
-
-    def update_sleeping_procs(self, sleep_time):
-        """Mark that the sleeping processes have slept for sleep_time."""
-        for p in self.sleeping_procs:
-            p.sleep(sleep_time)
-
-        # Procs that were sleeping but are now running.
-        woken_procs = [p for p in self.sleeping_procs if p.is_running()]
-
-        # Get rid of the procs that are 1) running or 2) finished
-        self.sleeping_procs = [p for p in self.sleeping_procs
-                               if p.is_sleeping()]
+        weight = self.curr_proc.weight
+        return max(MIN_TIMESLICE,
+                   int(self.target_latency) * weight /
+                   (self.waiting_procs.load_weight + weight))
+
+    def wake_sleepers(self):
+        """Put the sleepers whose wakeup time has come on a runqueue."""
+        for wakeup_time, p in self.sleeping_procs.pop_woken(self.clock):
+            self.counters.wakeups += 1
+
+            # The sleep could have finished off the process.
+            if not p.is_running():
+                continue
 
-        for p in woken_procs:
-            target_scheduler = p.target_cpu.scheduler
-            migrating = (target_scheduler != self)
+            # It's been waiting for the CPU since it woke, even if that was in
+            # the middle of someone else's slice.
+            p.runnable_since = wakeup_time
 
             # Migrate the woken procs if necessary
-            if migrating:
+            if p.target_cpu.scheduler != self:
                 self.processes.remove(p)
-            p.target_cpu.scheduler.enqueue_proc(p, migrated=migrating)
+                self.send_to_target(p)
+            else:
+                self.enqueue_proc(p)
 
     def enqueue_proc(self, p, migrated=False):
         # Adjust the timeslice of newly woken processes, just as CFS does in
@@ -98,122 +187,210 @@ class Scheduler(object):
             self.processes.append(p)
 
         # Add the woken proc to the runqueue.
-        self.waiting_procs.append(p)
+        self.waiting_procs.enqueue(p)
+        self.notify()
+
+    def settle_sleepers(self):
+        """Bring sleepers' total_sleeptime up to date with the clock."""
+        self.sleeping_procs.settle(self.clock)
 
     def enqueue_migrated_sleeper(self, sleeper):
-        self.sleeping_procs.append(sleeper)
+        self.sleeping_procs.add(sleeper, self.clock)
         self.processes.append(sleeper)
         sleeper.vruntime = self.min_vruntime + self.target_latency
-
-    def run(self, time):
-        # How long we want to simulate for
-        target_sim_time = time + self.residual_time
-
-        # How long we've simulated for in the current call to run()
-        sim_time = 0
-
-        # Keep going while any process needs to run.
-        while any([not p.finished for p in self.processes]):
-            time_left = target_sim_time - sim_time
-            if not time_left > 0:
-                break
-
-            # If no procs want to run, fast forward time; we need to have a
-            # runnable process before we continue with this loop.
+        self.notify()
+
+    def next_event_time(self):
+        """Return when something next happens on this CPU.
+
+        That's the end of the current slice if a process is running, right now
+        if the CPU is idle with processes waiting, and otherwise the next
+        sleeper waking up. Sleepers that wake in the middle of a slice don't
+        need an event of their own; they go on the runqueue when the slice
+        ends, just as CFS only reschedules on a tick. Return None if every
+        process on this CPU has finished.
+        """
+        if self.curr_proc is not None:
+            return self.slice_end
+        elif self.waiting_procs:
+            return self.clock
+        elif self.sleeping_procs:
+            return self.sleeping_procs.next_wakeup_time()
+        return None
+
+    def advance(self, now):
+        """Simulate this CPU up to time now, handling everything due by then.
+
+        now must not be past next_event_time().
+        """
+        assert now >= self.clock
+        if self.curr_proc is None and now > self.clock:
+            # Nothing was running, so we jump straight past the idle time.
+            self.counters.idle_skips += 1
+            self.counters.idle_time += now - self.clock
+        self.clock = now
+
+        slice_over = self.curr_proc is not None and now >= self.slice_end
+
+        # Run the current process for its slice, or until it wants to get off
+        # the CPU.
+        if slice_over:
+            self.curr_proc.run(self.slice_length)
+            slice_start = self.slice_end - self.slice_length
+            self.curr_proc.stats.record_slice(slice_start, self.slice_end)
+            self.stats.record_slice(slice_start, self.slice_end)
+
+        self.wake_sleepers()
+
+        if slice_over:
+            self.switch_procs()
+
+        # If the CPU was idle, pick something to run. Either way, a process
+        # that's on the CPU without a slice gets one.
+        if slice_over or self.curr_proc is None:
             if self.curr_proc is None:
-                if not self.waiting_procs:
-                    # Find the min time we need to wait for a process to wake up.
-                    min_sleep_proc = min(self.sleeping_procs,
-                                         key=lambda p: p.get_time_to_next_run())
-                    time_to_next_run = min_sleep_proc.curr_state.duration
-
-                    # Cap it at the time remaining in the simulation.
-                    min_sleep_time = min(time_to_next_run, time_left)
-                    assert min_sleep_time > 0
-
-                    # Give the sleeping processes some time to sleep. After this
-                    # there is hopefully at least one runnable process.
-                    self.update_sleeping_procs(min_sleep_time)
-
-                    sim_time += min_sleep_time
-
-                    # The sleep could have finished off the process. In that
-                    # case, there will still not be any waiting processes. It
-                    # could also be the case that the woken process has
-                    # migrated. In either of these cases, we just try again.
-                    if (min_sleep_proc.finished or
-                            min_sleep_proc.target_cpu.scheduler != self):
-                        continue
-
-                    # The only way there's still no waiting processes is if the
-                    # sleep time was capped by time_left.
-                    elif not self.waiting_procs:
-                        assert min_sleep_time < time_to_next_run
-                        return
-
-                # By now, there absolutely MUST be a waiting process.
-                self.curr_proc = self.min_vruntime_process()
-                self.waiting_procs.remove(self.curr_proc)
-
-                # Try the loop again, now that self.curr_proc is not None.
-                continue
-
-            # Figure out how long we should run the current process for.
-            ideal_slice = self.get_timeslice()
-
-            # If we don't have enough time to run this slice, break.
-            if ideal_slice > time_left:
-                self.residual_time = time_left
-                break
-
-            # Run it for that time, or until it wants to get off the CPU
-            runtime = self.curr_proc.run(ideal_slice)
-
-            sim_time += runtime
-
-            # Mark down the waiting times of all sleeping procs
-            self.update_sleeping_procs(runtime)
-
-            # Case 1: curr_proc is finished
-            if self.curr_proc.finished:
-                self.curr_proc = self.min_vruntime_process()
-                if self.curr_proc is not None:
-                    self.waiting_procs.remove(self.curr_proc)
-                    self.min_vruntime = self.curr_proc.vruntime
-
-            # Case 2: curr_proc wants more time, but we need to context switch.
-            elif self.curr_proc.is_running():
-                # If processes are waiting, context switch this one off the CPU
-                next_candidate = self.min_vruntime_process()
-                if next_candidate is not None:
-                    # Put next_candidate as the current process and put the
-                    # current process back on the runqueue.
-                    kicked_proc = self.curr_proc
-                    self.curr_proc.context_switches += 1
-                    self.waiting_procs.append(self.curr_proc)
-                    self.curr_proc = next_candidate
-                    self.waiting_procs.remove(next_candidate)
-                    self.min_vruntime = self.curr_proc.vruntime
-
-                    if kicked_proc.target_cpu.scheduler != self:
-                        self.migrate_proc(kicked_proc)
-
-            # Case 3: curr_proc wants to sleep, so we put it on list of sleepers
+                self.curr_proc = self.pick_next()
+
+            # With nothing to run here, see if another CPU has something.
+            if (self.curr_proc is None and self.on_idle is not None and
+                    self.on_idle(self, self.clock)):
+                self.curr_proc = self.pick_next()
+
+            if self.curr_proc is not None:
+                self.start_slice()
+
+    def run_alone(self, limit):
+        """Fast-forward a process that has this CPU to itself, up to limit.
+
+        If the current process is alone here, isn't due to migrate, and has
+        just started a slice at the beginning of a RUNNING state, then nothing
+        else can happen on this CPU until limit: it just runs and sleeps
+        through its trace. Rather than go event by event, jump straight
+        through every whole wake-sleep cycle that ends (with the process
+        waking up) by limit. Return whether we jumped.
+        """
+        p = self.curr_proc
+        if (p is None or self.waiting_procs or self.sleeping_procs or
+                p.target_cpu.scheduler is not self or p.curr_runtime != 0 or
+                p.remaining != p.state_list.durations[p.state_index] or
+                self.slice_end != self.clock + self.slice_length):
+            return False
+
+        timeslice = self.get_timeslice()
+
+        # Find the last RUNNING state the process can wake into by limit, short
+        # of its final state.
+        start_times = p.state_list.get_start_times()
+        start = p.state_index
+        last = bisect.bisect_right(start_times,
+                                   start_times[start] + (limit - self.clock),
+                                   start, len(p.state_list)) - 1
+        cycles = (last - start) // 2
+        if cycles <= 0:
+            return False
+
+        wakeup_time = (self.clock + start_times[start + 2 * cycles] -
+                       start_times[start])
+        sleeptime = p.total_sleeptime
+        slices = p.run_cycles(cycles, timeslice,
+                              self.min_vruntime - self.target_latency)
+        sleeptime = p.total_sleeptime - sleeptime
+        self.record_cycles(p, start, cycles, timeslice)
+
+        # Count everything as if we'd gone event by event. The slice started
+        # on the last wakeup is counted by start_slice().
+        self.counters.slices += slices - 1
+        self.counters.wakeups += cycles
+        self.counters.idle_skips += cycles
+        self.counters.idle_time += sleeptime
+
+        self.clock = wakeup_time
+        self.start_slice()
+        return True
+
+    def record_cycles(self, p, start, cycles, timeslice):
+        """Record the slices, waits and busy time of the wake-sleep cycles
+        that run_alone() fast-forwards p through, from the clock on.
+
+        Those are the same as going event by event: the cycles' RUNNING
+        states run back to back in slices of timeslice, and every wakeup is
+        picked to run straight away.
+        """
+        durations = p.state_list.durations
+        start_time = self.clock
+        for i in xrange(start, start + 2 * cycles, 2):
+            runtime = durations[i]
+            full_slices = (runtime - 1) / timeslice
+            last_slice = runtime - full_slices * timeslice
+            for stats in (p.stats, self.stats):
+                if full_slices:
+                    stats.slices.record(timeslice, full_slices)
+                stats.slices.record(last_slice)
+                stats.add_busy(start_time, start_time + runtime)
+            start_time += runtime + durations[i + 1]
+
+        p.stats.waits.record(0, cycles)
+        self.stats.waits.record(0, cycles)
+
+    def pick_next(self):
+        """Take the next process to run off the runqueue, recording how long
+        it waited. Return None if there's none.
+        """
+        p = self.waiting_procs.pick_next()
+        if p is not None:
+            wait = self.clock - p.runnable_since
+            p.stats.waits.record(wait)
+            self.stats.waits.record(wait)
+        return p
+
+    def start_slice(self):
+        self.counters.slices += 1
+
+        # Figure out how long we should run the current process for.
+        ideal_slice = self.get_timeslice()
+
+        # Run it for that time, or until it wants to get off the CPU.
+        self.slice_length = min(ideal_slice, self.curr_proc.remaining)
+        self.slice_end = self.clock + self.slice_length
+
+    def switch_procs(self):
+        """Decide what runs next, now that the current slice is over."""
+        # Case 1: curr_proc is finished
+        if self.curr_proc.finished:
+            self.curr_proc.finish_time = self.clock
+            self.curr_proc = self.pick_next()
+            if self.curr_proc is not None:
+                self.min_vruntime = self.curr_proc.vruntime
+
+        # Case 2: curr_proc wants more time, but we need to context switch.
+        elif self.curr_proc.is_running():
+            # If processes are waiting, context switch this one off the CPU
+            next_candidate = self.pick_next()
+            if next_candidate is not None:
+                # Put next_candidate as the current process and put the
+                # current process back on the runqueue.
+                kicked_proc = self.curr_proc
+                self.curr_proc.context_switches += 1
+                self.curr_proc.runnable_since = self.clock
+                self.waiting_procs.enqueue(self.curr_proc)
+                self.curr_proc = next_candidate
+                self.min_vruntime = self.curr_proc.vruntime
+
+                if kicked_proc.target_cpu.scheduler != self:
+                    self.migrate_proc(kicked_proc)
+
+        # Case 3: curr_proc wants to sleep, so we put it on list of sleepers
+        else:
+            if self.curr_proc.target_cpu.scheduler != self:
+                self.processes.remove(self.curr_proc)
+                self.send_to_target(self.curr_proc)
             else:
-                target_scheduler = self.curr_proc.target_cpu.scheduler
-                if target_scheduler != self:
-                    target_scheduler.enqueue_migrated_sleeper(self.curr_proc)
-                    self.processes.remove(self.curr_proc)
-                else:
-                    self.sleeping_procs.append(self.curr_proc)
-
-                self.curr_proc = self.min_vruntime_process()
+                self.sleeping_procs.add(self.curr_proc, self.clock)
 
-                # If a process wants to run, remove it from waiting list.
-                if self.curr_proc is not None:
-                    self.waiting_procs.remove(self.curr_proc)
-                    self.min_vruntime = self.curr_proc.vruntime
+            # If a process wants to run, take it off the runqueue.
+            self.curr_proc = self.pick_next()
+            if self.curr_proc is not None:
+                self.min_vruntime = self.curr_proc.vruntime
 
     def min_vruntime_process(self):
-        return (min(self.waiting_procs, key=lambda p: p.vruntime)
-                if self.waiting_procs else None)
+        return self.waiting_procs.peek()
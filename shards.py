@@ -0,0 +1,436 @@
+"""Simulating a workload's CPUs in several worker processes at once.
+
+Each worker simulates a contiguous group of the CPUs on its own EventEngine.
+Between migrator ticks, CPUs only hear from each other when a process that
+the migrator retargeted while it was running leaves its CPU. Until the first
+moment that could happen across workers, every worker simulates its CPUs
+independently; at that moment, the workers take turns in CPU order, exactly
+as a single engine would.
+
+At each tick, the workers report what the migrator needs to know about their
+processes (average runtime, load, weight and which CPU they're on). A Migrator
+in the coordinating process rebalances copies of the CPUs holding those
+summaries, and the workers are told where their processes go. Only processes
+that move between workers are shipped, so results are the same as simulating
+every CPU in one process.
+"""
+import copy
+import multiprocessing
+import traceback
+
+from counters import Counters
+from cpu import CPU
+from engine import EventEngine
+
+
+class ProcSummary(object):
+    """What the migrator knows about a process that a worker simulates."""
+    def __init__(self, name):
+        self.name = name
+        self.average_runtime = 0
+        self.load = 0.
+        self.weight = 0
+        self.finished = False
+
+        # The (coordinator's copy of the) CPU the process should be on.
+        self.target_cpu = None
+
+    def get_load(self):
+        return self.load
+
+    def has_started(self):
+        # Workers only summarize processes that have started.
+        return True
+
+
+class Outbox(object):
+    """Stands in for the scheduler of a CPU that another worker simulates.
+
+    Processes sent to the CPU are held in shipments, as (process, CPU number,
+    time they left) in the order they were sent, until they're shipped.
+    """
+    def __init__(self, number, shipments):
+        self.number = number
+        self.shipments = shipments
+
+        # Set to the engine's mark_dirty, so that the engine stops whatever
+        # it's doing when a process is sent across.
+        self.on_change = None
+
+    def receive(self, p, now):
+        self.shipments.append((p, self.number, now))
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def next_event_time(self):
+        # Nothing happens here; it's somewhere else.
+        return None
+
+
+class Worker(object):
+    """Simulates some of the CPUs, on orders from the ShardedEngine.
+
+    cpus are all of the simulation's CPUs (as they were when the worker was
+    forked); the worker keeps the ones numbered in numbers, and sends
+    processes bound for the others to their Outboxes.
+    """
+    def __init__(self, cpus, numbers):
+        self.cpus = {c.number: c for c in cpus}
+        self.local = [c for c in cpus if c.number in numbers]
+        self.shipments = []
+
+        # Map from process name --> process that's left one of our CPUs for
+        # another, and is waiting to be delivered there.
+        self.leaving = {}
+
+        self.engine = EventEngine(self.local)
+        for c in cpus:
+            if c.number not in numbers:
+                c.scheduler = Outbox(c.number, self.shipments)
+                c.scheduler.on_change = self.engine.mark_dirty
+
+        self.engine.start()
+        self.engine.retargeted()
+        self.engine.reschedule_dirty()
+
+    def status(self):
+        """Return the next live event on our calendar (or None), the
+        earliest time a process could leave us for another worker, and the
+        processes that have.
+        """
+        crossings = [s.next_event_time() for s in self.engine.schedulers
+                     if s.curr_proc is not None and
+                     isinstance(s.curr_proc.target_cpu.scheduler, Outbox)]
+        return (self.engine.peek(), min(crossings or [float("inf")]),
+                self.take_shipments())
+
+    def take_shipments(self):
+        """Return the processes sent to other workers, ready to ship.
+
+        A process's target CPU is replaced by its number, so that shipping
+        it doesn't drag our CPUs along.
+        """
+        shipments = list(self.shipments)
+        del self.shipments[:]
+        for p, number, _ in shipments:
+            p.target_cpu = number
+        return shipments
+
+    def run(self, until):
+        self.engine.run(until)
+        return self.status()
+
+    def step(self, time, below):
+        """Handle our events at time on CPUs numbered below below, in order,
+        until one of them sends a process to another worker.
+        """
+        while not self.shipments:
+            event = self.engine.peek()
+            if event is None or event[0] != time or event[2] >= below:
+                break
+
+            # Handle one event at a time, since another worker's CPU might
+            # have to go in between.
+            self.engine.until = time - 1
+            try:
+                self.engine.step()
+            finally:
+                self.engine.until = None
+        return self.status()
+
+    def receive(self, shipments):
+        for shipment in shipments:
+            self.unpack(shipment)
+        self.engine.reschedule_dirty()
+        return self.status()
+
+    def unpack(self, shipment):
+        p, number, now = shipment
+        p.target_cpu = self.cpus[number]
+        p.target_cpu.scheduler.receive(p, now)
+
+    def tick(self, now):
+        """Bring every CPU up to the tick, and summarize its processes.
+
+        Return a list of (CPU number, [(name, average runtime, load,
+        weight)]) for the started processes on each CPU, in the order the
+        migrator would see them.
+        """
+        self.engine.now = now
+        self.engine.catch_up(now)
+        assert not self.shipments
+
+        summaries = []
+        for c in self.local:
+            c.scheduler.settle_sleepers()
+            summaries.append((c.number, [
+                (p.name, p.average_runtime, p.get_load(), p.weight)
+                for p in c.get_unfinished_procs() if p.has_started()]))
+        return summaries
+
+    def retarget(self, targets):
+        """Point processes at their new CPUs, and take the ones that are due
+        to migrate off our CPUs.
+
+        targets is a map from process name --> CPU number. Return the
+        departures, as (CPU number, process name, whatever needs shipping) in
+        the order the processes left. Processes that stay with this worker
+        aren't shipped; they wait in self.leaving until delivered.
+        """
+        for c in self.local:
+            for p in c.get_unfinished_procs():
+                if p.name in targets:
+                    p.target_cpu = self.cpus[targets[p.name]]
+
+        departures = []
+        for c in self.local:
+            for p in c.scheduler.take_migrating_procs():
+                if isinstance(p.target_cpu.scheduler, Outbox):
+                    c.scheduler.send_to_target(p)
+                    departures.append((c.number, p.name,
+                                       self.take_shipments()[0]))
+                else:
+                    self.leaving[p.name] = (c, p)
+                    departures.append((c.number, p.name, None))
+        return departures
+
+    def deliver(self, arrivals, latencies):
+        """Deliver migrating processes to our CPUs, in the order given, then
+        set the CPUs' new target latencies.
+
+        Each arrival is a (name, shipment) pair; shipment is None for
+        processes that left one of our own CPUs.
+        """
+        for name, shipment in arrivals:
+            if shipment is None:
+                c, p = self.leaving.pop(name)
+                c.scheduler.send_to_target(p)
+            else:
+                self.unpack(shipment)
+
+        for c in self.local:
+            c.scheduler.target_latency = latencies[c.number]
+
+        self.engine.retargeted()
+        self.engine.reschedule_dirty()
+        return self.status()
+
+    def finish(self):
+        """Return every process on our CPUs, our counters, and a map from CPU
+        number --> its SchedStats.
+        """
+        procs = []
+        for c in self.local:
+            c.scheduler.settle_sleepers()
+            procs.extend(c.scheduler.processes)
+        for p in procs:
+            p.target_cpu = p.target_cpu.number
+        return (procs, self.engine.counters,
+                {c.number: c.scheduler.stats for c in self.local})
+
+
+def serve(conn, cpus, numbers):
+    """Run a Worker, calling its methods as the ShardedEngine asks."""
+    try:
+        worker = Worker(cpus, numbers)
+        while True:
+            request = conn.recv()
+            if request is None:
+                return
+            method, args = request
+            conn.send((True, getattr(worker, method)(*args)))
+    except Exception:
+        conn.send((False, traceback.format_exc()))
+
+
+class ShardedEngine(object):
+    """Drive the CPUs from several worker processes, ticking the migrator
+    (if there is one) every rebalance_period, like an EventEngine.
+
+    Each worker gets a contiguous group of CPUs, so that most migrations
+    within a bucket stay inside one worker. The workers are forked, and
+    carry on from whatever state the CPUs are in.
+    """
+    def __init__(self, cpus, num_workers, migrator=None, rebalance_period=None,
+                 counters=None, next_tick=None):
+        self.cpus = cpus
+        self.num_workers = min(num_workers, len(cpus))
+        self.rebalance_period = rebalance_period
+        self.counters = counters if counters is not None else Counters()
+
+        # There are only ticks if there's a migrator. next_tick is given if
+        # we're carrying on from an engine that's already started.
+        self.next_tick = None
+        if migrator is not None:
+            self.next_tick = (next_tick if next_tick is not None
+                              else rebalance_period)
+
+        # Copies of the CPUs holding ProcSummaries instead of processes, for
+        # the migrator.
+        self.mirrors = [CPU([], c.scheduler.target_latency, c.number)
+                        for c in cpus]
+        self.mirror_of = {c.number: c for c in self.mirrors}
+        self.summaries = {}
+
+        self.migrator = None
+        if migrator is not None:
+            self.migrator = copy.copy(migrator)
+            self.migrator.cpus = self.mirrors
+            self.migrator.historical_latencies = list(
+                migrator.historical_latencies)
+            self.migrator.breaks_runtimes = {
+                self.summary(p.name): runtime
+                for p, runtime in migrator.breaks_runtimes.items()}
+
+        # Map from CPU number --> the worker that simulates it.
+        self.worker_of = {c.number: i * self.num_workers / len(cpus)
+                          for i, c in enumerate(cpus)}
+        self.conns = []
+        self.workers = []
+
+    def summary(self, name):
+        if name not in self.summaries:
+            self.summaries[name] = ProcSummary(name)
+        return self.summaries[name]
+
+    def start_workers(self):
+        for i in range(self.num_workers):
+            numbers = [n for n, w in self.worker_of.items() if w == i]
+            conn, child_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=serve,
+                                             args=(child_conn, self.cpus,
+                                                   numbers))
+            worker.start()
+            self.conns.append(conn)
+            self.workers.append(worker)
+
+    def stop_workers(self):
+        for conn in self.conns:
+            conn.send(None)
+        for worker in self.workers:
+            worker.join()
+
+    def call(self, i, method, *args):
+        self.conns[i].send((method, args))
+        return self.result(i)
+
+    def call_all(self, method, *args):
+        """Call method on every worker at once, with the same args."""
+        return self.call_each(method, [args] * self.num_workers)
+
+    def call_each(self, method, args):
+        """Call method on every worker at once, with args[i] for worker i."""
+        for conn, a in zip(self.conns, args):
+            conn.send((method, a))
+        return [self.result(i) for i in range(self.num_workers)]
+
+    def result(self, i):
+        ok, result = self.conns[i].recv()
+        if not ok:
+            raise RuntimeError("Worker {} failed:\n{}".format(i, result))
+        return result
+
+    def run(self):
+        """Simulate until every process has finished.
+
+        Return every process, brought back from the workers, in no particular
+        order. Each CPU's SchedStats are brought back too.
+        """
+        self.start_workers()
+        try:
+            statuses = self.call_all("status")
+            while any(s[0] is not None for s in statuses):
+                # The earliest time a process could leave one worker for
+                # another.
+                crossing = min(s[1] for s in statuses)
+                next_tick = (self.next_tick if self.next_tick is not None
+                             else float("inf"))
+                if crossing == float("inf") or crossing > next_tick:
+                    statuses = self.call_all("run", self.next_tick)
+                    if (self.next_tick is not None and
+                            any(s[0] is not None for s in statuses)):
+                        statuses = self.tick(self.next_tick)
+                        self.next_tick += self.rebalance_period
+                else:
+                    statuses = self.call_all("run", crossing - 1)
+                    statuses = self.cross(crossing, statuses)
+
+            finished = self.call_all("finish")
+        finally:
+            self.stop_workers()
+
+        cpus = {c.number: c for c in self.cpus}
+        procs = []
+        for worker_procs, counters, cpu_stats in finished:
+            procs.extend(worker_procs)
+            for number, stats in cpu_stats.items():
+                cpus[number].scheduler.stats = stats
+            for field, _ in Counters.FIELDS:
+                setattr(self.counters, field,
+                        getattr(self.counters, field) +
+                        getattr(counters, field))
+            self.counters.sim_time = max(self.counters.sim_time,
+                                         counters.sim_time)
+        for p in procs:
+            p.target_cpu = cpus[p.target_cpu]
+        return procs
+
+    def cross(self, time, statuses):
+        """Handle every event at time, in CPU order across the workers,
+        shipping processes between them as they go.
+        """
+        while True:
+            due = [(s[0][2], i) for i, s in enumerate(statuses)
+                   if s[0] is not None and s[0][0] == time]
+            if not due:
+                return statuses
+
+            cpu, i = min(due)
+            below = min([c for c, j in due if j != i] or [float("inf")])
+            statuses[i] = self.call(i, "step", time, below)
+            self.ship(statuses[i][2], statuses)
+
+    def ship(self, shipments, statuses):
+        for p, number, now in shipments:
+            i = self.worker_of[number]
+            statuses[i] = self.call(i, "receive", [(p, number, now)])
+
+    def tick(self, now):
+        self.counters.rebalances += 1
+        with self.counters.phase("rebalance"):
+            for summaries in self.call_all("tick", now):
+                for number, procs in summaries:
+                    mirror = self.mirror_of[number]
+                    mirror.scheduler.processes = []
+                    for name, average_runtime, load, weight in procs:
+                        p = self.summary(name)
+                        p.average_runtime = average_runtime
+                        p.load = load
+                        p.weight = weight
+                        p.target_cpu = mirror
+                        mirror.scheduler.processes.append(p)
+
+            self.migrator.rebalance()
+
+            targets = [{} for _ in range(self.num_workers)]
+            for mirror in self.mirrors:
+                for p in mirror.scheduler.processes:
+                    targets[self.worker_of[mirror.number]][p.name] = (
+                        p.target_cpu.number)
+
+            # Deliver every migrating process in the order the CPUs gave
+            # them up, as the migrator would have done itself.
+            departures = sorted(
+                [d for ds in self.call_each("retarget",
+                                            [(t,) for t in targets])
+                 for d in ds],
+                key=lambda d: d[0])
+            arrivals = [[] for _ in range(self.num_workers)]
+            for _, name, shipment in departures:
+                number = self.summary(name).target_cpu.number
+                arrivals[self.worker_of[number]].append((name, shipment))
+
+            latencies = {c.number: c.scheduler.target_latency
+                         for c in self.mirrors}
+            return self.call_each("deliver",
+                                  [(a, latencies) for a in arrivals])
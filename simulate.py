@@ -1,24 +1,72 @@
 #!/usr/bin/python2
+import hashlib
 import json
+import multiprocessing
 import os
 import sys
+import traceback
 
-import matplotlib.pyplot as plt
-
+from counters import Counters
+from balancer import IdleBalancer
 from cpu import CPU
+from engine import EventEngine
+from estimator import estimator_factory
+from histogram import SchedStats
+from history import DEFAULT_CAP
 from migrator import Migrator
+from pack_trace import PACK_FILE_FMT
+from plots import start_runtime_plots
 from process import Process
+from results import Results, ResultStore, hash_run
+from simulation import BRANCHABLE_PARAMS, Simulation
+from state import State
 
 WORKLOAD_DIR = "workloads"
 WORKLOAD_FILE_FMT = "./workloads/{}.json"
 TRACE_FILE_FMT = "./traces/{}.trace.csv"
+TREE_FILE_FMT = "./traces/{}.tree.json"
 
 RUNNING = 0
 SLEEPING = 1
 SCHED_WAKEUP = "sched_wakeup"
 
 NANOS_PER_MILLISECOND = (10 ** 6)
-PLOT_DIR = "./plots"
+DEFAULT_IDLE_BALANCE_PERIOD_MILLIS = 4
+PROFILE_FILE_FMT = "./plots/{}.pstats"
+CHECKPOINT_FILE_FMT = "./plots/checkpoints/{name}_{{millis}}ms.ckpt"
+
+# The percentiles of waits, slices and utilization to report.
+PERCENTILES = [50, 99, 99.9]
+
+USAGE = """Usage: ./simulate.py [FLAGS] <WORKLOAD>
+       ./simulate.py [FLAGS] --resume=<CHECKPOINT> [<PARAM>=<VALUE> ...]
+
+    --rerun         simulate even if the results are already stored
+    --no-plots      don't plot, or keep the histories that plots are made from
+    --one-figure    plot every sample process in one multi-panel figure
+    --stats         print the simulator's counters and throughput
+    --profile       simulate under cProfile (implies --rerun and --stats),
+                    saving the stats to {}
+    --workers=N     split the CPUs between N worker processes, simulated in
+                    parallel
+    --compare       simulate the workload with plain CFS and with the
+                    time-packer side by side, and print how they differ
+                    (implies --no-plots)
+    --checkpoint-every=N
+                    save the whole simulation every N rebalance periods
+                    (implies --rerun), to
+                    {}
+    --resume=CHECKPOINT
+                    carry on simulating from a checkpoint, changing any of
+                    these workload parameters from then on (values are json):
+                    {}""".format(
+                        PROFILE_FILE_FMT.format("<WORKLOAD>"),
+                        CHECKPOINT_FILE_FMT.format(
+                            name="<WORKLOAD>").format(millis="<MILLIS>"),
+                        ",\n                    ".join(BRANCHABLE_PARAMS))
+
+FLAGS = ["--rerun", "--no-plots", "--one-figure", "--stats", "--profile",
+         "--checkpoint-every", "--resume", "--workers", "--compare"]
 
 
 def get_workload(workload):
@@ -37,20 +85,344 @@ def list_workloads():
         print "\t{}".format(f)
 
 
+def parse_flags(argv):
+    """Split argv into a map from flag --> value (None if it has none), and
+    the other arguments.
+    """
+    flags = {}
+    for a in argv[1:]:
+        if a.startswith("--"):
+            flag, _, value = a.partition("=")
+            flags[flag] = value if value else None
+    return flags, [a for a in argv[1:] if not a.startswith("--")]
+
+
+def parse_overrides(args):
+    """Parse PARAM=VALUE arguments into a map from param --> value."""
+    overrides = {}
+    for arg in args:
+        if "=" not in arg:
+            raise ValueError("Expected PARAM=VALUE: {}".format(arg))
+        param, value = arg.split("=", 1)
+        overrides[param] = json.loads(value)
+    return overrides
+
+
+def print_usage():
+    print USAGE
+    print
+    print "Workloads"
+    list_workloads()
+
+
 def main(argv):
-    if len(argv) != 2:
-        print "Usage: ./scheduler.py <WORKLOAD>"
-        print
-        print "Workloads"
-        list_workloads()
+    flags, args = parse_flags(argv)
+    resume = flags.get("--resume")
+
+    if (any(f not in FLAGS for f in flags) or
+            ("--resume" in flags and resume is None) or
+            (resume is None and len(args) != 1)):
+        print_usage()
+        return
+
+    plots = "--no-plots" not in flags
+    profile = "--profile" in flags
+    rerun = profile or "--rerun" in flags or "--checkpoint-every" in flags
+    store = ResultStore()
+
+    if resume is None:
+        name = args[0]
+        if name not in get_workloads():
+            print "Unrecognized workload: {}".format(name)
+            return
+        json_load = get_workload(name)
+    else:
+        # Checkpoints taken while resuming are named after the one we resumed
+        # from, so that they don't clobber the original run's.
+        name = os.path.splitext(os.path.basename(resume))[0]
+        try:
+            overrides = parse_overrides(args)
+        except ValueError as e:
+            print e
+            return
+
+    checkpoints = None
+    workers = None
+    try:
+        if "--checkpoint-every" in flags:
+            checkpoints = (int(flags["--checkpoint-every"]),
+                           CHECKPOINT_FILE_FMT.format(name=name))
+        if "--workers" in flags:
+            workers = int(flags["--workers"])
+    except (TypeError, ValueError):
+        print_usage()
+        return
+
+    if "--compare" in flags:
+        if resume is not None or checkpoints is not None or profile:
+            print ("--compare can't be combined with --resume, "
+                   "--checkpoint-every or --profile")
+            return
+        baseline, packed = compare_results(json_load, rerun, workers)
+        report_comparison(baseline, packed)
         return
 
-    workload = argv[1]
-    if workload not in get_workloads():
-        print "Unrecognized workload: {}".format(workload)
+    if resume is None:
+        run = lambda: get_results(json_load, store, rerun, plots, checkpoints,
+                                  workers)
+    else:
+        run = lambda: resume_results(resume, overrides, store, rerun, plots,
+                                     checkpoints, workers)
+
+    try:
+        if profile:
+            results, sample_procs = profile_results(
+                run, PROFILE_FILE_FMT.format(name))
+        else:
+            results, sample_procs = run()
+    except ValueError as e:
+        print e
         return
 
-    json_load = get_workload(workload)
+    # There's nothing to plot for results that came out of the store; the
+    # plots from the run that stored them are still around.
+    plotter = None
+    if plots and sample_procs is not None:
+        plotter = start_runtime_plots(sample_procs, "--one-figure" in flags)
+
+    report_raw_results(results)
+    report_percentiles(results)
+    if (profile or "--stats" in flags) and results.counters is not None:
+        results.counters.report()
+
+    if plotter is not None:
+        plotter.join()
+
+
+def get_trace_files(json_load):
+    trace_files = []
+    for proc in json_load['processes']:
+        if 'tree' in proc:
+            trace_files.append(TREE_FILE_FMT.format(proc['tree']))
+        trace_files.extend(get_trace_file(trace_name)
+                           for trace_name, _ in get_members(proc))
+    return trace_files
+
+
+def get_members(proc):
+    """Return the (trace name, start time) of each process that an entry of
+    the workload's processes stands for.
+
+    An entry names either a benchmark, which is a single process from time 0,
+    or a tree traced with trace_proc.py --tree, which is every process in the
+    tree, each starting when it was forked.
+    """
+    if 'tree' not in proc:
+        return [(proc['benchmark'], 0)]
+
+    with open(TREE_FILE_FMT.format(proc['tree']), 'r') as tree_file:
+        tree = json.load(tree_file)
+    return [(m['trace'], m['start_nanos']) for m in tree['processes']]
+
+
+def get_trace_file(benchmark):
+    """Return the packed trace of benchmark if there is one, or its csv."""
+    pack_file = PACK_FILE_FMT.format(benchmark)
+    if os.path.exists(pack_file):
+        return pack_file
+    return TRACE_FILE_FMT.format(benchmark)
+
+
+def get_results(json_load, store, rerun=False, plots=True, checkpoints=None,
+                workers=None):
+    """Return the Results of simulating json_load, and its sample processes.
+
+    If store already has results for the same workload and traces, return
+    those (with None for the sample processes) instead of simulating again,
+    unless rerun is set. If plots isn't set, the sample processes don't keep
+    the history needed to plot them. checkpoints is an optional (ticks, file
+    format) pair, to checkpoint the simulation every that many ticks. If
+    workers is more than 1, the CPUs are split between that many worker
+    processes.
+    """
+    run_hash = hash_run(json_load, get_trace_files(json_load))
+    results = stored_results(store, run_hash, rerun)
+    if results is not None:
+        return results, None
+
+    return simulate_results(build_simulation(json_load, plots), run_hash,
+                            store, checkpoints, workers)
+
+
+def resume_results(checkpoint_file, overrides, store, rerun=False,
+                   plots=True, checkpoints=None, workers=None):
+    """Like get_results, but carry on from a checkpoint.
+
+    overrides is a map from workload parameter --> the value it takes from
+    the checkpoint on. Raise ValueError if it can't be changed. Results are
+    stored under the checkpoint they came from, as well as the workload.
+    """
+    with open(checkpoint_file, "rb") as f:
+        checkpoint_hash = hashlib.sha1(f.read()).hexdigest()
+
+    sim = Simulation.load(checkpoint_file)
+    sim.branch(overrides)
+    for p in sim.sample_procs:
+        if not plots:
+            p.runtime_points = p.average_runtime_points = None
+        elif p.average_runtime_points is None:
+            # The checkpoint was taken without histories; plot from here on.
+            p.record_history(sim.json_load.get('history_cap', DEFAULT_CAP))
+
+    run_hash = hash_run(dict(sim.json_load, resumed_from=checkpoint_hash),
+                        get_trace_files(sim.json_load))
+    results = stored_results(store, run_hash, rerun)
+    if results is not None:
+        return results, None
+
+    print "Resuming from {}".format(checkpoint_file)
+    return simulate_results(sim, run_hash, store, checkpoints, workers)
+
+
+def compare_results(json_load, rerun=False, workers=None):
+    """Return the Results of json_load with plain CFS and with the
+    time-packer, whatever its own time_packer_active says.
+
+    The traces are parsed once, up front. Then each configuration is
+    simulated (or loaded from the store) in a child process of its own, and
+    the two run at the same time.
+    """
+    load_traces(json_load)
+
+    conns = []
+    children = []
+    for active in [False, True]:
+        conn, child_conn = multiprocessing.Pipe()
+        child = multiprocessing.Process(
+            target=serve_comparison,
+            args=(child_conn, dict(json_load, time_packer_active=active),
+                  rerun, workers))
+        child.start()
+        # Drop our end of the child's side, so that recv sees EOF if the
+        # child dies without sending anything.
+        child_conn.close()
+        conns.append(conn)
+        children.append(child)
+
+    try:
+        results = []
+        for i, conn in enumerate(conns):
+            try:
+                ok, result = conn.recv()
+            except EOFError:
+                children[i].join()
+                raise RuntimeError(
+                    "Simulation {} died without a result (exit code "
+                    "{})".format(i, children[i].exitcode))
+            if not ok:
+                raise RuntimeError(
+                    "Simulation {} failed:\n{}".format(i, result))
+            results.append(result)
+    except Exception:
+        # The other simulation's result will never be read; it could block
+        # sending it.
+        for child in children:
+            if child.is_alive():
+                child.terminate()
+        raise
+    finally:
+        for child in children:
+            child.join()
+    return results
+
+
+def serve_comparison(conn, json_load, rerun, workers):
+    """Send the Results of json_load (or the traceback of whatever stopped
+    them) down conn.
+    """
+    # The migrator prints its buckets on every rebalance, which would be
+    # interleaved with the other simulation's.
+    sys.stdout = open(os.devnull, "w")
+    try:
+        results, _ = get_results(json_load, ResultStore(), rerun,
+                                 plots=False, workers=workers)
+        conn.send((True, results))
+    except Exception:
+        conn.send((False, traceback.format_exc()))
+
+
+def stored_results(store, run_hash, rerun):
+    if rerun:
+        return None
+
+    results = store.load(run_hash)
+    if results is not None:
+        print "Using stored results: {}".format(store.run_dir(run_hash))
+    return results
+
+
+def simulate_results(sim, run_hash, store, checkpoints=None, workers=None):
+    if checkpoints is not None:
+        sim.checkpoint_every(*checkpoints)
+
+    procs, sample_procs, migrator, counters = sim.run(workers)
+    results = Results.from_simulation(run_hash, sim.json_load, procs,
+                                      migrator, counters, sim.cpus)
+    store.store(results)
+    return results, sample_procs
+
+
+def profile_results(run, profile_file):
+    """Call run (e.g. get_results with rerun set) under cProfile.
+
+    Save the profile to profile_file, and print the functions that took the
+    most time.
+    """
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(run)
+    finally:
+        profile_dir = os.path.dirname(profile_file)
+        if not os.path.exists(profile_dir):
+            os.makedirs(profile_dir)
+        profiler.dump_stats(profile_file)
+
+        print "Profile saved to {}".format(profile_file)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+
+
+def load_traces(json_load):
+    """Parse every trace the workload uses, up front.
+
+    Parsed traces are cached, so processes created afterwards (including in
+    forked children) share them rather than parsing again.
+    """
+    sim_time = json_load['sim_time_millis'] * NANOS_PER_MILLISECOND
+    for proc in json_load['processes']:
+        for trace_name, start_time in get_members(proc):
+            if start_time < sim_time:
+                State.make_state_list_from_trace(
+                    get_trace_file(trace_name), sim_time - start_time)
+
+
+def run_simulation(json_load, plots=True):
+    """Simulate the workload described by json_load.
+
+    Return all of the processes, the sample processes whose runtimes we plot,
+    the migrator, and the simulation's Counters. If plots isn't set, no
+    process keeps its runtime history.
+    """
+    return build_simulation(json_load, plots).run()
+
+
+def build_simulation(json_load, plots=True):
+    """Set up a Simulation of the workload described by json_load."""
+    counters = Counters()
+    with counters.phase("load"):
+        load_traces(json_load)
 
     # How much passing time we want to simulate. For example, if this is 5000,
     # we want to simulate 5 seconds worth of the trace.
@@ -64,16 +436,38 @@ def main(argv):
     # moving average runtime VS time.
     sample_procs = []
 
+    # Makes each process's estimator of its average runtime.
+    make_estimator = estimator_factory(json_load.get('runtime_estimator'))
+
     for proc in json_load['processes']:
+        # A tree's processes are grouped under the tree's name: the jth
+        # process of the ith copy of the tree is named TREE_i.j.
+        tree = 'tree' in proc
+        bench_name = proc['tree'] if tree else proc['benchmark']
+
+        # The processes that start in time to be simulated. Each one's trace
+        # is cut off at the end of the simulation, not sim_time after its
+        # start.
+        members = []
+        for j, (trace_name, start_time) in enumerate(get_members(proc)):
+            trace_file = get_trace_file(trace_name)
+            if (start_time < sim_time and len(State.make_state_list_from_trace(
+                    trace_file, sim_time - start_time))):
+                members.append((j, trace_file, start_time))
+
         for i in range(proc['quantity']):
-            trace_name = proc['benchmark']
-            trace_file = TRACE_FILE_FMT.format(trace_name)
-            new_proc = Process(trace_file,
-                               trace_name,
-                               i, sim_time)
-            procs.append(new_proc)
-            if i == 0:
-                sample_procs.append(new_proc)
+            for j, trace_file, start_time in members:
+                new_proc = Process(trace_file,
+                                   bench_name,
+                                   "{}.{}".format(i, j) if tree else i,
+                                   sim_time - start_time, make_estimator(),
+                                   proc.get('nice', 0), start_time)
+                procs.append(new_proc)
+                if i == 0 and j == members[0][0]:
+                    if plots:
+                        new_proc.record_history(
+                            json_load.get('history_cap', DEFAULT_CAP))
+                    sample_procs.append(new_proc)
 
     num_cpus = json_load['cpus']
 
@@ -96,81 +490,155 @@ def main(argv):
     # The migrator is in charge of periodically rebalancing buckets - this is
     # the meat of the time-packing algorithm. We initialize it with the maximum
     # allowable target latency, L_max, as described in our paper.
-    migrator = Migrator(json_load['max_latency_millis'], cpus)
+    #
+    # Optionally, breaks_tolerance lets it skip recomputing bucket boundaries
+    # while processes' average runtimes stay within that fraction of where
+    # they were.
+    #
+    # With stable_migration, it also tries to leave processes on the CPUs
+    # they're on, as long as that doesn't unbalance load by more than
+    # migration_imbalance_tolerance (a fraction).
+    migrator = Migrator(json_load['max_latency_millis'], cpus,
+                        json_load.get('breaks_tolerance', 0.),
+                        json_load.get('stable_migration', False),
+                        json_load.get('migration_imbalance_tolerance', 0.1))
 
     # We periodically recalibrate buckets and migrate processes. How often this
     # happens is controlled by the rebalance_period.
     rebalance_period = (
         json_load['rebalance_period_millis'] * NANOS_PER_MILLISECOND)
 
-    # Continue to simulate while CPUs have unfinished processes.
-    while any([c.has_unfinished_procs() for c in cpus]):
-        for c in cpus:
-            if c.has_unfinished_procs():
-                c.run(rebalance_period)
-
-        if json_load['time_packer_active']:
-            migrator.rebalance()
-
-    make_runtime_plots(sample_procs)
-    report_raw_results(procs, json_load['time_packer_active'], migrator)
-
-
-def report_raw_results(procs, time_packer_active, migrator):
+    # Optionally, a CPU that runs out of work pulls a waiting process off the
+    # busiest runqueue (in its bucket, if the time-packer is on), and idle
+    # CPUs try again every idle_balance_period.
+    balancer = None
+    if json_load.get('idle_balance', False):
+        balancer = IdleBalancer(cpus)
+    idle_balance_period = (
+        json_load.get('idle_balance_period_millis',
+                      DEFAULT_IDLE_BALANCE_PERIOD_MILLIS) *
+        NANOS_PER_MILLISECOND)
+
+    # Simulate all of the CPUs off one event calendar until every process has
+    # finished, rebalancing every rebalance_period if the time-packer is on.
+    engine = EventEngine(
+        cpus,
+        migrator if json_load['time_packer_active'] else None,
+        rebalance_period,
+        counters,
+        balancer,
+        idle_balance_period)
+
+    return Simulation(json_load, procs, sample_procs, cpus, migrator, engine,
+                      counters)
+
+
+def report_raw_results(results):
     """Print statistics about each process."""
-
-    class Stats:
-        """Helper class to average context switches for each benchmark."""
-        def __init__(self, bench_name):
-            self.bench_name = bench_name
-            self.context_switches = 0
-            self.proc_count = 0
-
-        def update_stats(self, proc):
-            assert proc.bench_name == self.bench_name
-            self.proc_count += 1
-            self.context_switches += proc.context_switches
-
-        def normalize(self):
-            self.context_switches /= self.proc_count
-
-    if not os.path.exists(PLOT_DIR):
-        os.mkdir(PLOT_DIR)
-
-    stats_dict = {}
-    for p in procs:
-        stats_dict.setdefault(
-            p.bench_name, Stats(p.bench_name)).update_stats(p)
+    for r in results.processes:
         print ("{}\n***********************\n"
                "\tcontext switches {}\n"
+               "\tmigrations: {}\n"
                "\taverage runtime: {}\n"
                "\tload: {}\n"
-               "\tfinished: {}\n").format(p.name,
-                                          p.context_switches,
-                                          p.average_runtime,
-                                          p.get_load(),
-                                          p.finished)
-
-    for s in stats_dict.values():
-        s.normalize()
-        print "{}: {}".format(s.bench_name, s.context_switches)
-
-    if time_packer_active:
-        lats = migrator.historical_latencies
-        print "Avg latency: {}".format(sum(lats) / len(lats))
-
-
-def make_runtime_plots(procs):
-    """Plot estimated runtimes (moving avg) vs time for each process."""
-    for p in procs:
-        plt.title("Estimated Runtime: {}".format(p.name))
-        plt.xlabel("Time (nanos)")
-        plt.ylabel("Estimated Runtime (nanos)")
-        plt.plot([x[0] for x in p.average_runtime_points],
-                 [x[1] for x in p.average_runtime_points])
-        plt.savefig('{}/runtime_{}.png'.format(PLOT_DIR, p.name))
-        plt.clf()
-        plt.close()
+               "\tfinished: {}\n").format(r["name"],
+                                          r["context_switches"],
+                                          r["migrations"],
+                                          r["average_runtime"],
+                                          r["load"],
+                                          r["finished"])
+
+    for b in results.benchmarks:
+        print "{}: {}".format(b["benchmark"], b["context_switches"])
+
+    print "Migrations: {}".format(results.migrations)
+
+    if results.average_latency is not None:
+        print "Avg latency: {}".format(results.average_latency)
+
+
+def format_percentiles(values, fmt="{}"):
+    return " / ".join("-" if v is None else fmt.format(v) for v in values)
+
+
+def report_percentiles(results):
+    """Print the p50 / p99 / p999 wait, slice and utilization of each process
+    and CPU, and of every process together.
+    """
+    rows = ([(r["name"], SchedStats.from_dict(r["stats"]))
+             for r in results.processes] +
+            [("cpu {}".format(r["cpu"]), SchedStats.from_dict(r["stats"]))
+             for r in results.cpus] +
+            [("all processes", results.process_stats)])
+
+    header = ["", "wait (nanos)", "slice (nanos)", "utilization (%)"]
+    cells = [header] + [
+        [name,
+         format_percentiles([stats.waits.percentile(q) for q in PERCENTILES]),
+         format_percentiles([stats.slices.percentile(q)
+                             for q in PERCENTILES]),
+         format_percentiles([None if u is None else 100 * u
+                             for u in (stats.utilization(q)
+                                       for q in PERCENTILES)],
+                            "{:.1f}")]
+        for name, stats in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(header))]
+
+    print
+    print "Percentiles ({})".format(
+        " / ".join("p{:g}".format(q).replace(".", "") for q in PERCENTILES))
+    for row in cells:
+        print "  ".join([row[0].ljust(widths[0])] +
+                        [cell.rjust(w) for cell, w in zip(row[1:], widths[1:])])
+
+
+def format_change(old, new):
+    """Describe the change from old to new, as a percentage."""
+    if old is None or new is None or isinstance(old, bool) or old == 0:
+        return ""
+    return "{:+.1f}%".format(100. * (new - old) / old)
+
+
+def report_comparison(baseline, packed):
+    """Print the results of plain CFS (baseline) and the time-packer (packed)
+    side by side.
+    """
+    def benchmark_values(results, field):
+        return {b["benchmark"]: b[field] for b in results.benchmarks}
+
+    rows = []
+    for field, label in [("context_switches", "context switches"),
+                         ("finish_time", "completion time")]:
+        old = benchmark_values(baseline, field)
+        new = benchmark_values(packed, field)
+        for benchmark in sorted(old):
+            rows.append(("{} ({})".format(label, benchmark),
+                         old[benchmark], new.get(benchmark)))
+
+    rows.append(("completion time", baseline.finish_time, packed.finish_time))
+    rows.append(("migrations", baseline.migrations, packed.migrations))
+    rows.append(("avg latency", baseline.average_latency,
+                 packed.average_latency))
+
+    old_stats = baseline.process_stats
+    new_stats = packed.process_stats
+    for q in PERCENTILES:
+        rows.append(("wait p{:g} (nanos)".format(q).replace(".", ""),
+                     old_stats.waits.percentile(q),
+                     new_stats.waits.percentile(q)))
+    rows.append(("finished", baseline.finished, packed.finished))
+
+    cells = [["", "CFS", "time-packing", "change"]] + [
+        [label,
+         "-" if before is None else str(before),
+         "-" if after is None else str(after),
+         format_change(before, after)]
+        for label, before, after in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(4)]
+    for row in cells:
+        print "  ".join(
+            [row[0].ljust(widths[0])] +
+            [cell.rjust(w) for cell, w in zip(row[1:], widths[1:])]).rstrip()
 
 
 if __name__ == '__main__':
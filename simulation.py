@@ -0,0 +1,154 @@
+"""A simulation in progress, which can be checkpointed and resumed."""
+import cPickle
+import os
+
+from shards import ShardedEngine
+
+NANOS_PER_MILLISECOND = (10 ** 6)
+
+# Workload parameters that a resumed simulation can change, since they only
+# affect the migrator and engine from the next tick on. Everything else
+# (processes, CPUs, how long to simulate) is baked into the checkpoint.
+BRANCHABLE_PARAMS = [
+    "max_latency_millis",
+    "rebalance_period_millis",
+    "time_packer_active",
+    "breaks_tolerance",
+    "stable_migration",
+    "migration_imbalance_tolerance",
+]
+
+
+class Simulation(object):
+    """Everything needed to carry on simulating a workload.
+
+    Between ticks of the engine, the whole thing (processes, schedulers,
+    migrator, calendar and counters) can be saved to a checkpoint, and
+    loaded to carry on from there. Loading a checkpoint more than once, with
+    different parameters, runs what-if branches off the same warmed-up
+    state.
+    """
+    def __init__(self, json_load, procs, sample_procs, cpus, migrator,
+                 engine, counters):
+        self.json_load = json_load
+        self.procs = procs
+        self.sample_procs = sample_procs
+        self.cpus = cpus
+        self.migrator = migrator
+        self.engine = engine
+        self.counters = counters
+
+    def run(self, workers=None):
+        """Simulate until every process has finished.
+
+        If workers is more than 1, split the CPUs between that many worker
+        processes. Return all of the processes, the sample processes, the
+        migrator, and the simulation's Counters.
+        """
+        with self.counters.phase("simulate"):
+            if workers > 1:
+                self.run_sharded(workers)
+            else:
+                self.engine.run()
+                for c in self.cpus:
+                    c.scheduler.settle_sleepers()
+
+        return self.procs, self.sample_procs, self.migrator, self.counters
+
+    def run_sharded(self, workers):
+        """Simulate on a ShardedEngine.
+
+        The processes come back from the workers, and replace the ones in
+        procs and sample_procs; the CPUs here are left as they were, but for
+        their schedulers' stats.
+        """
+        if self.engine.on_tick is not None:
+            raise ValueError("Can't checkpoint a simulation split between "
+                             "workers")
+        if self.engine.balancer is not None:
+            raise ValueError("Can't balance idle CPUs in a simulation split "
+                             "between workers")
+
+        engine = ShardedEngine(self.cpus, workers, self.engine.migrator,
+                               self.engine.rebalance_period, self.counters,
+                               self.engine.next_tick)
+        procs = {p.name: p for p in engine.run()}
+        self.procs = [procs[p.name] for p in self.procs]
+        self.sample_procs = [procs[p.name] for p in self.sample_procs]
+        if engine.migrator is not None:
+            self.migrator.historical_latencies = (
+                engine.migrator.historical_latencies)
+
+    def checkpoint_every(self, ticks, file_fmt):
+        """Save a checkpoint every ticks ticks of the engine.
+
+        Checkpoints are written to file_fmt, formatted with the simulated
+        time in millis.
+        """
+        count = [0]
+
+        def on_tick():
+            count[0] += 1
+            if count[0] % ticks == 0:
+                self.save(file_fmt.format(
+                    millis=self.engine.now / NANOS_PER_MILLISECOND))
+
+        self.engine.on_tick = on_tick
+
+    def save(self, file_name):
+        checkpoint_dir = os.path.dirname(file_name)
+        if checkpoint_dir and not os.path.exists(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+
+        with self.counters.phase("checkpoint"):
+            # Write it under another name first, so that a checkpoint that's
+            # there is always complete.
+            tmp_name = file_name + ".tmp"
+            try:
+                with open(tmp_name, "wb") as f:
+                    cPickle.dump(self, f, cPickle.HIGHEST_PROTOCOL)
+            except:
+                os.remove(tmp_name)
+                raise
+            os.rename(tmp_name, file_name)
+        print "Checkpoint saved to {}".format(file_name)
+
+    @staticmethod
+    def load(file_name):
+        with open(file_name, "rb") as f:
+            return cPickle.load(f)
+
+    def branch(self, overrides):
+        """Change the workload parameters in overrides, from here on.
+
+        Raise ValueError for parameters that can't change mid-simulation.
+        """
+        for param in overrides:
+            if param not in BRANCHABLE_PARAMS:
+                raise ValueError(
+                    "Can't change {} when resuming".format(param))
+
+        self.json_load = dict(self.json_load, **overrides)
+        if "max_latency_millis" in overrides:
+            self.migrator.max_latency = (
+                overrides["max_latency_millis"] * NANOS_PER_MILLISECOND)
+        if "rebalance_period_millis" in overrides:
+            # The next tick is already on the calendar; the ones after it
+            # come at the new period.
+            self.engine.rebalance_period = (
+                overrides["rebalance_period_millis"] * NANOS_PER_MILLISECOND)
+        if "time_packer_active" in overrides:
+            self.engine.migrator = (self.migrator
+                                    if overrides["time_packer_active"]
+                                    else None)
+            if self.engine.balancer is not None:
+                # Without the time-packer, there are no buckets to keep
+                # within. With it, there will be from the next tick.
+                self.engine.balancer.update_domains(None)
+        if "breaks_tolerance" in overrides:
+            self.migrator.breaks_tolerance = overrides["breaks_tolerance"]
+        if "stable_migration" in overrides:
+            self.migrator.stable = overrides["stable_migration"]
+        if "migration_imbalance_tolerance" in overrides:
+            self.migrator.imbalance_tolerance = (
+                overrides["migration_imbalance_tolerance"])
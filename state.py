@@ -1,64 +1,280 @@
 """Helper to generate state list from perf traces."""
+import bisect
+import mmap
+import os
+import struct
+from array import array
+
+from pack_trace import TraceReader, is_packed
+
 RUNNING = 0
 SLEEPING = 1
 SCHED_WAKEUP = "sched_wakeup"
 
+# Parsed states are cached in a binary file next to each trace.
+CACHE_FILE_FMT = "{}.states"
 
-class State(object):
-    def __init__(self, state, duration):
+
+class StateList(object):
+    """A list of states, stored as parallel arrays.
+
+    kinds[i] is RUNNING or SLEEPING, durations[i] is how long the i-th state
+    lasts in nanos, and end_times[i] is the trace timestamp of the event that
+    ended it. A state list is never modified once it's built, so every
+    process simulating the same trace shares one; each process keeps its own
+    cursor into it.
+    """
+    def __init__(self, kinds=None, durations=None, end_times=None):
+        self.kinds = kinds if kinds is not None else array('b')
+        self.durations = durations if durations is not None else array('l')
+        self.end_times = end_times if end_times is not None else array('l')
+
+        # Built on demand by get_start_times().
+        self.start_times = None
+
+        # The (trace name, max time) the list was made from, if it came from
+        # State.make_state_list_from_trace().
+        self.source = None
+
+    def __reduce__(self):
+        # Pickle a list that came from a trace as a reference to it, so that
+        # pickled processes (e.g. in a checkpoint) don't each carry a copy of
+        # it, and unpickled ones share it again.
+        if self.source is not None:
+            return shared_state_list, self.source
+        return StateList, (self.kinds, self.durations, self.end_times)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def append(self, state, duration, end_time):
         if state not in [SLEEPING, RUNNING]:
             raise Exception("Bad state")
-        self.state = state
-        self.duration = int(duration)
+        self.kinds.append(state)
+        self.durations.append(int(duration))
+        self.end_times.append(int(end_time))
+
+    def get_start_times(self):
+        """Return when each state starts if the states are run back to back.
+
+        That's the running sum of durations: start_times[i] is the total
+        duration of states before i, and start_times[len(self)] is the total
+        duration of them all. It's computed once and shared, like the list.
+        """
+        if self.start_times is None:
+            start_times = array('l', [0])
+            total = 0
+            for duration in self.durations:
+                total += duration
+                start_times.append(total)
+            self.start_times = start_times
+        return self.start_times
+
+    def truncate(self, max_time):
+        """Return the states that end by max_time, as a new StateList."""
+        n = bisect.bisect_right(self.end_times, max_time)
+        return StateList(self.kinds[:n], self.durations[:n],
+                         self.end_times[:n])
+
+
+def shared_state_list(trace_name, max_time):
+    # Pickle can only find module level functions, not static methods.
+    return State.make_state_list_from_trace(trace_name, max_time)
+
+
+class StateCache(object):
+    """An on-disk cache of a trace's parsed states, next to the trace itself.
+
+    The file holds a header followed by the kinds, durations and end_times
+    arrays of the whole trace, back to back in native byte order. The header
+    records the trace's mtime and size, so a cache whose trace has changed is
+    ignored and rewritten. Loading memory-maps the file, binary searches
+    end_times for max_time, and copies out only the states before it.
+    """
+    MAGIC = "STATES01"
+
+    # Magic, trace mtime, trace size, number of states.
+    HEADER = struct.Struct("=8sdqq")
+
+    # Bytes per element of the kinds and durations/end_times arrays.
+    KIND_SIZE = array('b').itemsize
+    TIME_SIZE = array('l').itemsize
+
+    def __init__(self, trace_name):
+        self.trace_name = trace_name
+        self.cache_name = CACHE_FILE_FMT.format(trace_name)
+
+    def trace_stamp(self):
+        stat = os.stat(self.trace_name)
+        return stat.st_mtime, stat.st_size
+
+    def load(self, max_time):
+        """Return the cached states that end by max_time, or None on a miss."""
+        try:
+            with open(self.cache_name, "rb") as cache_file:
+                mm = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None
+
+        try:
+            if len(mm) < self.HEADER.size:
+                return None
+
+            magic, mtime, size, count = self.HEADER.unpack_from(mm, 0)
+            if (magic != self.MAGIC or (mtime, size) != self.trace_stamp() or
+                    len(mm) != self.HEADER.size + count * (
+                        self.KIND_SIZE + 2 * self.TIME_SIZE)):
+                return None
+
+            kinds_offset = self.HEADER.size
+            durations_offset = kinds_offset + count * self.KIND_SIZE
+            end_times_offset = durations_offset + count * self.TIME_SIZE
+
+            # Binary search for the first state that ends after max_time.
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                end_time = struct.unpack_from(
+                    "l", mm, end_times_offset + mid * self.TIME_SIZE)[0]
+                if end_time <= max_time:
+                    lo = mid + 1
+                else:
+                    hi = mid
+
+            states = StateList()
+            states.kinds.fromstring(
+                mm[kinds_offset:kinds_offset + lo * self.KIND_SIZE])
+            states.durations.fromstring(
+                mm[durations_offset:durations_offset + lo * self.TIME_SIZE])
+            states.end_times.fromstring(
+                mm[end_times_offset:end_times_offset + lo * self.TIME_SIZE])
+            return states
+        finally:
+            mm.close()
+
+    def store(self, states):
+        """Write states (the whole trace) to the cache, if we can."""
+        mtime, size = self.trace_stamp()
+        tmp_name = "{}.{}.tmp".format(self.cache_name, os.getpid())
+        try:
+            with open(tmp_name, "wb") as cache_file:
+                cache_file.write(self.HEADER.pack(self.MAGIC, mtime, size,
+                                                  len(states)))
+                states.kinds.tofile(cache_file)
+                states.durations.tofile(cache_file)
+                states.end_times.tofile(cache_file)
+            os.rename(tmp_name, self.cache_name)
+        except (IOError, OSError):
+            # The trace directory might not be writable; we'll just parse the
+            # trace again next time.
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+
+
+class State(object):
+    # Map from (trace name, max time) --> StateList parsed from that trace.
+    state_lists = {}
 
     @staticmethod
     def make_state_list_from_trace(trace_name, max_time):
-        """Parse .trace.csv file (a list of events) as a list of states."""
-        states = []
+        """Parse a trace file (a list of events) as a list of states.
+
+        Each trace is only parsed once; later calls, and later runs via the
+        on-disk StateCache, get the same states.
+        """
+        key = (trace_name, max_time)
+        if key not in State.state_lists:
+            states = State.load_state_list(trace_name, max_time)
+            states.source = key
+            State.state_lists[key] = states
+        return State.state_lists[key]
+
+    @staticmethod
+    def load_state_list(trace_name, max_time):
+        if is_packed(trace_name):
+            # Packed traces are read straight up to max_time, without
+            # decompressing the rest. Caching all of their states would undo
+            # the packing.
+            return State.parse_trace(trace_name, max_time)
+
+        cache = StateCache(trace_name)
+        states = cache.load(max_time)
+        if states is not None:
+            return states
+
+        # Parse the whole trace, so that the cache can serve any max_time.
+        try:
+            states = State.parse_trace(trace_name)
+        except Exception:
+            # The trace is malformed somewhere. It might be past max_time, so
+            # parse just the part we need the same way we always have.
+            return State.parse_trace(trace_name, max_time)
+
+        cache.store(states)
+        return states.truncate(max_time)
+
+    @staticmethod
+    def parse_trace(trace_name, max_time=None):
+        """Parse the trace's states, up to max_time if it's given.
+
+        The trace is either a csv or a packed trace.
+        """
+        if is_packed(trace_name):
+            events = TraceReader(trace_name).events(end_time=max_time)
+            return State.parse_events(events, trace_name)
+
+        with open(trace_name, "r") as trace_file:
+            events = (line.split(",") for line in trace_file)
+            return State.parse_events(events, trace_name, max_time)
+
+    @staticmethod
+    def parse_events(events, trace_name, max_time=None):
+        """Parse (event, state, timestamp) triples as a list of states, up
+        to max_time if it's given.
+        """
+        states = StateList()
 
         # The process starts running
         curr_state = RUNNING
         curr_time = 0
 
-        with open(trace_name, "r") as trace_file:
-            lineno = 1
-            for line in trace_file.readlines():
-                event, state, ts = line.split(",")
-                if int(ts) > max_time:
-                    break
-                duration = int(ts) - curr_time
-                # If the current state is running, look for the next sleep
-                if curr_state == RUNNING:
-                    if event == SCHED_WAKEUP:
-                        print ts
-                        raise Exception("[line {}] not expecting "
-                                        "a wakeup".format(str(lineno)))
-
-                    # We don't care about the context switches that leave this
-                    # process still running.
-                    if state[0] == "R":
-                        continue
-                    # D, S, D|S, x, etc
-                    else:
-                        if duration == 0:
-                            duration = 1
-                        states.append(State(RUNNING, duration))
-                        curr_time = int(ts)
-                        curr_state = SLEEPING
-
-                # If the current state is sleeping, we look for the next wakeup.
-                # In fact, the next wakeup should be the very next event. If
-                # not, it's a bug.
+        lineno = 1
+        for event, state, ts in events:
+            if max_time is not None and int(ts) > max_time:
+                break
+            duration = int(ts) - curr_time
+            # If the current state is running, look for the next sleep
+            if curr_state == RUNNING:
+                if event == SCHED_WAKEUP:
+                    print ts
+                    raise Exception("[line {}] not expecting "
+                                    "a wakeup".format(str(lineno)))
+
+                # We don't care about the context switches that leave this
+                # process still running.
+                if state[0] == "R":
+                    continue
+                # D, S, D|S, x, etc
                 else:
-                    if event != SCHED_WAKEUP:
-                        raise Exception("[line {}] expected wakeup as next "
-                                        "event in trace: {}".format(str(lineno),
-                                                                    trace_name))
                     if duration == 0:
                         duration = 1
-                    states.append(State(SLEEPING, duration))
-                    curr_state = RUNNING
+                    states.append(RUNNING, duration, ts)
                     curr_time = int(ts)
+                    curr_state = SLEEPING
+
+            # If the current state is sleeping, we look for the next wakeup.
+            # In fact, the next wakeup should be the very next event. If
+            # not, it's a bug.
+            else:
+                if event != SCHED_WAKEUP:
+                    raise Exception("[line {}] expected wakeup as next "
+                                    "event in trace: {}".format(str(lineno),
+                                                                trace_name))
+                if duration == 0:
+                    duration = 1
+                states.append(SLEEPING, duration, ts)
+                curr_state = RUNNING
+                curr_time = int(ts)
 
-                lineno += 1
+            lineno += 1
         return states
@@ -0,0 +1,158 @@
+#!/usr/bin/python2
+"""Simulate a workload over a grid of parameters, in parallel."""
+import copy
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+
+import simulate
+from results import ResultStore
+
+USAGE = """Usage: ./sweep.py [-j JOBS] <WORKLOAD> <PARAM>=<VALUE>[,...] ...
+
+Simulates WORKLOAD once for every combination of parameter values, overriding
+the workload's own settings, e.g.
+
+    ./sweep.py mixed max_latency_millis=10,30,50 cpus=4,8
+
+Parameters are top-level keys of the workload json: {}.
+Values are parsed as json, so time_packer_active=true,false works."""
+
+SWEEPABLE_PARAMS = [
+    "cpus",
+    "sim_time_millis",
+    "max_latency_millis",
+    "rebalance_period_millis",
+    "initial_latency_millis",
+    "time_packer_active",
+    "breaks_tolerance",
+    "stable_migration",
+    "migration_imbalance_tolerance",
+    "idle_balance",
+    "idle_balance_period_millis",
+]
+
+
+def parse_grid(args):
+    """Parse PARAM=VALUE,... arguments into a list of (param, values)."""
+    grid = []
+    for arg in args:
+        if "=" not in arg:
+            raise ValueError("Expected PARAM=VALUE,...: {}".format(arg))
+
+        param, values = arg.split("=", 1)
+        if param not in SWEEPABLE_PARAMS:
+            raise ValueError("Unrecognized parameter: {}".format(param))
+
+        grid.append((param, [json.loads(v) for v in values.split(",")]))
+    return grid
+
+
+def make_configs(json_load, grid):
+    """Return a (params, workload) pair for every point in the grid."""
+    configs = []
+    params = [param for param, _ in grid]
+    for values in itertools.product(*[values for _, values in grid]):
+        point = dict(zip(params, values))
+        config = copy.deepcopy(json_load)
+        config.update(point)
+        configs.append((point, config))
+    return configs
+
+
+def quiet_worker():
+    # The migrator prints its buckets on every rebalance; nobody can read
+    # that from a dozen interleaved workers.
+    sys.stdout = open(os.devnull, "w")
+
+
+def run_config(config):
+    """Simulate one point of the grid and summarize the results."""
+    point, json_load = config
+    results, _ = simulate.get_results(json_load, ResultStore(), plots=False)
+
+    return {
+        "params": point,
+        "context_switches": {
+            b["benchmark"]: b["context_switches"] for b in results.benchmarks},
+        "avg_latency": results.average_latency,
+        "wait_p99": results.process_stats.waits.percentile(99),
+        "finished": results.finished,
+        "migrations": results.migrations,
+        "hash": results.run_hash,
+    }
+
+
+def sweep(json_load, grid, jobs=None):
+    """Simulate json_load at every point in grid across a pool of processes.
+
+    Return one result per point, in grid order.
+    """
+    configs = make_configs(json_load, grid)
+
+    # Parse the traces once, before forking, so the workers all share them.
+    for _, config in configs:
+        simulate.load_traces(config)
+
+    pool = multiprocessing.Pool(jobs, initializer=quiet_worker)
+    try:
+        return pool.map(run_config, configs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def print_results(grid, results):
+    params = [param for param, _ in grid]
+    benchmarks = sorted(set(
+        name for r in results for name in r["context_switches"]))
+
+    header = (params + ["finished", "migrations", "avg_latency", "wait_p99"] +
+              benchmarks)
+    rows = [[str(r["params"][p]) for p in params] +
+            [str(r["finished"]),
+             str(r["migrations"]),
+             str(r["avg_latency"]) if r["avg_latency"] is not None else "-",
+             str(r["wait_p99"]) if r["wait_p99"] is not None else "-"] +
+            [str(r["context_switches"].get(b, "-")) for b in benchmarks]
+            for r in results]
+
+    widths = [max(len(row[i]) for row in [header] + rows)
+              for i in range(len(header))]
+    for row in [header] + rows:
+        print "  ".join(cell.rjust(w) for cell, w in zip(row, widths))
+
+
+def main(argv):
+    args = argv[1:]
+    jobs = None
+    if len(args) >= 2 and args[0] == "-j":
+        jobs = int(args[1])
+        args = args[2:]
+
+    if not args:
+        print USAGE.format(", ".join(SWEEPABLE_PARAMS))
+        print
+        print "Workloads"
+        simulate.list_workloads()
+        return
+
+    workload = args[0]
+    if workload not in simulate.get_workloads():
+        print "Unrecognized workload: {}".format(workload)
+        return
+
+    try:
+        grid = parse_grid(args[1:])
+    except ValueError as e:
+        print e
+        return
+
+    results = sweep(simulate.get_workload(workload), grid, jobs)
+    print_results(grid, results)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
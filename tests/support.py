@@ -0,0 +1,111 @@
+"""Helpers shared by the simulator's tests."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import gen_trace
+import simulate
+from results import Results, process_record
+from state import State
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "golden")
+
+# The synthetic traces every test can simulate: a map from trace name -->
+# (profile, seconds, seed).
+TRACES = {
+    "cpu_bound": ("cpu_bound", 1.5, 1),
+    "io_bound": ("io_bound", 1.5, 1),
+    "bimodal": ("bimodal", 1.5, 1),
+}
+
+
+def make_workload(processes, cpus, time_packer_active=True, **params):
+    """A workload of processes, a list of (trace name, quantity) pairs."""
+    json_load = {
+        "processes": [{"benchmark": name, "quantity": quantity}
+                      for name, quantity in processes],
+        "cpus": cpus,
+        "sim_time_millis": 1000,
+        "max_latency_millis": 30,
+        "rebalance_period_millis": 100,
+        "initial_latency_millis": 10,
+        "time_packer_active": time_packer_active,
+    }
+    json_load.update(params)
+    return json_load
+
+
+def process_state(p):
+    """Everything the simulation decided about p, to compare runs by."""
+    state = process_record(p)
+    state.update({
+        "vruntime": p.vruntime,
+        "state_index": p.state_index,
+        "remaining": p.remaining,
+        "curr_runtime": p.curr_runtime,
+        "target_cpu": p.target_cpu.number,
+        "estimator": vars(p.runtime_estimator),
+    })
+    return state
+
+
+class Quiet(object):
+    """Swallows stdout (e.g. the migrator's buckets) within a with block."""
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+        return sys.stdout
+
+    def __exit__(self, exc_type, exc_value, tb):
+        sys.stdout = self.stdout
+
+
+class SimulationTestCase(unittest.TestCase):
+    """A test run in a scratch directory holding the synthetic TRACES."""
+    def setUp(self):
+        self.old_cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp(prefix="sched_test")
+        os.chdir(self.dir)
+        for name, (profile, seconds, seed) in TRACES.iteritems():
+            gen_trace.write_trace(gen_trace.PROFILES[profile], name, seconds,
+                                  seed)
+
+        # Parsed traces are kept by file name, which is the same in every
+        # scratch directory.
+        State.state_lists = {}
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.dir)
+        State.state_lists = {}
+
+    def build(self, json_load):
+        with Quiet():
+            return simulate.build_simulation(json_load, plots=False)
+
+    def run_simulation(self, sim, workers=None):
+        """Run sim, and return its Results and processes."""
+        with Quiet():
+            procs, _, migrator, counters = sim.run(workers)
+        return (Results.from_simulation(None, sim.json_load, procs, migrator,
+                                        counters, sim.cpus),
+                procs)
+
+    def simulate(self, json_load, workers=None):
+        return self.run_simulation(self.build(json_load), workers)
+
+    def assertSameRun(self, first, second):
+        """Assert that two (Results, processes) pairs are the same run."""
+        results, procs = first
+        other_results, other_procs = second
+        self.assertEqual(results.processes, other_results.processes)
+        self.assertEqual(results.benchmarks, other_results.benchmarks)
+        self.assertEqual(results.cpus, other_results.cpus)
+        self.assertEqual(results.historical_latencies,
+                         other_results.historical_latencies)
+        self.assertEqual([process_state(p) for p in procs],
+                         [process_state(p) for p in other_procs])
@@ -0,0 +1,52 @@
+import itertools
+import random
+import unittest
+
+from assignment import min_cost_assignment
+
+
+def brute_force_cost(cost):
+    """The least total cost of matching every row to its own column."""
+    n, m = len(cost), len(cost[0]) if cost else 0
+    return min(sum(cost[i][j] for i, j in enumerate(columns))
+               for columns in itertools.permutations(range(m), n))
+
+
+class MinCostAssignmentTest(unittest.TestCase):
+    def assertOptimal(self, cost):
+        assignment = min_cost_assignment(cost)
+        self.assertEqual(len(assignment), len(cost))
+        self.assertEqual(len(set(assignment)), len(assignment))
+        self.assertEqual(sum(cost[i][j] for i, j in enumerate(assignment)),
+                         brute_force_cost(cost), cost)
+
+    def test_known(self):
+        cost = [[4, 1, 3],
+                [2, 0, 5],
+                [3, 2, 2]]
+        self.assertEqual(min_cost_assignment(cost), [1, 0, 2])
+
+    def test_against_brute_force(self):
+        rng = random.Random(1)
+        for _ in range(300):
+            n = rng.randint(1, 6)
+            m = rng.randint(n, 6)
+            # Few distinct values, so there are lots of ties.
+            high = rng.choice([1, 3, 100])
+            self.assertOptimal([[rng.randint(-high, high) for _ in range(m)]
+                                for _ in range(n)])
+
+    def test_all_ties(self):
+        for n, m in [(1, 1), (3, 3), (2, 5)]:
+            self.assertOptimal([[7] * m for _ in range(n)])
+
+    def test_empty(self):
+        self.assertEqual(min_cost_assignment([]), [])
+
+    def test_more_rows_than_columns(self):
+        with self.assertRaises(ValueError):
+            min_cost_assignment([[1], [2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
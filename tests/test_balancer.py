@@ -0,0 +1,130 @@
+import unittest
+
+from balancer import IdleBalancer
+from cpu import CPU
+from engine import EventEngine
+from process import Process
+from support import SimulationTestCase, make_workload
+
+LONG_TRACE = "./traces/long.trace.csv"
+
+# Nanos between periodic balancing rounds.
+BALANCE_PERIOD = 1000
+
+
+class FakeBucket(object):
+    def __init__(self, cpus):
+        self.cpus = cpus
+
+
+class IdleBalancerTest(SimulationTestCase):
+    def setUp(self):
+        super(IdleBalancerTest, self).setUp()
+        # Runs for 1 ms, sleeps for 10 nanos, and runs for another 1 ms.
+        with open(LONG_TRACE, "w") as f:
+            f.write("sched_switch,S,1000000\nsched_wakeup,,1000010\n"
+                    "sched_switch,S,2000010\n")
+        self.num_procs = 0
+
+    def make_cpus(self, procs_per_cpu, running=True):
+        """CPUs with procs_per_cpu[i] processes on CPU i. If running, one of
+        them is running on each CPU that has any.
+        """
+        cpus = []
+        for number, count in enumerate(procs_per_cpu):
+            procs = [Process(LONG_TRACE, "long", self.num_procs + i, 10 ** 7)
+                     for i in range(count)]
+            self.num_procs += count
+            cpu = CPU(procs, 10 ** 6, number)
+            s = cpu.scheduler
+            if running:
+                s.curr_proc = s.waiting_procs.pick_next()
+            cpus.append(cpu)
+        return cpus
+
+    def test_pulls_from_busiest(self):
+        cpus = self.make_cpus([0, 2, 4, 3])
+        balancer = IdleBalancer(cpus)
+        idle, busiest = cpus[0].scheduler, cpus[2].scheduler
+        expected = busiest.waiting_procs.peek()
+
+        self.assertTrue(balancer.pull(idle, 0))
+        self.assertEqual(list(idle.waiting_procs), [expected])
+        self.assertEqual(idle.processes, [expected])
+        self.assertIs(expected.target_cpu, cpus[0])
+        self.assertNotIn(expected, busiest.processes)
+        self.assertEqual(len(busiest.waiting_procs), 2)
+        self.assertEqual(busiest.counters.idle_pulls, 1)
+
+    def test_never_pulls_running(self):
+        cpus = self.make_cpus([0, 1, 1])
+        balancer = IdleBalancer(cpus)
+        running = [c.scheduler.curr_proc for c in cpus[1:]]
+
+        self.assertFalse(balancer.pull(cpus[0].scheduler, 0))
+        self.assertEqual(cpus[0].scheduler.processes, [])
+        self.assertEqual([c.scheduler.curr_proc for c in cpus[1:]], running)
+        for c, p in zip(cpus[1:], running):
+            self.assertIs(p.target_cpu, c)
+
+    def test_stays_in_its_bucket(self):
+        cpus = self.make_cpus([0, 2, 4, 0])
+        balancer = IdleBalancer(cpus)
+        balancer.update_domains([FakeBucket(cpus[:2]),
+                                 FakeBucket(cpus[2:3])])
+
+        # CPU 2 is busier, but in another bucket.
+        pulled = cpus[1].scheduler.waiting_procs.peek()
+        self.assertTrue(balancer.pull(cpus[0].scheduler, 0))
+        self.assertEqual(cpus[0].scheduler.processes, [pulled])
+        self.assertEqual(len(cpus[2].scheduler.waiting_procs), 3)
+
+        # CPU 3 is in no bucket, so pulls from nobody.
+        self.assertFalse(balancer.pull(cpus[3].scheduler, 0))
+
+        balancer.update_domains(None)
+        self.assertTrue(balancer.pull(cpus[3].scheduler, 0))
+
+    def test_leaves_processes_bound_elsewhere(self):
+        cpus = self.make_cpus([0, 3, 0])
+        balancer = IdleBalancer(cpus)
+        source = cpus[1].scheduler
+
+        # The migrator has sent the next one to CPU 2.
+        source.waiting_procs.peek().target_cpu = cpus[2]
+        self.assertFalse(balancer.pull(cpus[0].scheduler, 0))
+        self.assertEqual(len(source.waiting_procs), 2)
+        self.assertEqual(cpus[0].scheduler.processes, [])
+
+    def test_balances_every_period(self):
+        cpus = self.make_cpus([0, 3], running=False)
+        engine = EventEngine(cpus, balancer=IdleBalancer(cpus),
+                             balance_period=BALANCE_PERIOD)
+
+        # CPU 0 never runs out of work on its own, so only periodic
+        # balancing can give it any.
+        engine.run(until=BALANCE_PERIOD - 1)
+        self.assertEqual(cpus[0].scheduler.processes, [])
+        self.assertEqual(engine.counters.idle_pulls, 0)
+
+        engine.run(until=BALANCE_PERIOD)
+        self.assertEqual(len(cpus[0].scheduler.processes), 1)
+        self.assertEqual(engine.counters.idle_pulls, 1)
+
+        # Once it has a process, it stops pulling.
+        engine.run(until=10 * BALANCE_PERIOD)
+        self.assertEqual(engine.counters.idle_pulls, 1)
+
+    def test_period_from_workload(self):
+        json_load = make_workload([("io_bound", 1)], cpus=2,
+                                  idle_balance=True,
+                                  idle_balance_period_millis=7)
+        sim = self.build(json_load)
+        self.assertIsNotNone(sim.engine.balancer)
+        self.assertEqual(sim.engine.balance_period, 7 * 10 ** 6)
+        self.assertIsNone(self.build(make_workload([("io_bound", 1)],
+                                                   cpus=2)).engine.balancer)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import itertools
+import unittest
+
+from breaks import natural_breaks
+
+
+def brute_force_breaks(data, n_classes):
+    """natural_breaks() the slow way: try every split."""
+    data = sorted(data)
+
+    def cost(values):
+        mean = float(sum(values)) / len(values)
+        return sum((x - mean) ** 2 for x in values)
+
+    best, best_breaks = None, None
+    for cuts in itertools.combinations(range(1, len(data)), n_classes - 1):
+        bounds = (0,) + cuts + (len(data),)
+        total = sum(cost(data[i:j]) for i, j in zip(bounds, bounds[1:]))
+        if best is None or total < best:
+            best = total
+            best_breaks = [data[0]] + [data[j - 1] for j in bounds[1:]]
+    return best_breaks
+
+
+class NaturalBreaksTest(unittest.TestCase):
+    def test_matches_brute_force(self):
+        data = [3, 1, 50, 52, 47, 200, 210, 9, 11, 1000]
+        for n_classes in range(1, 6):
+            self.assertEqual(natural_breaks(data, n_classes),
+                             brute_force_breaks(data, n_classes))
+
+    def test_far_from_zero_floats(self):
+        # Tightly clustered floats, far from 0: without centring, the sums
+        # of squares swamp the deviations.
+        base = 1e12
+        data = ([base + 0.01 * i for i in range(5)] +
+                [base + 10 + 0.01 * i for i in range(5)])
+        self.assertEqual(natural_breaks(data, 2),
+                         [data[0], data[4], data[-1]])
+
+    def test_single_value(self):
+        self.assertEqual(natural_breaks([7], 1), [7, 7])
+
+
+if __name__ == '__main__':
+    unittest.main()
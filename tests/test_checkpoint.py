@@ -0,0 +1,39 @@
+import os
+import unittest
+
+from simulation import Simulation
+from state import State
+from support import Quiet, SimulationTestCase, make_workload
+
+CHECKPOINT_FMT = "./checkpoints/run_{millis}ms.ckpt"
+
+# Processes with equal loads, so the migrator has ties to break.
+WORKLOAD = make_workload(
+    [("cpu_bound", 4), ("io_bound", 4), ("bimodal", 2)], cpus=4)
+
+
+class CheckpointTest(SimulationTestCase):
+    def test_resume_matches_uninterrupted_run(self):
+        sim = self.build(WORKLOAD)
+        sim.checkpoint_every(3, CHECKPOINT_FMT)
+        uninterrupted = self.run_simulation(sim)
+
+        for millis in [300, 600]:
+            checkpoint = CHECKPOINT_FMT.format(millis=millis)
+            self.assertTrue(os.path.exists(checkpoint))
+            with Quiet():
+                resumed = Simulation.load(checkpoint)
+            resumed.branch({})
+            self.assertSameRun(self.run_simulation(resumed), uninterrupted)
+
+    def test_same_from_trace_cache(self):
+        # The first run parses the csvs and caches their states on disk, the
+        # second loads the cache.
+        parsed = self.simulate(WORKLOAD)
+        State.state_lists = {}
+        cached = self.simulate(WORKLOAD)
+        self.assertSameRun(parsed, cached)
+
+
+if __name__ == '__main__':
+    unittest.main()
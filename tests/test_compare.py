@@ -0,0 +1,29 @@
+import os
+import unittest
+
+import simulate
+from support import SimulationTestCase, make_workload
+
+WORKLOAD = make_workload([("io_bound", 2), ("bimodal", 1)], cpus=2)
+
+
+class CompareTest(SimulationTestCase):
+    def test_child_that_dies_raises(self):
+        serve_comparison = simulate.serve_comparison
+
+        def dying_serve_comparison(conn, json_load, rerun, workers):
+            # Exit without sending anything, as if killed.
+            if not json_load['time_packer_active']:
+                os._exit(3)
+            serve_comparison(conn, json_load, rerun, workers)
+
+        simulate.serve_comparison = dying_serve_comparison
+        try:
+            with self.assertRaisesRegexp(RuntimeError, "exit code 3"):
+                simulate.compare_results(WORKLOAD)
+        finally:
+            simulate.serve_comparison = serve_comparison
+
+
+if __name__ == '__main__':
+    unittest.main()
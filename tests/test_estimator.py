@@ -0,0 +1,124 @@
+import random
+import unittest
+
+from estimator import (DEFAULT_WINDOW, EWMA, WindowAverage, WindowMedian,
+                       estimator_factory)
+
+
+def old_average_runtime(runtimes, curr_runtime, n=DEFAULT_WINDOW):
+    """Process.calc_average_runtime as it was before the estimators."""
+    last_n = runtimes[-n:]
+    last_n.append(curr_runtime)
+    return sum(last_n) / len(last_n)
+
+
+def random_runtimes(count, seed=1):
+    rng = random.Random(seed)
+    return [rng.choice([1, 10, 1000, 10 ** 6]) * rng.randint(1, 9)
+            for _ in range(count)]
+
+
+class WindowAverageTest(unittest.TestCase):
+    def test_same_as_old_average(self):
+        estimator = WindowAverage()
+        runtimes = []
+        for runtime in random_runtimes(100):
+            for curr_runtime in [0, 1, runtime, 10 ** 7 + 3]:
+                self.assertEqual(
+                    estimator.estimate(curr_runtime),
+                    old_average_runtime(runtimes, curr_runtime))
+            estimator.push(runtime)
+            runtimes.append(runtime)
+
+    def test_eviction(self):
+        estimator = WindowAverage(3)
+        for runtime in [100, 200, 300, 400, 500]:
+            estimator.push(runtime)
+        self.assertEqual(len(estimator.runtimes), 3)
+        self.assertEqual(estimator.count, 3)
+        self.assertEqual(estimator.total, 1200)
+        self.assertEqual(estimator.estimate(0), 300)
+
+
+class WindowMedianTest(unittest.TestCase):
+    def test_empty(self):
+        self.assertEqual(WindowMedian().estimate(42), 42)
+
+    def test_odd_count(self):
+        estimator = WindowMedian()
+        for runtime in [50, 10, 40, 20]:
+            estimator.push(runtime)
+        # 10, 20, 30, 40, 50
+        self.assertEqual(estimator.estimate(30), 30)
+        # 10, 20, 40, 50, 90
+        self.assertEqual(estimator.estimate(90), 40)
+        # 5, 10, 20, 40, 50
+        self.assertEqual(estimator.estimate(5), 20)
+
+    def test_even_count(self):
+        estimator = WindowMedian()
+        for runtime in [50, 10, 40]:
+            estimator.push(runtime)
+        # 10, 40, 50, 60
+        self.assertEqual(estimator.estimate(60), 45)
+        # 10, 25, 40, 50
+        self.assertEqual(estimator.estimate(25), 32)
+        # 0, 10, 40, 50
+        self.assertEqual(estimator.estimate(0), 25)
+
+    def test_eviction(self):
+        estimator = WindowMedian(3)
+        runtimes = random_runtimes(50)
+        for i, runtime in enumerate(runtimes):
+            estimator.push(runtime)
+            window = runtimes[max(0, i - 2):i + 1]
+            self.assertEqual(estimator.sorted_runtimes, sorted(window))
+            self.assertEqual(len(estimator.runtimes), 3)
+
+            for curr_runtime in [0, runtime, 10 ** 7]:
+                values = sorted(window + [curr_runtime])
+                n = len(values)
+                self.assertEqual(
+                    estimator.estimate(curr_runtime),
+                    (values[(n - 1) / 2] + values[n / 2]) / 2)
+
+
+class EWMATest(unittest.TestCase):
+    def test_hand_computed(self):
+        estimator = EWMA(0.2)
+        self.assertEqual(estimator.estimate(70), 70)
+        estimator.push(100)
+        self.assertEqual(estimator.average, 100)
+        estimator.push(200)
+        # 100 + 0.2 * (200 - 100)
+        self.assertEqual(estimator.average, 120)
+        estimator.push(0)
+        # 120 + 0.2 * (0 - 120)
+        self.assertEqual(estimator.average, 96)
+        # 96 + 0.2 * (46 - 96)
+        self.assertEqual(estimator.estimate(46), 86)
+        self.assertEqual(estimator.average, 96)
+
+    def test_weight_one_follows_the_newest(self):
+        estimator = EWMA(1.)
+        for runtime in [5, 500, 50]:
+            estimator.push(runtime)
+            self.assertEqual(estimator.average, runtime)
+
+
+class EstimatorFactoryTest(unittest.TestCase):
+    def test_types(self):
+        self.assertIsInstance(estimator_factory()(), WindowAverage)
+        self.assertEqual(estimator_factory({"window": 4})().window, 4)
+        self.assertIsInstance(estimator_factory({"type": "median"})(),
+                              WindowMedian)
+        ewma = estimator_factory({"type": "ewma", "weight": 0.3})()
+        self.assertEqual(ewma.weight, 0.3)
+
+    def test_unknown_type(self):
+        with self.assertRaises(ValueError):
+            estimator_factory({"type": "mode"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+
+from scheduler import Scheduler
+from support import SimulationTestCase, make_workload
+
+# Counters that the fast path must leave as the step-by-step path would.
+# idle_skips and idle_time count the fast-forwards themselves, so differ.
+SAME_COUNTERS = ["slices", "wakeups", "migrations", "rebalances"]
+
+WORKLOADS = {
+    # Most CPUs hold a single process, so it runs alone from the start.
+    "spread": make_workload([("io_bound", 2), ("bimodal", 1)], cpus=4,
+                            time_packer_active=False),
+    # The time-packer gives processes CPUs of their own now and then.
+    "packed": make_workload(
+        [("cpu_bound", 2), ("io_bound", 3), ("bimodal", 2)], cpus=4),
+    "nice": dict(make_workload([("io_bound", 2), ("cpu_bound", 1)], cpus=4),
+                 processes=[{"benchmark": "io_bound", "quantity": 2,
+                             "nice": 5},
+                            {"benchmark": "cpu_bound", "quantity": 1,
+                             "nice": -5}]),
+    "ewma": make_workload([("io_bound", 3), ("bimodal", 2)], cpus=4,
+                          runtime_estimator={"type": "ewma", "weight": 0.3}),
+}
+
+
+class FastPathTest(SimulationTestCase):
+    def simulate_without_fast_path(self, json_load):
+        run_alone = Scheduler.run_alone
+        Scheduler.run_alone = lambda self, limit: False
+        try:
+            return self.simulate(json_load)
+        finally:
+            Scheduler.run_alone = run_alone
+
+    def simulate_counting_jumps(self, json_load):
+        """Simulate json_load, and return the run and how many times a
+        process was fast-forwarded.
+        """
+        run_alone = Scheduler.run_alone
+        jumps = [0]
+
+        def counting_run_alone(self, limit):
+            jumped = run_alone(self, limit)
+            jumps[0] += jumped
+            return jumped
+
+        Scheduler.run_alone = counting_run_alone
+        try:
+            return self.simulate(json_load), jumps[0]
+        finally:
+            Scheduler.run_alone = run_alone
+
+    def test_same_as_step_by_step(self):
+        for name, json_load in sorted(WORKLOADS.items()):
+            fast, jumps = self.simulate_counting_jumps(json_load)
+            slow = self.simulate_without_fast_path(json_load)
+
+            self.assertGreater(jumps, 0, name)
+            self.assertSameRun(fast, slow)
+
+            # The histograms and estimators are in the process states that
+            # assertSameRun compares; the counters are shared by the CPUs.
+            fast_counters, slow_counters = fast[0].counters, slow[0].counters
+            for field in SAME_COUNTERS:
+                self.assertEqual(getattr(fast_counters, field),
+                                 getattr(slow_counters, field),
+                                 "{}: {}".format(name, field))
+
+
+if __name__ == '__main__':
+    unittest.main()
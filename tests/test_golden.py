@@ -0,0 +1,30 @@
+import os
+import unittest
+
+import simulate
+from support import GOLDEN_DIR, Quiet, SimulationTestCase, make_workload
+
+
+class GoldenTest(SimulationTestCase):
+    def test_cfs_matches_baseline(self):
+        """Plain CFS schedules exactly as the original simulator did.
+
+        golden/cfs_small.txt is the original simulator's report of this
+        workload. It predates the migration counts, so those are left out.
+        """
+        json_load = make_workload(
+            [("cpu_bound", 2), ("io_bound", 3), ("bimodal", 2)], cpus=2,
+            time_packer_active=False)
+        results, _ = self.simulate(json_load)
+        with Quiet() as out:
+            simulate.report_raw_results(results)
+        report = [line for line in out.getvalue().splitlines()
+                  if not line.startswith("\tmigrations:")]
+        report = report[:report.index("Migrations: 0")]
+
+        with open(os.path.join(GOLDEN_DIR, "cfs_small.txt")) as f:
+            self.assertEqual(report, f.read().splitlines())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import unittest
+
+from histogram import (SUB_BUCKET_COUNT, LogHistogram, SchedStats,
+                       bucket_range)
+
+
+def bucket_of(value):
+    h = LogHistogram()
+    h.record(value)
+    return h.counts.keys()[0]
+
+
+class BucketRangeTest(unittest.TestCase):
+    def test_known_ranges(self):
+        self.assertEqual(bucket_range(0), (0, 0))
+        self.assertEqual(bucket_range(127), (127, 127))
+        self.assertEqual(bucket_range(128), (128, 129))
+        self.assertEqual(bucket_range(191), (254, 255))
+        self.assertEqual(bucket_range(192), (256, 259))
+        self.assertEqual(bucket_range(316), (992, 999))
+
+    def test_buckets_tile_the_values(self):
+        # Each bucket starts right after the one before, and is less than
+        # 1/64th as wide as its lowest value.
+        for index in range(1, 2000):
+            lowest, highest = bucket_range(index)
+            self.assertEqual(lowest, bucket_range(index - 1)[1] + 1)
+            self.assertLess(highest - lowest, max(1, lowest // 64))
+
+    def test_values_land_in_their_bucket(self):
+        values = range(2 * SUB_BUCKET_COUNT) + [
+            v + d for v in [1000, 10 ** 6, 10 ** 9, 2 ** 40]
+            for d in [-1, 0, 1]]
+        for value in values:
+            lowest, highest = bucket_range(bucket_of(value))
+            self.assertTrue(lowest <= value <= highest, value)
+
+
+class LogHistogramTest(unittest.TestCase):
+    def test_record_counts(self):
+        h = LogHistogram()
+        h.record(5)
+        h.record(5, 3)
+        h.record(254)
+        h.record(255)
+        self.assertEqual(dict(h.counts), {5: 4, 191: 2})
+        self.assertEqual(h.total, 6)
+
+    def test_percentiles(self):
+        h = LogHistogram()
+        for value in range(1, 1001):
+            h.record(value)
+        self.assertEqual(h.percentile(0), 1)
+        self.assertEqual(h.percentile(50), 503)
+        self.assertEqual(h.percentile(99), 991)
+        self.assertEqual(h.percentile(99.9), 999)
+        self.assertEqual(h.percentile(100), 1007)
+
+    def test_percentiles_of_exact_values(self):
+        h = LogHistogram()
+        h.record(3, 998)
+        h.record(100)
+        h.record(120)
+        self.assertEqual(h.percentile(50), 3)
+        self.assertEqual(h.percentile(99.8), 3)
+        self.assertEqual(h.percentile(99.9), 100)
+        self.assertEqual(h.percentile(100), 120)
+
+    def test_empty(self):
+        h = LogHistogram()
+        self.assertEqual(h.total, 0)
+        for percent in [0, 50, 99.9, 100]:
+            self.assertIsNone(h.percentile(percent))
+
+    def test_merge_and_dict(self):
+        h = LogHistogram()
+        h.record(7, 2)
+        h.record(10 ** 6)
+        other = LogHistogram()
+        other.record(7)
+        h.merge(other)
+        self.assertEqual(h.counts[7], 3)
+        self.assertEqual(LogHistogram.from_dict(h.to_dict()).counts,
+                         h.counts)
+
+
+class SchedStatsTest(unittest.TestCase):
+    def test_busy_windows(self):
+        stats = SchedStats(window=10)
+        stats.record_slice(0, 5)
+        stats.record_slice(8, 14)
+        # Three windows pass without running at all.
+        stats.record_slice(55, 57)
+
+        # [0, 10) ran 7, [10, 20) 4, and [20, 50) not at all; [50, 60)
+        # isn't over yet.
+        self.assertEqual(dict(stats.busy.counts), {7: 1, 4: 1, 0: 3})
+        self.assertEqual(dict(stats.slices.counts), {5: 1, 6: 1, 2: 1})
+        self.assertEqual(stats.utilization(100), 0.7)
+        self.assertEqual(stats.utilization(50), 0.)
+
+    def test_slice_across_windows(self):
+        stats = SchedStats(window=10)
+        stats.record_slice(3, 35)
+        self.assertEqual(dict(stats.busy.counts), {7: 1, 10: 2})
+        self.assertEqual(stats.window_busy, 5)
+        self.assertEqual(stats.utilization(100), 1.)
+
+    def test_no_window_counted(self):
+        stats = SchedStats(window=10)
+        self.assertIsNone(stats.utilization(50))
+        stats.record_slice(0, 10)
+        self.assertIsNone(stats.utilization(50))
+
+    def test_dict(self):
+        stats = SchedStats(window=10)
+        stats.waits.record(3)
+        stats.record_slice(0, 25)
+        loaded = SchedStats.from_dict(stats.to_dict())
+        self.assertEqual(loaded.window, 10)
+        self.assertEqual(loaded.waits.counts, stats.waits.counts)
+        self.assertEqual(loaded.slices.counts, stats.slices.counts)
+        self.assertEqual(loaded.busy.counts, stats.busy.counts)
+
+
+if __name__ == '__main__':
+    unittest.main()
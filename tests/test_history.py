@@ -0,0 +1,64 @@
+import random
+import unittest
+
+from history import History
+
+
+def random_points(count, seed=1):
+    rng = random.Random(seed)
+    time = 0
+    points = []
+    for _ in range(count):
+        time += rng.randint(1, 1000)
+        points.append((time, rng.randint(-10 ** 6, 10 ** 6)))
+    return points
+
+
+class HistoryTest(unittest.TestCase):
+    def test_short_history_is_kept_whole(self):
+        history = History(16)
+        points = random_points(15)
+        for time, value in points:
+            history.append(time, value)
+        self.assertEqual(history.points(), points)
+
+    def test_never_over_cap(self):
+        for cap in [4, 5, 16, 100]:
+            history = History(cap)
+            for i, (time, value) in enumerate(random_points(5000)):
+                history.append(time, value)
+                self.assertLessEqual(len(history), cap, (cap, i))
+                self.assertEqual(len(history.points()), len(history))
+
+    def test_extremes_survive(self):
+        for seed in range(5):
+            points = random_points(3000, seed)
+            history = History(64)
+            for time, value in points:
+                history.append(time, value)
+
+            kept = history.points()
+            self.assertLess(len(kept), len(points))
+            self.assertIn(min(points, key=lambda p: p[1]), kept)
+            self.assertIn(max(points, key=lambda p: p[1]), kept)
+
+    def test_time_order(self):
+        points = random_points(3000)
+        history = History(64)
+        for i, (time, value) in enumerate(points):
+            history.append(time, value)
+            times = [t for t, _ in history.points()]
+            self.assertEqual(times, sorted(times), i)
+
+            # Every point kept is one that was appended.
+            self.assertTrue(set(history.points()) <= set(points[:i + 1]))
+
+    def test_spike_survives(self):
+        history = History(16)
+        for time in range(10000):
+            history.append(time, 10 ** 6 if time == 5001 else 0)
+        self.assertIn((5001, 10 ** 6), history.points())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from migrator import Bucket
+
+
+class FakeProcess(object):
+    def __init__(self, load):
+        self.load = load
+        self.weight = 1024
+
+    def get_load(self):
+        return self.load
+
+
+def make_bucket(loads, num_cpus):
+    bucket = Bucket(0)
+    for load in loads:
+        bucket.add_process(FakeProcess(load))
+    for number in range(num_cpus):
+        bucket.claim_cpu("cpu{}".format(number))
+    bucket.num_cpus = num_cpus
+    return bucket
+
+
+class StablePlacementTest(unittest.TestCase):
+    def test_keeps_an_equally_good_placement(self):
+        bucket = make_bucket([1., 1., 1., 1.], 2)
+        cpu0, cpu1 = bucket.cpus
+        # Greedy placement alternates cpu0, cpu1, cpu0, cpu1, which is no
+        # better balanced.
+        current = [cpu1, cpu1, cpu0, cpu0]
+        current_cpus = dict(zip(bucket.procs, current))
+        self.assertNotEqual(bucket.greedy_placement(), current)
+        self.assertEqual(bucket.stable_placement(current_cpus, 0.), current)
+
+    def test_places_newcomers_on_the_idlest(self):
+        bucket = make_bucket([3., 1., 1., 2.], 2)
+        cpu0, cpu1 = bucket.cpus
+        current_cpus = {bucket.procs[0]: cpu0, bucket.procs[1]: cpu1}
+        self.assertEqual(bucket.stable_placement(current_cpus, 0.),
+                         [cpu0, cpu1, cpu1, cpu1])
+
+    def test_moves_as_few_as_balance_needs(self):
+        bucket = make_bucket([1., 1., 1., 1.], 2)
+        cpu0, cpu1 = bucket.cpus
+        current_cpus = {p: cpu0 for p in bucket.procs}
+
+        placement = bucket.stable_placement(current_cpus, 0.)
+        self.assertEqual(placement.count(cpu1), 2)
+
+        # Within the tolerance, nothing moves.
+        self.assertEqual(bucket.stable_placement(current_cpus, 1.),
+                         [cpu0] * 4)
+
+    def test_ignores_cpus_outside_the_bucket(self):
+        bucket = make_bucket([1., 1.], 2)
+        cpu0, cpu1 = bucket.cpus
+        current_cpus = {bucket.procs[0]: "elsewhere", bucket.procs[1]: cpu1}
+        self.assertEqual(bucket.stable_placement(current_cpus, 0.),
+                         [cpu0, cpu1])
+
+
+if __name__ == '__main__':
+    unittest.main()
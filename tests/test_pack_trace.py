@@ -0,0 +1,125 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import pack_trace
+from pack_trace import TraceReader, TraceWriter, pack_csv
+from state import State
+
+
+def make_events(n, seed=1):
+    """n (event, state, time) triples of a process alternating between
+    running and sleeping, with some repeated times.
+    """
+    rng = random.Random(seed)
+    events = []
+    time = 0
+    for i in range(n):
+        time += rng.choice([0, 1, 7, 130, 10 ** 6])
+        if i % 2:
+            events.append(("sched_wakeup", "", time))
+        else:
+            events.append(("sched_switch", rng.choice(["S", "D"]), time))
+    return events
+
+
+class PackTraceTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="pack_test")
+        self.pack_name = os.path.join(self.dir, "t.trace.pack")
+
+        # Small blocks, so that a few events span several of them.
+        self.block_events = pack_trace.BLOCK_EVENTS
+        pack_trace.BLOCK_EVENTS = 8
+
+    def tearDown(self):
+        pack_trace.BLOCK_EVENTS = self.block_events
+        shutil.rmtree(self.dir)
+
+    def write(self, events):
+        with TraceWriter(self.pack_name) as writer:
+            for event, state, time in events:
+                writer.write(event, state, time)
+
+    def test_round_trip(self):
+        events = make_events(100)
+        self.write(events)
+        reader = TraceReader(self.pack_name)
+        self.assertEqual(len(reader.index), 13)
+        self.assertEqual(list(reader.events()), events)
+
+    def test_window(self):
+        events = make_events(100)
+        self.write(events)
+        reader = TraceReader(self.pack_name)
+
+        times = sorted(set(time for _, _, time in events))
+        bounds = [None, -1, times[-1] + 1] + times[::7] + [
+            t + 1 for t in times[::11]]
+        for start_time in bounds:
+            for end_time in bounds:
+                expected = [
+                    e for e in events
+                    if (start_time is None or e[2] >= start_time) and
+                    (end_time is None or e[2] <= end_time)]
+                self.assertEqual(
+                    list(reader.events(start_time, end_time)), expected,
+                    (start_time, end_time))
+
+    def test_empty(self):
+        self.write([])
+        reader = TraceReader(self.pack_name)
+        self.assertEqual(reader.index, [])
+        self.assertEqual(list(reader.events()), [])
+        self.assertEqual(list(reader.events(0, 100)), [])
+
+    def test_out_of_order(self):
+        with self.assertRaises(ValueError):
+            self.write([("sched_switch", "S", 5), ("sched_wakeup", "", 4)])
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_truncated(self):
+        self.write(make_events(100))
+        with open(self.pack_name, "rb") as f:
+            data = f.read()
+        for size in [0, 5, len(data) // 2, len(data) - 1]:
+            with open(self.pack_name, "wb") as f:
+                f.write(data[:size])
+            with self.assertRaises(ValueError):
+                TraceReader(self.pack_name)
+
+    def test_corrupt_footer(self):
+        self.write(make_events(100))
+        with open(self.pack_name, "rb") as f:
+            data = f.read()
+        footer = pack_trace.FOOTER.unpack(data[-pack_trace.FOOTER.size:])
+        dictionary_offset, index_offset, num_blocks, magic = footer
+        for bad in [(dictionary_offset, index_offset, num_blocks + 1, magic),
+                    (index_offset + 1, index_offset, num_blocks, magic),
+                    (dictionary_offset, len(data), num_blocks, magic),
+                    (-1, index_offset, num_blocks, magic)]:
+            with open(self.pack_name, "wb") as f:
+                f.write(data[:-pack_trace.FOOTER.size])
+                f.write(pack_trace.FOOTER.pack(*bad))
+            with self.assertRaisesRegexp(ValueError, "corrupt footer"):
+                TraceReader(self.pack_name)
+
+    def test_same_states_as_csv(self):
+        csv_name = os.path.join(self.dir, "t.trace.csv")
+        with open(csv_name, "w") as csv_file:
+            for event, state, time in make_events(101):
+                csv_file.write("{},{},{}\n".format(event, state, time))
+        pack_csv(csv_name, self.pack_name)
+
+        for max_time in [None, 0, 5 * 10 ** 6, 10 ** 12]:
+            csv_states = State.parse_trace(csv_name, max_time)
+            packed_states = State.parse_trace(self.pack_name, max_time)
+            self.assertEqual(packed_states.kinds, csv_states.kinds)
+            self.assertEqual(packed_states.durations, csv_states.durations)
+            self.assertEqual(packed_states.end_times, csv_states.end_times)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+
+import runqueue
+from runqueue import RunQueue, SleeperQueue
+
+
+class FakeProcess(object):
+    """Just enough of a Process for the queues."""
+    def __init__(self, name, vruntime=0, weight=1024, sleep=0):
+        self.name = name
+        self.vruntime = vruntime
+        self.weight = weight
+        self.remaining = sleep
+        self.total_sleeptime = 0
+        self.finished = False
+        self.finish_time = None
+
+    def is_sleeping(self):
+        return self.remaining > 0
+
+    def sleep(self, time):
+        time = min(time, self.remaining)
+        self.remaining -= time
+        self.total_sleeptime += time
+
+
+class RunQueueTest(unittest.TestCase):
+    def test_picks_in_vruntime_order(self):
+        procs = [FakeProcess(i, vruntime=v) for i, v in enumerate([5, 1, 3])]
+        rq = RunQueue(procs)
+        self.assertEqual([rq.pick_next().name for _ in range(3)], [1, 2, 0])
+        self.assertIsNone(rq.pick_next())
+        self.assertIsNone(rq.peek())
+
+    def test_ties_go_to_the_first_added(self):
+        # As min() over a list of the processes in the order they came.
+        procs = [FakeProcess(i, vruntime=7) for i in range(4)]
+        rq = RunQueue(procs)
+        self.assertEqual(rq.peek(), min(procs, key=lambda p: p.vruntime))
+        self.assertEqual([rq.pick_next().name for _ in range(4)],
+                         [0, 1, 2, 3])
+
+    def test_remove_skips_dead_entries(self):
+        procs = [FakeProcess(i, vruntime=i) for i in range(5)]
+        rq = RunQueue(procs)
+        rq.remove(procs[0])
+        rq.remove(procs[3])
+        self.assertEqual(len(rq), 3)
+        self.assertNotIn(procs[0], rq)
+        self.assertEqual(rq.peek(), procs[1])
+        self.assertEqual([rq.pick_next().name for _ in range(3)], [1, 2, 4])
+
+    def test_removed_process_can_come_back(self):
+        p, q = FakeProcess("p", vruntime=1), FakeProcess("q", vruntime=2)
+        rq = RunQueue([p, q])
+        rq.remove(p)
+        p.vruntime = 3
+        rq.enqueue(p)
+        self.assertEqual([rq.pick_next(), rq.pick_next()], [q, p])
+
+    def test_keeps_load_weight(self):
+        procs = [FakeProcess(i, weight=w) for i, w in enumerate([1024, 335])]
+        rq = RunQueue(procs)
+        self.assertEqual(rq.load_weight, 1359)
+        rq.remove(procs[1])
+        self.assertEqual(rq.load_weight, 1024)
+        rq.pick_next()
+        self.assertEqual(rq.load_weight, 0)
+
+    def test_compacts_dead_entries(self):
+        procs = [FakeProcess(i, vruntime=i) for i in range(100)]
+        rq = RunQueue(procs)
+        for p in procs[:90]:
+            rq.remove(p)
+        self.assertLessEqual(len(rq.heap),
+                             runqueue.COMPACTION_FACTOR * (len(rq) + 1))
+        self.assertEqual(rq.peek(), procs[90])
+
+    def test_iterates_in_order_added(self):
+        procs = [FakeProcess(i, vruntime=v) for i, v in enumerate([3, 1, 2])]
+        rq = RunQueue(procs)
+        rq.remove(procs[1])
+        self.assertEqual(list(rq), [procs[0], procs[2]])
+
+
+class SleeperQueueTest(unittest.TestCase):
+    def test_wakes_in_wakeup_order(self):
+        procs = [FakeProcess(i, sleep=s) for i, s in enumerate([30, 10, 20])]
+        sq = SleeperQueue()
+        for p in procs:
+            sq.add(p, 0)
+        self.assertEqual(sq.next_wakeup_time(), 10)
+        self.assertEqual(sq.pop_woken(9), [])
+        self.assertEqual(sq.pop_woken(20), [(10, procs[1]), (20, procs[2])])
+        self.assertEqual(len(sq), 1)
+
+    def test_woken_come_in_order_they_slept(self):
+        procs = [FakeProcess(i, sleep=s) for i, s in enumerate([20, 10])]
+        sq = SleeperQueue()
+        for p in procs:
+            sq.add(p, 0)
+        self.assertEqual([p for _, p in sq.pop_woken(20)], procs)
+
+    def test_settles_sleep_lazily(self):
+        p = FakeProcess("p", sleep=100)
+        sq = SleeperQueue()
+        sq.add(p, 10)
+        self.assertEqual(p.total_sleeptime, 0)
+        sq.settle(40)
+        self.assertEqual(p.total_sleeptime, 30)
+        sq.settle(40)
+        self.assertEqual(p.total_sleeptime, 30)
+        sq.pop_woken(110)
+        self.assertEqual(p.total_sleeptime, 100)
+
+    def test_remove_settles_and_skips_dead_entries(self):
+        p, q = FakeProcess("p", sleep=10), FakeProcess("q", sleep=20)
+        sq = SleeperQueue()
+        sq.add(p, 0)
+        sq.add(q, 0)
+        sq.remove(p, 4)
+        self.assertEqual(p.total_sleeptime, 4)
+        self.assertNotIn(p, sq)
+        self.assertEqual(sq.next_wakeup_time(), 20)
+        self.assertEqual(sq.pop_woken(20), [(20, q)])
+
+
+if __name__ == '__main__':
+    unittest.main()
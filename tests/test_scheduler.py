@@ -0,0 +1,50 @@
+import unittest
+
+from cpu import CPU
+from engine import EventEngine
+from process import Process
+from support import SimulationTestCase
+from weights import nice_to_weight
+
+TINY_TRACE = "./traces/tiny.trace.csv"
+
+
+class TimesliceTest(SimulationTestCase):
+    def setUp(self):
+        super(TimesliceTest, self).setUp()
+        # Runs for 20 nanos, sleeps for 10, and runs for 20 more.
+        with open(TINY_TRACE, "w") as f:
+            f.write("sched_switch,S,20\nsched_wakeup,,30\nsched_switch,S,50\n")
+
+    def make_cpu(self, target_latency, num_procs):
+        procs = [Process(TINY_TRACE, "tiny", i, 1000)
+                 for i in range(num_procs)]
+        return CPU(procs, target_latency, 0), procs
+
+    def test_shares_latency_by_weight(self):
+        cpu, procs = self.make_cpu(300, 3)
+        s = cpu.scheduler
+        s.curr_proc = s.waiting_procs.pick_next()
+        self.assertEqual(s.get_timeslice(), 100)
+
+        s.curr_proc.weight, _ = nice_to_weight(-5)
+        self.assertEqual(s.get_timeslice(),
+                         300 * s.curr_proc.weight /
+                         (s.curr_proc.weight + 2 * 1024))
+
+    def test_tiny_latency_still_makes_progress(self):
+        # 1.9 nanos can't be shared out between three processes.
+        cpu, procs = self.make_cpu(1.9, 3)
+        s = cpu.scheduler
+        s.curr_proc = s.waiting_procs.pick_next()
+        self.assertEqual(s.get_timeslice(), 1)
+        s.waiting_procs.enqueue(s.curr_proc)
+        s.curr_proc = None
+
+        EventEngine([cpu]).run()
+        self.assertTrue(all(p.finished for p in procs))
+        self.assertEqual([p.total_runtime for p in procs], [40] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import unittest
+
+from support import SimulationTestCase, make_workload
+
+# Processes with equal loads, so the migrator has ties to break.
+WORKLOAD = make_workload(
+    [("cpu_bound", 4), ("io_bound", 4), ("bimodal", 2)], cpus=4)
+
+
+class ShardedTest(SimulationTestCase):
+    def test_same_as_single_process(self):
+        serial = self.simulate(WORKLOAD)
+        for workers in [2, 3]:
+            self.assertSameRun(self.simulate(WORKLOAD, workers), serial)
+
+    def test_same_with_stable_migration(self):
+        json_load = dict(WORKLOAD, stable_migration=True)
+        self.assertSameRun(self.simulate(json_load, 2),
+                           self.simulate(json_load))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import gen_trace
+from state import CACHE_FILE_FMT, State, StateCache
+
+TRACE = "./traces/cpu_bound.trace.csv"
+MAX_TIME = 10 ** 9
+
+
+class StateCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.old_cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp(prefix="cache_test")
+        os.chdir(self.dir)
+        gen_trace.write_trace(gen_trace.PROFILES["cpu_bound"], "cpu_bound",
+                              1.5, 1)
+        self.cache_name = CACHE_FILE_FMT.format(TRACE)
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.dir)
+
+    def assertSameStates(self, states, other):
+        self.assertEqual(states.kinds, other.kinds)
+        self.assertEqual(states.durations, other.durations)
+        self.assertEqual(states.end_times, other.end_times)
+
+    def test_cached_same_as_parsed(self):
+        parsed = State.parse_trace(TRACE, MAX_TIME)
+        self.assertIsNone(StateCache(TRACE).load(MAX_TIME))
+
+        self.assertSameStates(State.load_state_list(TRACE, MAX_TIME), parsed)
+        self.assertTrue(os.path.exists(self.cache_name))
+        for max_time in [0, MAX_TIME, 2 * MAX_TIME]:
+            cached = StateCache(TRACE).load(max_time)
+            self.assertIsNotNone(cached)
+            self.assertSameStates(cached, State.parse_trace(TRACE, max_time))
+
+    def test_changed_mtime_invalidates(self):
+        State.load_state_list(TRACE, MAX_TIME)
+        stat = os.stat(TRACE)
+        os.utime(TRACE, (stat.st_atime, stat.st_mtime + 10))
+        self.assertIsNone(StateCache(TRACE).load(MAX_TIME))
+
+    def test_changed_size_invalidates(self):
+        State.load_state_list(TRACE, MAX_TIME)
+        stat = os.stat(TRACE)
+
+        # One more state, appended without moving the mtime.
+        event, _, ts = open(TRACE).readlines()[-1].split(",")
+        with open(TRACE, "a") as trace_file:
+            if event == "sched_wakeup":
+                trace_file.write("sched_switch,S,{}\n".format(int(ts) + 1))
+            else:
+                trace_file.write("sched_wakeup,,{}\n".format(int(ts) + 1))
+        os.utime(TRACE, (stat.st_atime, stat.st_mtime))
+
+        self.assertIsNone(StateCache(TRACE).load(MAX_TIME))
+        parsed = State.parse_trace(TRACE, 2 * MAX_TIME)
+        self.assertSameStates(State.load_state_list(TRACE, 2 * MAX_TIME),
+                              parsed)
+        self.assertEqual(parsed.end_times[-1], int(ts) + 1)
+
+    def test_truncated_cache_is_rebuilt(self):
+        parsed = State.parse_trace(TRACE, MAX_TIME)
+        State.load_state_list(TRACE, MAX_TIME)
+        with open(self.cache_name, "rb") as cache_file:
+            data = cache_file.read()
+
+        for size in [0, 10, StateCache.HEADER.size, len(data) // 2,
+                     len(data) - 1]:
+            with open(self.cache_name, "wb") as cache_file:
+                cache_file.write(data[:size])
+            self.assertIsNone(StateCache(TRACE).load(MAX_TIME))
+
+            self.assertSameStates(State.load_state_list(TRACE, MAX_TIME),
+                                  parsed)
+            with open(self.cache_name, "rb") as cache_file:
+                self.assertEqual(cache_file.read(), data)
+
+    def test_corrupt_magic_is_rebuilt(self):
+        State.load_state_list(TRACE, MAX_TIME)
+        with open(self.cache_name, "r+b") as cache_file:
+            cache_file.write("NOTSTATE")
+        self.assertIsNone(StateCache(TRACE).load(MAX_TIME))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+import trace_proc
+from support import SimulationTestCase
+
+SWITCH_LINE = (" {ts:.6f}:   sched:sched_switch: prev_comm={comm} "
+               "prev_pid={pid} prev_prio=120 prev_state={state} ==> "
+               "next_comm=swapper next_pid=0 next_prio=120\n")
+WAKE_LINE = (" {ts:.6f}:   sched:sched_wakeup: comm={comm} pid={pid} "
+             "prio=120 target_cpu=000\n")
+
+
+class ParseTraceTest(SimulationTestCase):
+    def write_perf_output(self, lines):
+        with open("perf.txt", "w") as f:
+            f.writelines(lines)
+
+    def read_trace(self, name):
+        with open("./traces/{}.trace.csv".format(name)) as f:
+            return f.read().splitlines()
+
+    def test_keeps_the_busiest_of_many_pids(self):
+        # More pids than there could be spill files open at once.
+        lines = []
+        ts = 100.
+        for pid in range(1, 3001):
+            lines.append(SWITCH_LINE.format(ts=ts, comm="tar", pid=pid,
+                                            state="S"))
+            ts += 0.001
+        for _ in range(3):
+            lines.append(WAKE_LINE.format(ts=ts, comm="tar", pid=7))
+            lines.append(SWITCH_LINE.format(ts=ts + 0.0005, comm="tar", pid=7,
+                                            state="S"))
+            ts += 0.001
+        self.write_perf_output(lines)
+
+        trace_proc.parse_trace("many", "/bin/tar -x", "perf.txt")
+        trace = self.read_trace("many")
+        self.assertEqual(len(trace), 7)
+        self.assertEqual(trace[0], "sched_switch,S,0")
+        self.assertEqual(trace[1], "sched_wakeup,,2994000000")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import json
+import unittest
+
+from support import SimulationTestCase, make_workload
+
+# A tree whose children are forked after the first few rebalances.
+LATE_TREE = {"processes": [
+    {"trace": "io_bound", "pid": 1, "comm": "io_bound", "parent": None,
+     "start_nanos": 0},
+    {"trace": "cpu_bound", "pid": 2, "comm": "cpu_bound", "parent": 0,
+     "start_nanos": 300 * 10 ** 6},
+    {"trace": "bimodal", "pid": 3, "comm": "bimodal", "parent": 0,
+     "start_nanos": 350 * 10 ** 6 + 1},
+]}
+
+WORKLOAD = dict(make_workload([("io_bound", 1)], cpus=4),
+                processes=[{"tree": "late", "quantity": 1},
+                           {"benchmark": "io_bound", "quantity": 1}])
+
+
+class LateForkTest(SimulationTestCase):
+    def setUp(self):
+        super(LateForkTest, self).setUp()
+        with open("./traces/late.tree.json", 'w') as tree_file:
+            json.dump(LATE_TREE, tree_file)
+
+    def test_late_children_run(self):
+        _, procs = self.simulate(WORKLOAD)
+        for p in procs:
+            self.assertGreater(p.state_index, 0, p.name)
+
+    def test_sharded_same_as_single_process(self):
+        self.assertSameRun(self.simulate(WORKLOAD, 2),
+                           self.simulate(WORKLOAD))
+
+
+if __name__ == '__main__':
+    unittest.main()
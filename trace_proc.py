@@ -1,32 +1,62 @@
 #!/usr/bin/python2
+import json
 import os
 import re
+import shutil
 import sys
 import subprocess
+import tempfile
 
 import benchmarks
+from pack_trace import PACK_FILE_FMT, TraceWriter
 
 PERF_DATA = "/tmp/{}/perf.data".format(os.getuid())
 
 PERF_RECORD = "sudo perf record \
 -e sched:sched_switch \
 -e sched:sched_wakeup \
+-e sched:sched_process_fork \
 -e sched:sched_process_exit \
 -a -o {outfile} -- {cmd}"
 
-PERF_SCRIPT = "sudo perf script -i {infile} -F time,event,trace > {outfile}"
-PERF_TRACE = "/tmp/{}/perf.trace".format(os.getuid())
+PERF_SCRIPT = "sudo perf script -i {infile} -F time,event,trace"
 
 WAKE_EVENT = "sched_wakeup"
 SWITCH_EVENT = "sched_switch"
+FORK_EVENT = "sched_process_fork"
+EXIT_EVENT = "sched_process_exit"
 TRACE_DIR = "./traces"
+TREE_FILE_FMT = "./traces/{}.tree.json"
+
+# How many events of a pid to hold in memory before spilling them to disk.
+SPILL_BATCH = 256
+
+SWITCH_RE = re.compile(r"prev_comm=(\S*).*?prev_pid=(\d*).*?prev_state=(\S*)")
+WAKE_RE = re.compile(r"comm=(\S*).*?pid=(\d*)")
+FORK_RE = re.compile(
+    r"comm=(\S*).*?pid=(\d*).*?child_comm=(\S*).*?child_pid=(\d*)")
+EXIT_RE = re.compile(r"comm=(\S*).*?pid=(\d*)")
 
 
 def main(argv):
     _benchmarks = benchmarks.BENCHMARKS
 
-    if len(argv) != 2:
-        print "Usage: ./trace_proc.py <BENCHMARK_NAME>"
+    args = argv[1:]
+    pack = "--pack" in args
+    if pack:
+        args.remove("--pack")
+    tree = "--tree" in args
+    if tree:
+        args.remove("--tree")
+
+    if len(args) != 1:
+        print "Usage: ./trace_proc.py [--pack] [--tree] <BENCHMARK_NAME>"
+        print
+        print "--pack writes a packed trace (see pack_trace.py) instead of a"
+        print "       csv"
+        print "--tree writes a trace for every process and thread of the"
+        print "       benchmark's process tree, and a manifest of the tree"
+        print
         for name, b in _benchmarks.iteritems():
             print "{}:\t{}".format(name, b.benchmark_cmd)
         return
@@ -34,10 +64,10 @@ def main(argv):
     if not os.path.isdir("/tmp/{}".format(os.getuid())):
         os.mkdir("/tmp/{}".format(os.getuid()))
 
-    bench_name = argv[1]
+    bench_name = args[0]
     bench = _benchmarks.get(bench_name, None)
     if bench is None:
-        print "Invalid benchmark name: {}".format(argv[1])
+        print "Invalid benchmark name: {}".format(bench_name)
         return
 
     if bench.preparation_cmd is not None:
@@ -45,74 +75,348 @@ def main(argv):
         subprocess.call(bench.preparation_cmd, shell=True)
 
     perf_record(bench.benchmark_cmd)
-    perf_script()
 
     if not os.path.isdir(TRACE_DIR):
         os.mkdir(TRACE_DIR)
 
-    parse_trace(bench_name, bench.benchmark_cmd, PERF_TRACE)
+    # Parse perf script's output as it's produced, rather than dumping it to
+    # a file first.
+    script = perf_script()
+    try:
+        if tree:
+            parse_tree(bench_name, bench.benchmark_cmd, script.stdout, pack)
+        else:
+            parse_trace(bench_name, bench.benchmark_cmd, script.stdout, pack)
+    finally:
+        # If parsing stopped early, don't leave perf script blocked writing
+        # to a pipe nobody reads.
+        script.stdout.close()
+        status = script.wait()
+
+    # A perf script that failed partway through looks just like a short
+    # trace to the parser.
+    if status != 0:
+        raise RuntimeError("perf script exited with status {}; the trace of "
+                           "{} is incomplete".format(status, bench_name))
+
+
+def parse_trace(bench_name, command, trace, pack=False):
+    """Parse perf script output into csv format, or a packed trace if pack
+    is set.
+
+    The trace is streamed: each of the command's events is spilled to a
+    temporary file for its pid as it's read (see SpillFiles), and only the
+    events of the pid we keep are ever loaded into memory.
+
+    Args
+        command: the command whose events we're interested in tracing.
+        trace: path to a perf.trace file, or a file object (e.g. the stdout
+            of perf script) to read it from.
+    """
+    command_name = os.path.split(command.split()[0])[1]
+    spill_dir = tempfile.mkdtemp(prefix="trace_proc")
+    try:
+        # Map from pid --> number of events. This is here because sometimes
+        # processes fork off children.
+        event_counts = spill_events(trace, command_name, spill_dir)
+        if not event_counts:
+            print "No events captured"
+            return
+
+        # Get the pid with the most events (this is probably the PID we care
+        # about)
+        pid = max(event_counts, key=lambda p: event_counts[p])
+        with open(os.path.join(spill_dir, pid), 'r') as spill_file:
+            event_list = [Event(*line.rstrip("\n").split(","))
+                          for line in spill_file]
+    finally:
+        shutil.rmtree(spill_dir)
+
+    event_list.sort(key=lambda e: e.time)
+    write_trace(bench_name, event_list, event_list[0].time, pack)
+
 
+def parse_tree(bench_name, command, trace, pack=False):
+    """Parse perf script output into a trace for every process (or thread)
+    of command's process tree, and a manifest of the tree.
 
-def parse_trace(bench_name, command, filename):
-    """Parse the perf.trace file into csv format.
+    The tree is every process running the command, and every process forked
+    off one of the tree's, all the way down. A process's trace starts when
+    it's forked (or for one running the command, at its first event), and
+    ends with its last switch away after it exits; a pid that's reused after
+    that is another process. The traces are named BENCH_NAME.0, BENCH_NAME.1
+    and so on, in the order the processes started, and the manifest
+    (./traces/BENCH_NAME.tree.json) lists them with their parents and how
+    long after the tree's start they started.
 
     Args
-        command: the command whose events we're interested in tracing.
-        filename: absolute path to the perf.trace file.
+        command: the command whose process tree we're interested in tracing.
+        trace: path to a perf.trace file, or a file object (e.g. the stdout
+            of perf script) to read it from.
     """
-    # dict of pid -> event list. This is here because sometimes processes fork
-    # off children.
-    events = {}
     command_name = os.path.split(command.split()[0])[1]
-    with open(filename, 'r') as trace_file:
-        for line in trace_file.readlines():
-            # This is a single line of the trace
-            split = [i.strip() for i in line.split(' ') if i.strip()]
+    spill_dir = tempfile.mkdtemp(prefix="trace_proc")
+    try:
+        members = [m for m in spill_tree_events(trace, command_name, spill_dir)
+                   if m.events]
+        if not members:
+            print "No events captured"
+            return
+
+        members.sort(key=lambda m: m.start)
+        numbers = {m.key: i for i, m in enumerate(members)}
+        tree_start = members[0].start
+
+        manifest = []
+        for i, m in enumerate(members):
+            with open(os.path.join(spill_dir, m.key), 'r') as spill_file:
+                event_list = [Event(*line.rstrip("\n").split(","))
+                              for line in spill_file]
+            event_list.sort(key=lambda e: e.time)
+
+            trace_name = "{}.{}".format(bench_name, i)
+            write_trace(trace_name, event_list, m.start, pack)
+            manifest.append({
+                "trace": trace_name,
+                "pid": int(m.pid),
+                "comm": m.comm,
+                "parent": numbers.get(m.parent),
+                "start_nanos": m.start - tree_start,
+            })
+    finally:
+        shutil.rmtree(spill_dir)
+
+    with open(TREE_FILE_FMT.format(bench_name), 'w') as tree_file:
+        json.dump({"processes": manifest}, tree_file, indent=4,
+                  sort_keys=True)
+    print "Traced {} processes".format(len(manifest))
+
+
+def write_trace(trace_name, event_list, start_time, pack=False):
+    """Write event_list, in time order, as trace_name's trace, with times
+    relative to start_time.
+    """
+    if pack:
+        with TraceWriter(PACK_FILE_FMT.format(trace_name)) as writer:
+            for e in event_list:
+                e.normalize_time(start_time)
+                writer.write(e.event_type, e.state, e.time)
+        return
 
-            raw_ts, raw_event = split[:2]
-            event = raw_event.split(":")[1].strip()
-            ts = raw_ts.split(":")[0].strip()
-            trace = " ".join(split[2:])
-            state = trace.split("=")[0].split()[-1]
+    with open('./traces/{}.trace.csv'.format(trace_name), 'w') as outfile:
+        for e in event_list:
+            e.normalize_time(start_time)
+            line_out = ','.join([e.event_type, e.state, str(e.time)])
+            outfile.write(line_out + "\n")
 
-            cmd = None
-            if event == SWITCH_EVENT:
-                cmd = re.search("prev_comm=(\S*)", trace).group(1)
-                pid = re.search("prev_pid=(\d*)", trace).group(1)
-                state = re.search("prev_state=(\S*)", trace).group(1)
 
-            elif event == WAKE_EVENT:
-                cmd = re.search("comm=(\S*)", trace).group(1)
-                pid = re.search("pid=(\d*)", trace).group(1)
-                state = ""
+def spill_events(trace, command_name, spill_dir):
+    """Write command_name's events to one file per pid in spill_dir.
 
-            # If this line of the trace is not the command we're interested
-            # in, skip it.
-            if cmd != command_name:
-                continue
+    Return a map from pid --> number of events spilled for it.
+    """
+    spill_files = SpillFiles(spill_dir)
+    event_counts = {}
+    for pid, event, state, ts in iter_events(trace, command_name):
+        spill_files.write(pid, "{},{},{}\n".format(event, ts, state))
+        event_counts[pid] = event_counts.get(pid, 0) + 1
+    spill_files.flush_all()
+    return event_counts
+
+
+class SpillFiles(object):
+    """Spills lines to a file per key in spill_dir, a batch at a time.
+
+    A system-wide capture can have thousands of pids, too many to keep a
+    file open for each. Instead, up to SPILL_BATCH lines per key are held in
+    memory, and appended to the key's file in one go, so only one file is
+    ever open at a time.
+    """
+    def __init__(self, spill_dir):
+        self.spill_dir = spill_dir
 
-            events.setdefault(pid, []).append(Event(event, ts, state, trace))
+        # Map from key --> lines not yet written to its file.
+        self.batches = {}
 
-    if not events:
-        print "No events captured"
-        return
+    def write(self, key, line):
+        batch = self.batches.setdefault(key, [])
+        batch.append(line)
+        if len(batch) >= SPILL_BATCH:
+            self.flush(key)
 
-    event_list = []
+    def flush(self, key):
+        """Write out key's pending lines."""
+        batch = self.batches.pop(key, None)
+        if batch:
+            with open(os.path.join(self.spill_dir, key), 'a') as spill_file:
+                spill_file.writelines(batch)
 
-    # Get the longest list of events (this is probably the PID we care about)
-    for pid, elist in events.iteritems():
-        if len(elist) > len(event_list):
-            event_list = elist
+    def flush_all(self):
+        for key in self.batches.keys():
+            self.flush(key)
 
-    event_list.sort(key=lambda e: e.time)
 
-    start_time = event_list[0].time
+class TreeMember(object):
+    """A process of the traced tree, from its fork to its exit."""
+    __slots__ = ["key", "pid", "comm", "parent", "start", "events",
+                 "exiting"]
 
-    with open('./traces/{}.trace.csv'.format(bench_name), 'w') as outfile:
-        for e in event_list:
-            e.normalize_time(start_time)
-            line_out = ','.join([e.event_type, e.state, str(e.time)])
-            outfile.write(line_out + "\n")
+    def __init__(self, key, pid, comm, parent, start):
+        # The name of its spill file; unlike the pid, it's never reused.
+        self.key = key
+        self.pid = pid
+        self.comm = comm
+
+        # The key of the member that forked it, or None.
+        self.parent = parent
+
+        # When it started, in nanos.
+        self.start = start
+        self.events = 0
+
+        # Whether it has exited, and only its last switch away is to come.
+        self.exiting = False
+
+
+def spill_tree_events(trace, command_name, spill_dir):
+    """Write the events of command_name's process tree to one file per
+    process in spill_dir.
+
+    Return the list of TreeMembers, in the order they were first seen.
+    """
+    members = []
+
+    # Map from pid --> the member it belongs to right now.
+    live = {}
+    spill_files = SpillFiles(spill_dir)
+    for cmd, pid, event, state, ts, child in iter_all_events(trace):
+        member = live.get(pid)
+
+        if event == FORK_EVENT:
+            if member is not None:
+                child_comm, child_pid = child
+                live[child_pid] = TreeMember(
+                    "{}.{}".format(child_pid, len(members)), child_pid,
+                    child_comm, member.key, to_nanos(ts))
+                members.append(live[child_pid])
+            continue
+
+        if event == EXIT_EVENT:
+            if member is not None:
+                member.exiting = True
+            continue
+
+        if member is None:
+            if cmd != command_name:
+                continue
+            # Another process running the command itself.
+            member = live[pid] = TreeMember(
+                "{}.{}".format(pid, len(members)), pid, cmd, None,
+                to_nanos(ts))
+            members.append(member)
+
+        # Forked children usually exec something else afterwards.
+        member.comm = cmd
+
+        spill_files.write(member.key, "{},{},{}\n".format(event, ts, state))
+        member.events += 1
+
+        # Once it has switched away for the last time, the pid is free,
+        # and the member has no more events to come.
+        if (member.exiting and event == SWITCH_EVENT and
+                not state.startswith("R")):
+            del live[pid]
+            spill_files.flush(member.key)
+    spill_files.flush_all()
+    return members
+
+
+def iter_all_events(trace):
+    """Yield (comm, pid, event, state, timestamp, child) for every switch,
+    wakeup, fork and exit in the trace. child is the (comm, pid) of the
+    child for forks, and None otherwise.
+    """
+    trace_file = open(trace, 'r') if isinstance(trace, basestring) else trace
+    try:
+        for line in trace_file:
+            parsed = parse_line(line)
+            if parsed is not None:
+                yield parsed
+    finally:
+        if trace_file is not trace:
+            trace_file.close()
+
+
+def parse_line(line):
+    """Parse a single line of the trace as iter_all_events() yields it, or
+    return None if it isn't an event we care about.
+    """
+    raw_ts, raw_event, trace_text = line.split(None, 2)
+    event = raw_event.split(":")[1].strip()
+    child = None
+
+    if event == SWITCH_EVENT:
+        match = SWITCH_RE.search(trace_text)
+        if match is None:
+            return None
+        cmd, pid, state = match.groups()
+
+    elif event == WAKE_EVENT:
+        match = WAKE_RE.search(trace_text)
+        if match is None:
+            return None
+        cmd, pid = match.groups()
+        state = ""
+
+    elif event == FORK_EVENT:
+        match = FORK_RE.search(trace_text)
+        if match is None:
+            return None
+        cmd, pid, child_comm, child_pid = match.groups()
+        child = (child_comm, child_pid)
+        state = ""
+
+    elif event == EXIT_EVENT:
+        match = EXIT_RE.search(trace_text)
+        if match is None:
+            return None
+        cmd, pid = match.groups()
+        state = ""
+
+    else:
+        return None
+
+    return cmd, pid, event, state, raw_ts.split(":")[0], child
+
+
+def iter_events(trace, command_name):
+    """Yield (pid, event, state, timestamp) for command_name's events."""
+    trace_file = open(trace, 'r') if isinstance(trace, basestring) else trace
+    try:
+        # Every event we care about names the command as comm= or
+        # prev_comm=, which lets us skip most lines without splitting them.
+        needle = "=" + command_name
+        for line in trace_file:
+            if needle not in line:
+                continue
+
+            # This is a single line of the trace
+            parsed = parse_line(line)
+            if parsed is None:
+                continue
+            cmd, pid, event, state, ts, _ = parsed
+            if event not in (SWITCH_EVENT, WAKE_EVENT):
+                continue
+
+            # If this line of the trace is not the command we're interested
+            # in, skip it.
+            if cmd != command_name:
+                continue
+
+            yield pid, event, state, ts
+    finally:
+        if trace_file is not trace:
+            trace_file.close()
 
 
 def perf_record(cmd):
@@ -125,22 +429,28 @@ def perf_record(cmd):
 
 def perf_script():
     # Perf will dump traces to the perf.data file. We must convert the entries
-    # into a format that we can parse.
-    subprocess.call(
-        PERF_SCRIPT.format(infile=PERF_DATA, outfile=PERF_TRACE),
-        shell=True)
+    # into a format that we can parse. Return the running perf script, whose
+    # stdout is a pipe of converted entries.
+    return subprocess.Popen(
+        PERF_SCRIPT.format(infile=PERF_DATA),
+        shell=True,
+        stdout=subprocess.PIPE)
+
+
+def to_nanos(ts):
+    """Convert a timestamp in seconds, as perf prints it, to nanos."""
+    return int(float(ts) * (10 ** 9))
 
 
 class Event(object):
+    __slots__ = ["event_type", "time", "state"]
 
-    def __init__(self, event_type, time, state, trace):
+    def __init__(self, event_type, time, state):
         self.event_type = event_type
 
-        # Convert the end timestamp (which is now in seconds) to nanos
-        self.time = int(float(time) * (10 ** 9))
+        self.time = to_nanos(time)
 
         self.state = state
-        self.trace = trace
 
     def normalize_time(self, time):
         """Make times relative to 0."""
@@ -0,0 +1,70 @@
+"""CFS load weights for nice levels, from the kernel's kernel/sched/core.c.
+
+A nice 0 process weighs NICE_0_LOAD. Each nice level up or down changes a
+process's weight by about 25%, so that it gets about 10% less or more of the
+CPU than a process one level away. The inverse weights are 2**32 / weight, so
+that dividing by a weight is a multiply and a shift.
+"""
+MIN_NICE = -20
+MAX_NICE = 19
+
+NICE_0_LOAD = 1024
+WMULT_SHIFT = 32
+
+SCHED_PRIO_TO_WEIGHT = [
+    # -20
+    88761, 71755, 56483, 46273, 36291,
+    # -15
+    29154, 23254, 18705, 14949, 11916,
+    # -10
+    9548, 7620, 6100, 4904, 3906,
+    # -5
+    3121, 2501, 1991, 1586, 1277,
+    # 0
+    1024, 820, 655, 526, 423,
+    # 5
+    335, 272, 215, 172, 137,
+    # 10
+    110, 87, 70, 56, 45,
+    # 15
+    36, 29, 23, 18, 15,
+]
+
+SCHED_PRIO_TO_WMULT = [
+    # -20
+    48388, 59856, 76040, 92818, 118348,
+    # -15
+    147320, 184698, 229616, 287308, 360437,
+    # -10
+    449829, 563644, 704093, 875809, 1099582,
+    # -5
+    1376151, 1717300, 2157191, 2708050, 3363326,
+    # 0
+    4194304, 5237765, 6557202, 8165337, 10153587,
+    # 5
+    12820798, 15790321, 19976592, 24970740, 31350126,
+    # 10
+    39045157, 49367440, 61356676, 76695844, 95443717,
+    # 15
+    119304647, 148102320, 186737708, 238609294, 286331153,
+]
+
+
+def nice_to_weight(nice):
+    """Return the (weight, inverse weight) of a process at nice level nice."""
+    if not MIN_NICE <= nice <= MAX_NICE:
+        raise ValueError("Nice levels go from {} to {}, not {}".format(
+            MIN_NICE, MAX_NICE, nice))
+    return (SCHED_PRIO_TO_WEIGHT[nice - MIN_NICE],
+            SCHED_PRIO_TO_WMULT[nice - MIN_NICE])
+
+
+def calc_delta_fair(delta, weight, inv_weight):
+    """Scale delta nanos of runtime to vruntime, for a process of weight.
+
+    vruntime runs slower than real time for processes heavier than nice 0,
+    and faster for lighter ones. At nice 0, it's real time exactly.
+    """
+    if weight == NICE_0_LOAD:
+        return delta
+    return (delta * NICE_0_LOAD * inv_weight) >> WMULT_SHIFT